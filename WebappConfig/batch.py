@@ -0,0 +1,299 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Runs a list of install, clean and upgrade operations from a single
+webapp-config process.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import copy, json, os, os.path, sys, tempfile, time
+
+from WebappConfig.debug  import OUT
+from WebappConfig.daemon import Daemon
+
+# ========================================================================
+# Operations
+# ------------------------------------------------------------------------
+
+# The command line switch for each action
+ACTIONS = {'install' : '-I',
+           'clean'   : '-C',
+           'upgrade' : '-U'}
+
+class Operation:
+    '''
+    A single line of the batch file:
+
+      {"action": "install", "package": "www-apps/horde",
+       "version": "3.0.5", "host": "www.example.com", "dir": "/horde"}
+
+    "host" and "dir" default to the configured host name and the
+    package name. "secure" selects htdocs-secure. Additional command
+    line arguments (e.g. ["-s", "nginx"]) can be given as "args".
+    '''
+
+    def __init__(self, line, data):
+
+        self.line    = line
+        self.error   = ''
+        self.key     = None
+        self.device  = None
+        self.status  = None
+        self.seconds = 0
+        self.output  = ''
+        self.capture = None
+
+        if not isinstance(data, dict):
+            data = {}
+            self.error = 'Expected an object'
+
+        self.action  = data.get('action', '')
+        self.package = data.get('package', '')
+        self.version = data.get('version', '')
+        self.host    = data.get('host', '')
+        self.dir     = data.get('dir', '')
+        self.secure  = bool(data.get('secure', False))
+        self.args    = data.get('args', [])
+
+        if self.error:
+            return
+
+        if not self.action in ACTIONS:
+            self.error = 'Unknown action "' + str(self.action) + '"'
+        elif not self.package or not self.version:
+            self.error = 'Package and version are required'
+        elif (not isinstance(self.args, list) or
+              [i for i in self.args if not isinstance(i, str)]):
+            self.error = '"args" must be a list of strings'
+
+    def argv(self):
+        ''' The webapp-config command line for this operation.'''
+        argv = [ACTIONS[self.action], self.package, self.version]
+        if self.host:
+            argv += ['-h', self.host]
+        if self.dir:
+            argv += ['-d', self.dir]
+        if self.secure:
+            argv += ['-S']
+        return argv + self.args
+
+    def record(self):
+        ''' The result of this operation.'''
+        result = {'line'    : self.line,
+                  'action'  : self.action,
+                  'package' : self.package,
+                  'version' : self.version,
+                  'host'    : self.host,
+                  'dir'     : self.dir}
+        if self.key:
+            result['installdir'] = self.key
+        if self.error:
+            result['error'] = self.error
+        else:
+            result['status']  = self.status
+            result['seconds'] = round(self.seconds, 3)
+            result['output']  = self.output
+        return result
+
+def read_operations(f):
+    ''' Read the operations from a file with one JSON object per line.'''
+    operations = []
+    for n, line in enumerate(f):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as e:
+            operation = Operation(n + 1, {})
+            operation.error = 'Invalid JSON: ' + str(e)
+        else:
+            operation = Operation(n + 1, data)
+        operations.append(operation)
+    return operations
+
+# ========================================================================
+# Scheduler
+# ------------------------------------------------------------------------
+
+class Batch:
+    '''
+    Runs the operations of a batch file. All caches are loaded once
+    (see WebappConfig.daemon) and each operation runs in a forked
+    child, at most "jobs" at a time and at most "jobs_per_fs" on the
+    same filesystem. Operations on the same install directory run one
+    after the other in the order of the file.
+    '''
+
+    def __init__(self, config, jobs = 0, jobs_per_fs = 0):
+
+        if not jobs:
+            jobs = (hasattr(os, 'sched_getaffinity') and
+                    len(os.sched_getaffinity(0)) or 1)
+
+        self.config      = config
+        self.jobs        = jobs
+        self.jobs_per_fs = jobs_per_fs or jobs
+        self.__daemon    = Daemon(config)
+
+    def installdir(self, operation):
+        '''
+        Determine the install directory of an operation the same way
+        Config.setinstalldir() does. The host and htdocs base of the
+        operation are set on a copy of the configuration.
+        '''
+        config        = copy.copy(self.config)
+        config.config = copy.deepcopy(self.config.config)
+
+        if operation.host:
+            config.config.set('USER', 'vhost_hostname', operation.host)
+        if operation.secure or '-S' in operation.args or \
+           '--secure' in operation.args:
+            config.config.set('USER', 'my_htdocsbase', '${vhost_htdocs_secure}')
+        else:
+            config.config.set('USER', 'my_htdocsbase',
+                              '${vhost_htdocs_insecure}')
+
+        return config.installpath(operation.dir or
+                                  operation.package.split('/')[-1])
+
+    def device(self, path):
+        ''' The filesystem of the (nearest existing parent of the) path.'''
+        while True:
+            try:
+                return os.stat(path).st_dev
+            except OSError:
+                if path in ['/', '']:
+                    return None
+                path = os.path.dirname(path)
+
+    def run(self, filename):
+        ''' Run the operations of a batch file. Returns the exit status.'''
+        try:
+            if filename == '-':
+                operations = read_operations(sys.stdin)
+            else:
+                f = open(filename)
+                operations = read_operations(f)
+                f.close()
+        except (IOError, OSError) as e:
+            OUT.die('Unable to read the batch file ' + filename + ': '
+                    + str(e))
+
+        self.__daemon.warm()
+
+        for i in operations:
+            if not i.error:
+                i.key    = self.installdir(i)
+                i.device = self.device(i.key)
+
+        pending = []
+        for i in operations:
+            if i.error:
+                self.report(i)
+            else:
+                pending.append(i)
+
+        start   = time.time()
+        running = {}
+        failed  = len(operations) - len(pending)
+
+        while pending or running:
+
+            # Start as many operations as allowed. An operation may not
+            # overtake an earlier one on the same install directory.
+            busy    = set([i.key for i in running.values()])
+            devices = [i.device for i in running.values()]
+            for i in list(pending):
+                if len(running) >= self.jobs:
+                    break
+                if (not i.key in busy and
+                    devices.count(i.device) < self.jobs_per_fs):
+                    pending.remove(i)
+                    running[self.start(i)] = i
+                    devices.append(i.device)
+                busy.add(i.key)
+
+            pid, status = os.wait()
+            if not pid in running:
+                continue
+
+            operation = running.pop(pid)
+            self.finish(operation, status)
+            if operation.status:
+                failed += 1
+            self.report(operation)
+
+        # The summary is the last record so that stdout remains JSON
+        print(json.dumps({'operations' : len(operations),
+                          'failed'     : failed,
+                          'seconds'    : round(time.time() - start, 3)},
+                         sort_keys = True))
+        sys.stdout.flush()
+
+        return failed and 1 or 0
+
+    def start(self, operation):
+        ''' Fork a child running the operation. Returns its pid.'''
+        umask = os.umask(0)
+        os.umask(umask)
+
+        request = {'argv'  : [sys.argv[0]] + operation.argv(),
+                   'cwd'   : os.getcwd(),
+                   'env'   : dict(os.environ),
+                   'umask' : umask}
+
+        operation.capture = tempfile.TemporaryFile()
+        operation.seconds = time.time()
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        pid = os.fork()
+        if pid == 0:
+            status = 1
+            try:
+                null   = os.open(os.devnull, os.O_RDONLY)
+                out    = operation.capture.fileno()
+                status = self.__daemon.execute(request,
+                                               [null, os.dup(out), out])
+            finally:
+                os._exit(status)
+
+        return pid
+
+    def finish(self, operation, status):
+        ''' Collect the results of a finished child.'''
+        operation.seconds = time.time() - operation.seconds
+
+        if os.WIFEXITED(status):
+            operation.status = os.WEXITSTATUS(status)
+        else:
+            operation.status = 128 + os.WTERMSIG(status)
+
+        operation.capture.seek(0)
+        operation.output = operation.capture.read().decode('utf-8', 'replace')
+        operation.capture.close()
+        operation.capture = None
+
+    def report(self, operation):
+        ''' Print the result of an operation as soon as it is known.'''
+        print(json.dumps(operation.record(), sort_keys = True))
+        sys.stdout.flush()
@@ -0,0 +1,319 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-cleaner
+#       Python script for removing obsolete and unused versions of
+#       web-based applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Finds the versions of web applications in /usr/share/webapps that
+can be removed because a newer version exists (prune) or because they
+have not been installed into a virtual host (clean unused).  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import json, os, os.path, subprocess, sys
+
+from WebappConfig.debug import OUT
+from WebappConfig.vdb   import vercmp
+
+# ========================================================================
+# Inventory
+# ------------------------------------------------------------------------
+
+# The command removing the candidates
+EMERGE = ['emerge', '-Cav']
+
+class Package:
+    '''
+    The versions of a web application available in /usr/share/webapps
+    and the number of virtual installs of each version.
+
+    >>> p = Package('www-apps', 'gallery')
+    >>> for i in ['2.0_rc2', '1.4.4_p6', '2.0', '10.1']:
+    ...     p.add_version(i)
+    >>> p.add_install('2.0')
+    >>> p.versions
+    ['1.4.4_p6', '2.0_rc2', '2.0', '10.1']
+    >>> p.best(), p.prune(), p.unused()
+    ('10.1', ['1.4.4_p6', '2.0_rc2', '2.0'], ['1.4.4_p6', '2.0_rc2', '10.1'])
+    >>> p.atoms(p.prune())
+    ['=www-apps/gallery-1.4.4_p6', '=www-apps/gallery-2.0_rc2', '=www-apps/gallery-2.0']
+    '''
+
+    def __init__(self, category, package):
+
+        self.category = category
+        self.pn       = package
+
+        # Valid versions, oldest first
+        self.versions = []
+
+        # Versions that are no Gentoo versions. They are never removed.
+        self.invalid  = []
+
+        # Number of virtual installs by version
+        self.installs = {}
+
+    def name(self):
+        ''' CATEGORY/PN or PN for the old layout.'''
+        if self.category:
+            return self.category + '/' + self.pn
+        return self.pn
+
+    def add_version(self, version):
+        ''' Insert an available version.'''
+        try:
+            position = 0
+            for i in self.versions:
+                if vercmp(version, i) < 0:
+                    break
+                position += 1
+        except ValueError:
+            OUT.warn('Ignoring ' + self.name() + ' with invalid version "'
+                     + version + '"')
+            self.invalid.append(version)
+            return
+
+        self.versions.insert(position, version)
+
+    def add_install(self, version):
+        ''' Count a virtual install.'''
+        self.installs[version] = self.installs.get(version, 0) + 1
+
+    def best(self):
+        ''' The latest version.'''
+        if self.versions:
+            return self.versions[-1]
+
+    def prune(self):
+        ''' All versions but the latest one.'''
+        return self.versions[:-1]
+
+    def unused(self):
+        ''' All versions without virtual installs.'''
+        return [i for i in self.versions if not self.installs.get(i)]
+
+    def atoms(self, versions):
+        ''' The atoms selecting the given versions.'''
+        return ['=' + self.name() + '-' + i for i in versions]
+
+    def record(self):
+        ''' The inventory of the package as a dictionary.'''
+        return {'cat'      : self.category,
+                'pn'       : self.pn,
+                'versions' : self.versions,
+                'invalid'  : self.invalid,
+                'installs' : dict((i, self.installs.get(i, 0))
+                                  for i in self.versions),
+                'best'     : self.best(),
+                'prune'    : self.prune(),
+                'unused'   : self.unused()}
+
+def inventory(source, db):
+    '''
+    Collect all packages with their versions and installs. Both
+    hierarchies are read in a single pass each.
+
+    The old layout (/usr/share/webapps/PN/PVR) is reported without a
+    category.
+    '''
+
+    def category(cat, root):
+        if cat == os.path.basename(root):
+            return ''
+        return cat
+
+    packages = {}
+
+    OUT.debug('Collecting available versions', 7)
+
+    for location, (cat, pn, pvr) in source.iter_locations():
+        key = (category(cat, source.root), pn)
+        if not key in packages:
+            packages[key] = Package(key[0], pn)
+        packages[key].add_version(pvr)
+
+    OUT.debug('Collecting virtual installs', 7)
+
+    for record in db.iter_installs():
+        key = (category(record['cat'], db.root), record['pn'])
+        if not key in packages and key[0]:
+            # Installed from the old layout before the category was known
+            key = ('', key[1])
+        if key in packages:
+            packages[key].add_install(record['pvr'])
+
+    return [packages[i] for i in sorted(packages)]
+
+def select(packages, names):
+    '''
+    The packages matching one of the names (CATEGORY/PN or PN). All
+    packages if no names are given.
+    '''
+    if not names:
+        return packages
+
+    result = []
+    for name in names:
+        matches = [i for i in packages if name in (i.name(), i.pn)]
+        if not matches:
+            OUT.die(name + ' not found')
+        result += [i for i in matches if not i in result]
+    return result
+
+def candidates(packages, action):
+    ''' The atoms to remove for the action ("prune" or "clean_unused").'''
+    result = []
+    for package in packages:
+        if action == 'prune':
+            result += package.atoms(package.prune())
+        else:
+            result += package.atoms(package.unused())
+    return result
+
+def write_json(packages, out = None):
+    ''' Write the inventory and the candidates as a JSON document.'''
+    out = out or sys.stdout
+    json.dump({'packages'     : [i.record() for i in packages],
+               'prune'        : candidates(packages, 'prune'),
+               'clean_unused' : candidates(packages, 'clean_unused')},
+              out, indent = 2, sort_keys = True)
+    out.write('\n')
+
+# ========================================================================
+# Main program
+# ------------------------------------------------------------------------
+
+def setup_parser():
+
+    from argparse import ArgumentParser, SUPPRESS
+
+    parser = ArgumentParser(
+        usage = '%(prog)s [options] [action] [CATEGORY/PN ...]',
+        description = 'Remove obsolete and unused versions of web applicat'
+        'ions. Removing versions of all packages requires --all. If multipl'
+        'e actions are given, only the action specified last will be execut'
+        'ed.')
+
+    parser.add_argument('packages', nargs = '*', metavar = 'CATEGORY/PN',
+                        help = SUPPRESS)
+
+    parser.add_argument('-p', '--pretend', action = 'store_true',
+                        help = 'Instead of cleaning, simply show the comman'
+                        'ds to be executed')
+
+    parser.add_argument('-P', '--prune', action = 'store_const',
+                        dest = 'action', const = 'prune',
+                        help = 'Removes all but the latest version of a pac'
+                        'kage. Similar to emerge --prune')
+
+    parser.add_argument('-C', '--clean-unused', action = 'store_const',
+                        dest = 'action', const = 'clean_unused',
+                        help = 'Removes all versions of a web application t'
+                        'hat have not been installed into a virtual host')
+
+    parser.add_argument('-j', '--json', action = 'store_const',
+                        dest = 'action', const = 'json',
+                        help = 'Print the available versions, the virtual i'
+                        'nstalls and the candidates of both actions as JSON'
+                        ' instead of cleaning')
+
+    parser.add_argument('-a', '--all', action = 'store_true',
+                        help = 'Clean all packages instead of those named o'
+                        'n the command line. --json always reports all pac'
+                        'kages unless names are given')
+
+    parser.add_argument('-D', '--define', action = 'append',
+                        help = 'Allows to name a <KEY>=<VALUE> pair that wi'
+                        'll be imported into the configuration variables of'
+                        ' webapp-config (e.g. my_approot)')
+
+    return parser
+
+def main(argv = None):
+    '''
+    Main program call.
+    '''
+    from WebappConfig.config import Config
+    from WebappConfig.db     import WebappDB, WebappSource
+    import WebappConfig.wrapper as wrapper
+
+    if argv is None:
+        argv = sys.argv[1:]
+
+    parser  = setup_parser()
+    options = parser.parse_args(argv)
+
+    if not argv:
+        parser.print_help()
+        return 0
+
+    if not options.action:
+        OUT.die('Please specify a valid action')
+
+    if (options.action != 'json' and
+        not options.packages and not options.all):
+        OUT.die('Please specify a web application to be cleaned or --all')
+
+    # Locate both hierarchies the way webapp-config does
+
+    config = Config()
+
+    if not os.access(config.maybe_get('my_etcconfig'), os.R_OK):
+        OUT.die('The configuration file ' + config.maybe_get('my_etcconfig')
+                + ' is not accessible!')
+
+    config.read_config()
+
+    for i in options.define or []:
+        if '=' in i:
+            config.config.set('USER', i.split('=')[0].lower(),
+                              i.split('=', 1)[1])
+
+    root     = wrapper.get_root(config)
+    source   = WebappSource(root, config.maybe_get('my_approot'))
+    db       = WebappDB(root, config.maybe_get('my_persistroot'),
+                        installs = config.maybe_get('wa_installsbase'))
+
+    packages = select(inventory(source, db), options.packages)
+
+    if options.action == 'json':
+        write_json(packages)
+        return 0
+
+    atoms = candidates(packages, options.action)
+
+    if not atoms:
+        OUT.info('Nothing to clean')
+        return 0
+
+    command = ' '.join(EMERGE + atoms)
+
+    if options.action == 'prune':
+        OUT.info('Multiple versions detected.')
+    else:
+        OUT.info('Unused versions detected.')
+
+    if options.pretend:
+        OUT.info('To clean, run the following command:')
+        OUT.info(command)
+        return 0
+
+    OUT.info('Running ' + command)
+
+    return subprocess.call(EMERGE + atoms)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -19,7 +19,7 @@
 # Dependencies
 # ------------------------------------------------------------------------
 
-import sys, os, os.path, re, socket, time
+import sys, os, os.path, re, time, json
 
 if sys.hexversion >= 0x3000000:
     # Python 3
@@ -31,17 +31,20 @@ else:
     import ConfigParser as configparser
     from ConfigParser import SafeConfigParser as configparser_ConfigParser
 
-import WebappConfig.server
 import WebappConfig.permissions as Perm
 import WebappConfig.wrapper as wrapper
 
-from argparse             import ArgumentParser
 from WebappConfig.debug   import OUT
 from WebappConfig.eprefix import EPREFIX
+from WebappConfig.events  import EVENTS
+from WebappConfig.metrics import METRICS
+from WebappConfig.profiler import PROFILE
 from WebappConfig.version import WCVERSION
 
 from WebappConfig.permissions import PermissionMap
 
+# Bump this whenever the layout of the configuration cache changes
+CONFIG_CACHE_VERSION = 1
 
 # ========================================================================
 # BashParser class
@@ -51,8 +54,19 @@ class BashConfigParser(configparser_ConfigParser):
 
     _interpvar_match = re.compile(r"(%\(([^)]+)\)s|\$\{([^}]+)\})").match
 
+    # Splits a value into literal text and variable references
+    _split_references = re.compile(r"\$\{([^}:]+)\}").split
+
+    # Finds the variables a value refers to
+    _reference = re.compile(r"%\(([^)]+)\)s|\$\{([^}]+)\}")
+
     def __init__(self, defaults=None):
         self.error_action = 1
+        # Memoized values of the USER section together with the options
+        # they depend on and, for each option, the values that depend
+        # on it
+        self.__values     = {}
+        self.__dependents = {}
         if sys.hexversion >= 0x3000000:
             configparser_ConfigParser.__init__(self, defaults, interpolation=ExtendedInterpolation())
         else:
@@ -62,8 +76,14 @@ class BashConfigParser(configparser_ConfigParser):
         self.error_action = action
 
     def get(self, section, option, *args, **kwargs):
+        memoize = section == 'USER' and not args and not kwargs
+        if memoize:
+            option = self.optionxform(option)
+            value  = self.__interpolate(option, 0)
+            if value is not None:
+                return value
         try:
-            return configparser_ConfigParser.get(self, section, option, *args, **kwargs)
+            value = configparser_ConfigParser.get(self, section, option, *args, **kwargs)
         except Exception as e:
             error = '\nThere is a problem with your configuration file or' \
                 ' an environment variable.\n' \
@@ -77,6 +97,139 @@ class BashConfigParser(configparser_ConfigParser):
             elif self.error_action == 1:
                 OUT.warn(error)
             return ''
+        if memoize:
+            self.__memoize(option, value,
+                           self.dependencies(option, self.__raw_values()))
+        return value
+
+    def set(self, section, option, value = None):
+        configparser_ConfigParser.set(self, section, option, value)
+        self.invalidate(self.optionxform(option))
+
+    def remove_option(self, section, option):
+        result = configparser_ConfigParser.remove_option(self, section, option)
+        self.invalidate(self.optionxform(option))
+        return result
+
+    def invalidate(self, option):
+        ''' Drop the memoized values that depend on the given option.'''
+        self.__values.pop(option, None)
+        for i in self.__dependents.pop(option, ()):
+            self.__values.pop(i, None)
+
+    def __memoize(self, option, value, deps):
+        ''' Remember the interpolated value of an option.'''
+        self.__values[option] = (value, deps)
+        for i in deps:
+            self.__dependents.setdefault(i, set()).add(option)
+
+    def __raw_values(self):
+        ''' Return all raw values visible in the USER section.'''
+        raw = dict(self.defaults())
+        raw.update([(k, v) for k, v in self._sections['USER'].items()
+                    if not k.startswith('__')])
+        return raw
+
+    def __raw(self, option):
+        ''' Return the raw value of an option of the USER section.'''
+        section = self._sections.get('USER', {})
+        if option in section:
+            return section[option]
+        return self.defaults().get(option)
+
+    def __interpolate(self, option, depth):
+        '''
+        Return the interpolated value of an option of the USER section.
+        Referenced options are interpolated (and memoized) first, so
+        each option is only interpolated once until one of its
+        dependencies changes.
+
+        Returns None for anything beyond plain ${option} references
+        (escapes, other sections, errors). The caller falls back to
+        the regular interpolation in that case.
+        '''
+        memo = self.__values.get(option)
+        if memo is not None:
+            return memo[0]
+
+        raw = self.__raw(option)
+        if (raw is None or not isinstance(raw, str) or
+            depth > configparser.MAX_INTERPOLATION_DEPTH):
+            return None
+
+        parts = self._split_references(raw)
+        deps  = set()
+
+        for i in range(0, len(parts), 2):
+            if '$' in parts[i] or '%' in parts[i]:
+                return None
+
+        for i in range(1, len(parts), 2):
+            ref   = self.optionxform(parts[i])
+            value = self.__interpolate(ref, depth + 1)
+            if value is None:
+                return None
+            parts[i] = value
+            deps.add(ref)
+            deps.update(self.__values[ref][1])
+
+        value = ''.join(parts)
+        self.__memoize(option, value, deps)
+        return value
+
+    def dependencies(self, option, raw):
+        ''' Return all options the value of "option" refers to, directly
+        or indirectly.'''
+        deps  = set()
+        queue = [option]
+        while queue:
+            value = raw.get(queue.pop())
+            if not value:
+                continue
+            for m in self._reference.finditer(value):
+                dep = self.optionxform(m.group(1) or m.group(2))
+                if not dep in deps:
+                    deps.add(dep)
+                    queue.append(dep)
+        return deps
+
+    def take_snapshot(self):
+        '''
+        Return the raw values of the USER section together with all
+        values that can be fully interpolated and the options they
+        depend on. The result can be stored as JSON.
+        '''
+        section = dict([(k, v) for k, v in self._sections['USER'].items()
+                        if not k.startswith('__')])
+
+        values = {}
+        for option in self.__raw_values():
+            value = self.__interpolate(option, 0)
+            if value is None:
+                try:
+                    value = configparser_ConfigParser.get(self, 'USER', option)
+                except Exception:
+                    continue
+                self.__memoize(option, value,
+                               self.dependencies(option, self.__raw_values()))
+            values[option] = [value, sorted(self.__values[option][1])]
+
+        return {'section' : section,
+                'values'  : values}
+
+    def use_snapshot(self, snapshot):
+        ''' Load a snapshot returned by take_snapshot().'''
+        self._sections['USER'].update(snapshot['section'])
+        self.__values     = {}
+        self.__dependents = {}
+        for k, v in snapshot['values'].items():
+            self.__memoize(k, v[0], set(v[1]))
+
+    def _read(self, fp, fpname):
+        # Values read from a file replace everything memoized so far
+        self.__values     = {}
+        self.__dependents = {}
+        self.__read(fp, fpname)
 
     def _interpolate_some(self, option, accum, rest, section, map, depth):
         if depth > configparser.MAX_INTERPOLATION_DEPTH:
@@ -133,7 +286,7 @@ class BashConfigParser(configparser_ConfigParser):
         r'(?P<value>.*)$'                     # everything up to eol
         )
 
-    def _read(self, fp, fpname):
+    def __read(self, fp, fpname):
         """Parse a sectioned setup file.
 
         The sections in setup file contains a title line at the top,
@@ -216,12 +369,6 @@ class Config:
 
         ## These are the webapp-config default configuration values.
 
-        hostname = 'localhost'
-        try:
-            hostname = socket.gethostbyaddr(socket.gethostname())[0]
-        except:
-            pass
-
         self.__d = {
             'config_protect'               : '',
             # Necessary to load the config file
@@ -239,7 +386,10 @@ class Config:
             'g_perms_dotconfig'            : '0600',
             # USER section (only 'get' these variables from
             # the USER section)
-            'vhost_hostname'               : hostname,
+            #
+            # Resolving the host name may be slow. It is only done in
+            # parseparams() if the configuration file does not set it.
+            'vhost_hostname'               : '',
             'vhost_server'                 : 'apache',
             'vhost_default_uid'            : '0',
             'vhost_default_gid'            : '0',
@@ -268,6 +418,8 @@ class Config:
             'vhost_server_uid'  : 'root',
             'vhost_server_gid'  : 'root',
             'my_persistroot'    : EPREFIX + '/var/db/webapps',
+            'my_cachedir'       : EPREFIX + '/var/cache/webapp-config',
+            'g_socket'          : EPREFIX + '/run/webapp-config.socket',
             'wa_installsbase'   : 'installs',
             'vhost_root'        : EPREFIX + '/var/www/${vhost_hostname}',
             'g_htdocsdir'       : '${vhost_root}/${my_htdocsbase}',
@@ -301,13 +453,17 @@ class Config:
         self.config = BashConfigParser(self.__d)
         self.config.add_section('USER')
 
-        # Setup the command line parser
-        self.setup_parser()
+        # The command line parser is set up in parseparams()
+        self.parser = None
 
         self.work = ''
 
         self.flag_dir = False
 
+        # Operations on the same install directory are serialized by
+        # locks in this directory (set by the daemon)
+        self.lock_dir = ''
+
     def set_configprotect(self):
         self.config.set('USER', 'config_protect',
            wrapper.config_protect(self.maybe_get('cat'),
@@ -320,7 +476,10 @@ class Config:
         if not self.config.has_option('USER', 'my_appsuffix'):
             self.determine_appsuffix()
 
-        self.set_configprotect()
+        # Only the eclass needs CONFIG_PROTECT from us. Avoid resolving
+        # it for all other actions.
+        if self.work == 'query':
+            self.set_configprotect()
 
     def determine_appsuffix(self):
 
@@ -378,6 +537,8 @@ class Config:
 
     def setup_parser(self):
 
+        from argparse import ArgumentParser
+
         self.parser  = ArgumentParser(
             usage    = '%(prog)s [-ICU] [-dghus] <APPLICATION VERSION>',
             add_help = False)
@@ -611,6 +772,16 @@ class Config:
                                help = 'This will list all outdated entries in '
                                'the webapp-config "database".')
 
+        info_opts.add_argument('--export-metrics',
+                               nargs = 1,
+                               metavar = 'DIR',
+                               help = 'Write the virtual installs per applic'
+                               'ation version, the outdated database entries'
+                               ', the files and bytes of every install and t'
+                               'he entries that changed since the install to'
+                               ' DIR/webapp-config.prom for the textfile col'
+                               'lector of the Prometheus node exporter.')
+
         info_opts.add_argument('-si',
                                '--show-installed',
                                action='store_true',
@@ -635,6 +806,16 @@ class Config:
         info_opts.add_argument('--query',
                                nargs=2)
 
+        info_opts.add_argument('--format',
+                               choices = ['json',
+                                          'jsonl',
+                                          'tsv'],
+                               help = 'Output machine-readable records instea'
+                               'd of text for --list-installs, --list-unused-i'
+                               'nstalls, --show-installed and --prune-database'
+                               '. Records are written as soon as they are foun'
+                               'd.')
+
         #-----------------------------------------------------------------
         # Other Options
 
@@ -669,12 +850,130 @@ class Config:
                                'can also be used to temporarily overwrite varia'
                                'bles from the configuration file.')
 
+        alio_opts.add_argument('--progress',
+                               action='store_true',
+                               help = 'Show a single line with the number of '
+                               'installed and removed files and the throughp'
+                               'ut instead of a line per file. Files that co'
+                               'uld not be removed or were kept are still li'
+                               'sted. The totals are printed once the operat'
+                               'ion finished.')
+
+        alio_opts.add_argument('--hook-timeout',
+                               nargs = 1,
+                               type = float,
+                               help = 'Terminate hook scripts running longer'
+                               ' than the given number of seconds. Hooks whos'
+                               'e names start with the same number (e.g. "10'
+                               '-a" and "10-b") run at the same time.')
+
+        alio_opts.add_argument('--hook-limits',
+                               nargs = 1,
+                               help = 'Resource limits for every hook script'
+                               ', e.g. "cpu=60,as=1G,nofile=1024". The name'
+                               's are those of setrlimit(2) without the RLIM'
+                               'IT_ prefix.')
+
+        alio_opts.add_argument('--event-log',
+                               nargs = 1,
+                               help = 'Append a JSON record for every file o'
+                               'peration (mkdir, link, copy, chown, chmod, p'
+                               'rotect, unlink, skip) and hook script to the'
+                               ' given file. A number selects an open file d'
+                               'escriptor.')
+
+        alio_opts.add_argument('--profile',
+                               nargs = '?',
+                               const = '',
+                               metavar = 'FILE',
+                               help = 'Print the time spent in each phase o'
+                               'f the run (startup, portage, NSS, hashing, '
+                               'files, hooks), the number of files and byte'
+                               's and the peak memory usage to stderr. With '
+                               'FILE the run is profiled by cProfile and th'
+                               'e statistics are written to FILE.')
+
+        alio_opts.add_argument('--metrics',
+                               nargs = 1,
+                               metavar = 'FILE',
+                               help = 'Write the counters of the run (files '
+                               'linked, copied, hashed and removed, bytes ha'
+                               'shed, stat calls, NSS lookups, hook and CONT'
+                               'ENTS times) to FILE at exit. FILE is replace'
+                               'd atomically.')
+
+        alio_opts.add_argument('--metrics-format',
+                               choices = ['json',
+                                          'prometheus'],
+                               help = 'Format of --metrics. The default is p'
+                               'rometheus (node exporter textfile) for files'
+                               ' ending in .prom and json otherwise.')
+
         alio_opts.add_argument('-?',
                                '--help',
                                action='help',
                                help = 'Show this help')
 
 
+        #-----------------------------------------------------------------
+        # Batch Options
+
+        btch_opts = self.parser.add_argument_group('<Batch Options>')
+
+        btch_opts.add_argument('--batch',
+                               nargs = 1,
+                               help = 'Run the install, clean and upgrade ope'
+                               'rations listed in FILE ("-" for stdin), one J'
+                               'SON object per line, e.g. {"action": "instal'
+                               'l", "package": "horde", "version": "3.0.5", '
+                               '"host": "www.example.com", "dir": "/horde"}. '
+                               'Operations on the same install directory run'
+                               ' in the order of the file. The result and du'
+                               'ration of each operation is printed as a JSO'
+                               'N line, followed by a JSON summary.')
+
+        btch_opts.add_argument('-j',
+                               '--jobs',
+                               nargs = 1,
+                               type = int,
+                               help = 'The number of operations of --batch th'
+                               'at may run at the same time. Default is the '
+                               'number of CPUs.')
+
+        btch_opts.add_argument('--jobs-per-fs',
+                               nargs = 1,
+                               type = int,
+                               help = 'The number of operations of --batch th'
+                               'at may run at the same time on a single file'
+                               'system. Default is the value of --jobs.')
+
+        #-----------------------------------------------------------------
+        # Daemon Options
+
+        daem_opts = self.parser.add_argument_group('<Daemon Options>')
+
+        daem_opts.add_argument('--daemon',
+                               action = 'store_true',
+                               help = 'Keep running and execute the webapp-co'
+                               'nfig invocations forwarded by --client. Parse'
+                               'd configuration, source manifests, type list'
+                               's, user and group lookups and the package da'
+                               'tabase stay loaded between the invocations. '
+                               'Operations on the same install directory are'
+                               ' serialized.')
+
+        daem_opts.add_argument('--client',
+                               action = 'store_true',
+                               help = 'Forward this invocation to a running d'
+                               'aemon. Must be the first argument and may on'
+                               'ly be followed by --socket.')
+
+        daem_opts.add_argument('--socket',
+                               nargs = 1,
+                               help = 'The socket the daemon listens on. Defa'
+                               'ult is "' + self.config.get('USER', 'g_socket')
+                               + '".')
+
         #-----------------------------------------------------------------
         # Debug Options
 
@@ -762,6 +1061,17 @@ class Config:
                     ' variable "' + group + "'")
         return result
 
+    def prefetch_principals(self):
+        ''' Resolve all configured users and groups in one go.'''
+        Perm.prefetch([self.maybe_get(i) for i in ['vhost_default_uid',
+                                                   'vhost_config_uid',
+                                                   'vhost_server_uid']
+                       if self.maybe_get(i)],
+                      [self.maybe_get(i) for i in ['vhost_default_gid',
+                                                   'vhost_config_gid',
+                                                   'vhost_server_gid']
+                       if self.maybe_get(i)])
+
     def installdir(self):
         return self.maybe_get('g_installdir')
 
@@ -817,13 +1127,10 @@ class Config:
             OUT.die('The configuration file ' + self.__d['my_etcconfig'] +
                     ' is not accessible!')
 
-        try:
-            self.config.read(self.__d['my_etcconfig'])
-        except Exception as e:
-            OUT.die('The config file '
-                    + self.config.get('USER', 'my_etcconfig') +
-                    ' cannot be read by the configuration parser.'
-                    '.\nMaybe you need to etc-update?\nError was: ' + str(e))
+        self.read_config()
+
+        if not self.maybe_get('vhost_hostname'):
+            self.config.set('USER', 'vhost_hostname', self.default_hostname())
 
         # check the version id in the config file
         #
@@ -844,6 +1151,7 @@ class Config:
         OUT.debug('Successfully parsed configuration file options', 7)
 
         # Parse the command line
+        self.setup_parser()
         options = vars(self.parser.parse_args())
 
         OUT.debug('Successfully parsed command line options', 7)
@@ -905,7 +1213,14 @@ class Config:
                             'default_dirs' : 'vhost_config_default_dirs',
                             'pretend'      : 'g_pretend',
                             'verbose'      : 'g_verbose',
-                            'bug_report'   : 'g_bugreport'}
+                            'bug_report'   : 'g_bugreport',
+                            'format'       : 'g_format',
+                            'socket'       : 'g_socket',
+                            'batch'        : 'g_batch',
+                            'jobs'         : 'g_jobs',
+                            'jobs_per_fs'  : 'g_jobs_per_fs',
+                            'hook_timeout' : 'g_hook_timeout',
+                            'hook_limits'  : 'g_hook_limits'}
 
         for key in option_to_config:
             if key in options and options[key]:
@@ -917,6 +1232,26 @@ class Config:
                     self.config.set('USER', option_to_config[key],
                                     str(options[key]))
 
+        if ('progress' in options
+            and options['progress']):
+            OUT.progress_on()
+
+        if ('event_log' in options
+            and options['event_log']):
+            try:
+                EVENTS.open(options['event_log'][0])
+            except (ValueError, IOError, OSError) as e:
+                OUT.die('Unable to open the event log: ' + str(e))
+
+        if ('profile' in options
+            and options['profile'] is not None):
+            PROFILE.enable(options['profile'])
+
+        if ('metrics' in options
+            and options['metrics']):
+            METRICS.enable(options['metrics'][0],
+                           options.get('metrics_format'))
+
         # handle verbosity
         if ('pretend' in options
             and options['pretend']):
@@ -955,7 +1290,8 @@ class Config:
         work = ['install', 'clean', 'upgrade', 'list_installs',
                 'list_servers', 'list_unused_installs',
                 'prune_database', 'show_installed', 'show_postinst',
-                'show_postupgrade', 'check_config', 'query']
+                'show_postupgrade', 'check_config', 'query', 'daemon',
+                'batch', 'export_metrics']
 
         if len(sys.argv) ==  1:
             self.parser.print_help()
@@ -969,6 +1305,9 @@ class Config:
         if options.get('prune_database'):
             self.prune_action = options.get('prune_database')
 
+        if options.get('export_metrics'):
+            self.export_dir = options.get('export_metrics')[0]
+
         OUT.debug('Checking command line arguments', 1)
 
         if self.work in ['install', 'clean', 'query', 'list_installs',
@@ -1029,6 +1368,87 @@ class Config:
                         self.config.get('USER', 'g_installdir'))
 
 
+    def default_hostname(self):
+        ''' Return the fully qualified name of this host.'''
+        import socket
+
+        hostname = 'localhost'
+        try:
+            hostname = socket.gethostbyaddr(socket.gethostname())[0]
+        except:
+            pass
+        return hostname
+
+    def config_cache(self):
+        ''' Return the location of the configuration cache.'''
+        if self.__d['my_cachedir']:
+            return self.__d['my_cachedir'] + '/config.json'
+
+    def config_key(self):
+        '''
+        Returns the values identifying the configuration: name, mtime
+        and size of the configuration file, the expected configuration
+        version and the default values.
+        '''
+        try:
+            st = os.stat(self.__d['my_etcconfig'])
+        except OSError:
+            return None
+        return [self.__d['my_etcconfig'], st.st_mtime, st.st_size,
+                self.__d['my_conf_version'], self.__d]
+
+    def read_config(self):
+        '''
+        Read the configuration file. Parsing and interpolating the file
+        is only done if it changed since the last run. Otherwise the
+        cached snapshot of the configuration is used.
+        '''
+        key   = self.config_key()
+        cache = self.config_cache()
+
+        if key and cache and os.path.isfile(cache):
+            try:
+                f = open(cache)
+                data = json.load(f)
+                f.close()
+                if (isinstance(data, dict) and
+                    data.get('version') == CONFIG_CACHE_VERSION and
+                    data.get('key') == key):
+
+                    OUT.debug('Using cached configuration', 7)
+
+                    self.config.use_snapshot(data['snapshot'])
+                    return
+            except (IOError, OSError, ValueError, KeyError):
+                OUT.debug('Ignoring broken configuration cache', 7)
+
+        try:
+            self.config.read(self.__d['my_etcconfig'])
+        except Exception as e:
+            OUT.die('The config file '
+                    + self.config.get('USER', 'my_etcconfig') +
+                    ' cannot be read by the configuration parser.'
+                    '.\nMaybe you need to etc-update?\nError was: ' + str(e))
+
+        snapshot = self.config.take_snapshot()
+        self.config.use_snapshot(snapshot)
+
+        if not key or not cache:
+            return
+
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache), 0o755)
+            tmp = cache + '.' + str(os.getpid())
+            f = open(tmp, 'w')
+            json.dump({'version'  : CONFIG_CACHE_VERSION,
+                       'key'      : key,
+                       'snapshot' : snapshot}, f)
+            f.close()
+            os.rename(tmp, cache)
+        except (IOError, OSError):
+            OUT.debug('Unable to write configuration cache', 7)
+
     # --------------------------------------------------------------------
     # Helper functions
 
@@ -1063,32 +1483,42 @@ class Config:
 
             j -= 1
 
-    def setinstalldir(self):
+    def installpath(self, g_installdir):
+        ''' Return the install directory for the given g_installdir.'''
 
-        # set our install directory
-        #
         # the sed is to make sure we don't have any '//' or '///' and so
         # on in the final directory string
         #
         # this makes sure we don't write rubbish into the installs list
 
-        g_installdir = self.config.get('USER', 'g_installdir')
-
         if (os.path.isabs(g_installdir) 
             and self.config.get('USER', 'allow_absolute') == 'yes'):
             installpath = g_installdir
         else:
             installpath = self.config.get('USER', 'g_htdocsdir') + '/' + g_installdir
 
-        installpath = re.compile('/+').sub('/', self.__r + installpath)
+        installpath = re.compile('/+').sub('/', wrapper.get_root(self)
+                                           + installpath)
 
-        while installpath[-1] == '/':
+        while len(installpath) > 1 and installpath[-1] == '/':
             installpath = installpath[:-1]
 
+        return installpath
+
+    def setinstalldir(self):
+
+        # set our install directory
+
+        installpath = self.installpath(self.config.get('USER', 'g_installdir'))
+
         OUT.info('Install directory is: ' + installpath)
 
         self.config.set('USER', 'g_installdir', installpath)
 
+        if self.lock_dir:
+            from WebappConfig.daemon import lock_installdir
+            lock_installdir(self.lock_dir, installpath)
+
     def checkconfig (self):
 
         OUT.debug('Running checkconfig', 6)
@@ -1155,10 +1585,24 @@ class Config:
 
         OUT.debug('Handling ' + self.work, 6)
 
+        METRICS.labels['action'] = self.work
+
         if self.work == 'help':
             self.parser.print_help()
             sys.exit(0)
 
+        if self.work == 'daemon':
+            from WebappConfig.daemon import Daemon
+            Daemon(self).serve()
+            sys.exit(0)
+
+        if self.work == 'batch':
+            from WebappConfig.batch import Batch
+            sys.exit(Batch(self,
+                           int(self.maybe_get('g_jobs') or 0),
+                           int(self.maybe_get('g_jobs_per_fs') or 0)
+                           ).run(self.maybe_get('g_batch')))
+
         if self.work == 'list_servers':
             from WebappConfig.server import listservers
             # List the supported servers
@@ -1199,31 +1643,62 @@ class Config:
                                         self.maybe_get('pvr'))
 
             # Compare this against the installed web applications
-            self.create_webapp_source().listunused(db)
+            writer = self.create_record_writer()
+            self.create_webapp_source().listunused(db, writer)
+            self.close_record_writer(writer)
 
         if self.work == 'list_installs':
             # Get the handler for the virtual install db and list the
             # virtual installations
             self.__r = wrapper.get_root(self)
+            writer = self.create_record_writer()
             self.create_webapp_db(  self.maybe_get('cat'),
                                     self.maybe_get('pn'),
-                                    self.maybe_get('pvr')).listinstalls()
+                                    self.maybe_get('pvr')).listinstalls(writer)
+            self.close_record_writer(writer)
+
         if self.work == 'prune_database':
             # Get the handler for the virtual install db. If the action is equal
             # to clean, then it'll simply prune the "db" of outdated entries.
             # If it's not set to clean, then it'll list the outdated entries
             # in the db to be cleaned out.
             self.__r = wrapper.get_root(self)
+            writer = self.create_record_writer()
             self.create_webapp_db(  self.maybe_get('cat'),
                                     self.maybe_get('pn'),
-                                    self.maybe_get('pvr')).prune_database(self.prune_action)
+                                    self.maybe_get('pvr')).prune_database(self.prune_action,
+                                                                          writer)
+            self.close_record_writer(writer)
+
+            # The type caches of removed applications are outdated as well
+            if self.prune_action == 'clean':
+                from WebappConfig.db import WebappSource
+                for i in WebappSource(self.__r,
+                                      self.maybe_get('my_approot'),
+                                      cachedir = self.maybe_get('my_cachedir'),
+                                      pretend = self.pretend()
+                                      ).prune_type_cache():
+                    OUT.debug('Removed outdated type cache ' + i, 6)
+
+        if self.work == 'export_metrics':
+            # Collect the gauges of all virtual installs for the node
+            # exporter
+            from WebappConfig.exporter import Exporter
+            self.__r = wrapper.get_root(self)
+            Exporter(self.create_webapp_db('', '', '')).write(
+                self.export_dir)
 
         if self.work == 'show_installed':
 
             # This reads a .webapp file in the specified installdir.
             self.__r = wrapper.get_root(self)
+            writer = self.create_record_writer()
+            if writer:
+                # Keep stdout clean for the records
+                OUT.info_off()
             self.setinstalldir()
-            self.create_dotconfig().show_installed()
+            self.create_dotconfig().show_installed(writer)
+            self.close_record_writer(writer)
 
         if self.work == 'show_postinst':
 
@@ -1511,6 +1986,22 @@ class Config:
                                                        self.config.get('USER', 'pvr'))
 
 
+    def create_record_writer(self):
+
+        fmt = self.maybe_get('g_format')
+
+        if not fmt:
+            return None
+
+        from WebappConfig.records import RecordWriter
+
+        return RecordWriter(fmt)
+
+    def close_record_writer(self, writer):
+
+        if writer:
+            writer.close()
+
     def create_webapp_db(self, category, package, version):
 
         from WebappConfig.db import  WebappDB
@@ -1542,7 +2033,9 @@ class Config:
                             self.maybe_get('cat'),
                             self.maybe_get('pn'),
                             self.maybe_get('pvr'),
-                            pm = self.config.get('USER', 'package_manager'))
+                            pm = self.config.get('USER', 'package_manager'),
+                            cachedir = self.maybe_get('my_cachedir'),
+                            pretend = self.pretend())
 
     def create_dotconfig(self):
 
@@ -1576,6 +2069,8 @@ class Config:
 
     def create_server(self, content, webapp_source, category, package, version):
 
+        import WebappConfig.server
+
         # handle server type
 
         allowed_servers = {'apache'   : WebappConfig.server.Apache,
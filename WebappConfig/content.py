@@ -27,6 +27,8 @@ import hashlib, re, os, os.path, io
 from WebappConfig.debug       import OUT
 from WebappConfig.permissions import PermissionMap
 from WebappConfig.compat      import create_md5
+from WebappConfig.metrics     import METRICS
+from WebappConfig.profiler    import PROFILE
 # ========================================================================
 # Content handler
 # ------------------------------------------------------------------------
@@ -139,13 +141,22 @@ class Contents:
             OUT.die('Content file ' + dbpath + ' is missing or not accessibl'
                     'e!')
 
-        content = io.open(dbpath, encoding='utf-8').readlines()
+        with METRICS.timer('contents_read_seconds'):
+            self.__read(dbpath)
+
+    def __read(self, dbpath):
+
+        with io.open(dbpath, encoding='utf-8') as f:
+            content = f.readlines()
+
+        METRICS.add('contents_entries_read', len(content))
+
+        rfn = re.compile('"(.*)"')
 
         for i in content:
 
             i = i.strip()
 
-            rfn = re.compile('"(.*)"')
             rfs = rfn.search(i)
             if not rfs:
                 ok = False
@@ -155,7 +166,8 @@ class Contents:
                 line_split = i.split(' ')
                 line_split[3] = fn
 
-                OUT.debug('Adding content line', 10)
+                if OUT.debug_enabled:
+                    OUT.debug('Adding content line', 10)
 
                 ok = True
 
@@ -255,7 +267,8 @@ class Contents:
             destination,
             path,
             real_path,
-            relative = True):
+            relative = True,
+            checksum = None):
         '''
         Add an entry to the contents file.
 
@@ -314,9 +327,13 @@ class Contents:
           real_path   - for config-protected files realpath =! path
                         (and this is important for md5)
           relative    - 1 for storing a relative filename, 0 otherwise
+          checksum    - md5sum of the file if it is already known (e.g.
+                        from the manifest of the source). The file
+                        will not be read in that case.
         '''
 
-        OUT.debug('Adding entry to content dictionary', 6)
+        if OUT.debug_enabled:
+            OUT.debug('Adding entry to content dictionary', 6)
 
         # Build the full path that we use as index in the contents list
         while path[0] == '/':
@@ -352,11 +369,15 @@ class Contents:
         # Generate handler for file attributes
         a = allowed_types[dsttype]
 
+        if checksum and a[0] == 'file':
+            a = [a[0], lambda x: checksum, a[2]]
+
         # For absolute entries the path must match the entry
         if not relative:
             path = entry
 
-        OUT.debug('Adding entry', 7)
+        if OUT.debug_enabled:
+            OUT.debug('Adding entry', 7)
 
         # report if pretending
         if self.__p:
@@ -382,8 +403,10 @@ class Contents:
                 if msg[0] == "/":
                     msg = self.__root + msg
                     msg = self.__re.sub('/', msg)
-                OUT.notice('>>> ' + a[0] + ' ' * (4 - len(a[0])) + ' ('  \
-                           + ctype + ') ' + msg)
+                OUT.record('added', '>>> ' + a[0] + ' ' * (4 - len(a[0]))
+                           + ' (' + ctype + ') ' + msg)
+            else:
+                OUT.count('added')
 
 
     def file_zero(self, filename):
@@ -396,10 +419,16 @@ class Contents:
 
     def file_md5(self, filename):
         ''' Return the md5 hash for the file content.'''
+        METRICS.add('files_hashed')
+        METRICS.add('bytes_hashed', os.path.getsize(filename))
+        if PROFILE.enabled:
+            with PROFILE.phase('hash', False):
+                return create_md5(filename)
         return create_md5(filename)
 
     def file_time(self, filename):
         ''' Return the last modification time.'''
+        METRICS.add('stat_calls')
         if os.path.islink(filename):
             return str(os.lstat(filename)[8])
         else:
@@ -429,6 +458,11 @@ class Contents:
                 if self.__content[i][0] in ['sym', 'file']]
 
 
+    def get_entries(self):
+        ''' Get (entry, type, recorded modification time) for all
+        entries.'''
+        return [(i, j[0], j[4]) for i, j in self.__content.items()]
+
     def get_canremove(self, entry):
         '''
         Determines if an entry can be removed.
@@ -441,13 +475,15 @@ class Contents:
         returned.
         '''
 
-        OUT.debug('Checking if the file can be removed', 6)
+        if OUT.debug_enabled:
+            OUT.debug('Checking if the file can be removed', 6)
 
         # Path not found.
         # Cannot remove -> return False
         if not os.path.exists(entry) and not os.path.islink(entry):
 
-            OUT.debug('Did not find the file.', 7)
+            if OUT.debug_enabled:
+                OUT.debug('Did not find the file.', 7)
 
             return '!found ' + self.epath(entry)
 
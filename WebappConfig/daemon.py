@@ -0,0 +1,499 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Keeps webapp-config running in the background so that invocations
+forwarded by "webapp-config --client" do not have to start from
+scratch.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+from __future__ import print_function
+
+import array, errno, fcntl, hashlib, json, os, os.path, socket, struct, sys
+
+from WebappConfig.debug    import OUT
+from WebappConfig.eprefix  import EPREFIX
+from WebappConfig.events   import EVENTS
+from WebappConfig.metrics  import METRICS
+from WebappConfig.profiler import PROFILE
+
+# ========================================================================
+# Protocol
+# ------------------------------------------------------------------------
+#
+# The client sends a single JSON line describing the invocation
+# (command line, working directory, environment and umask). Its
+# standard input, output and error are passed along with the request
+# so that the daemon writes directly to the terminal of the client.
+# Once the invocation finished the daemon answers with a single JSON
+# line holding the exit status.
+
+# The default location of the socket
+SOCKET = EPREFIX + '/run/webapp-config.socket'
+
+# The number of file descriptors passed with a request
+FDS = 3
+
+def send_request(sock, request, fds):
+    ''' Send a request together with the given file descriptors.'''
+    data = (json.dumps(request) + '\n').encode('utf-8')
+    sent = sock.sendmsg([data], [(socket.SOL_SOCKET, socket.SCM_RIGHTS,
+                                  array.array('i', fds))])
+    sock.sendall(data[sent:])
+
+def receive_request(sock):
+    '''
+    Receive a request. Returns the request and the list of file
+    descriptors that came with it.
+    '''
+    fds = array.array('i')
+    data, ancdata, flags, addr = sock.recvmsg(
+        65536, socket.CMSG_SPACE(FDS * fds.itemsize))
+
+    for level, kind, cdata in ancdata:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(cdata[:len(cdata) - len(cdata) % fds.itemsize])
+
+    while not data.endswith(b'\n'):
+        chunk = sock.recv(65536)
+        if not chunk:
+            for i in fds:
+                os.close(i)
+            raise ValueError('Incomplete request')
+        data += chunk
+
+    return json.loads(data.decode('utf-8')), list(fds)
+
+def receive_all(sock):
+    ''' Read from the socket until the other side closes it.'''
+    data = b''
+    while True:
+        chunk = sock.recv(4096)
+        if not chunk:
+            return data
+        data += chunk
+
+def supported():
+    ''' Passing file descriptors requires Python 3.3 or newer.'''
+    return (hasattr(socket, 'AF_UNIX') and
+            hasattr(socket.socket, 'sendmsg'))
+
+# ========================================================================
+# Client
+# ------------------------------------------------------------------------
+
+def client(argv):
+    '''
+    Forward an invocation of the form
+
+      webapp-config --client [--socket PATH] <arguments>
+
+    to the daemon and return its exit status.
+    '''
+    path = SOCKET
+    args = argv[2:]
+    if args[:1] == ['--socket'] and len(args) > 1:
+        path = args[1]
+        args = args[2:]
+
+    if not supported():
+        OUT.die('The webapp-config daemon requires Python 3.3 or newer.')
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (socket.error, OSError) as e:
+        OUT.die('Unable to connect to the webapp-config daemon at '
+                + path + ': ' + str(e))
+
+    umask = os.umask(0)
+    os.umask(umask)
+
+    sys.stdout.flush()
+    sys.stderr.flush()
+
+    try:
+        send_request(sock, {'argv'  : [argv[0]] + args,
+                            'cwd'   : os.getcwd(),
+                            'env'   : dict(os.environ),
+                            'umask' : umask},
+                     [0, 1, 2])
+        reply = receive_all(sock)
+    finally:
+        sock.close()
+
+    try:
+        return int(json.loads(reply.decode('utf-8'))['status'])
+    except (ValueError, KeyError, TypeError):
+        OUT.die('The webapp-config daemon did not finish the request.')
+
+# ========================================================================
+# Install directory locks
+# ------------------------------------------------------------------------
+
+# The locks held by this process
+_locks = {}
+
+def lock_installdir(lockdir, installdir):
+    '''
+    Wait until no other process works on the install directory and
+    keep it locked until this process exits.
+    '''
+    name = lockdir + '/' + hashlib.md5(
+        installdir.encode('utf-8')).hexdigest() + '.lock'
+
+    if name in _locks:
+        return
+
+    if not os.path.isdir(lockdir):
+        os.makedirs(lockdir, 0o700)
+
+    fd = os.open(name, os.O_RDWR | os.O_CREAT, 0o600)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except (IOError, OSError) as e:
+        if not e.errno in [errno.EAGAIN, errno.EACCES]:
+            raise
+        OUT.info('Waiting for another operation on ' + installdir)
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    _locks[name] = fd
+
+# ========================================================================
+# Daemon
+# ------------------------------------------------------------------------
+
+class Daemon:
+    '''
+    Accepts invocations on a Unix socket and runs each of them in a
+    forked child. The child inherits everything the daemon loaded
+    (modules, configuration cache, source manifests and type lists,
+    user and group lookups, portage settings and the package
+    database) but cannot modify the state of the daemon. The global
+    state of webapp-config (working directory, umask, sys.exit(),
+    output) is confined to the child as well.
+    '''
+
+    def __init__(self, config):
+
+        self.config   = config
+        self.path     = config.maybe_get('g_socket')
+        self.lockdir  = config.maybe_get('my_cachedir') + '/locks'
+
+        self.__children = set()
+
+        # The state the warm caches were loaded for
+        self.__state    = {}
+
+    # --------------------------------------------------------------------
+    # Caches
+
+    def nss_key(self):
+        ''' Identifies the state of the local user and group databases.'''
+        key = []
+        for i in ['/etc/passwd', '/etc/group', '/etc/nsswitch.conf']:
+            try:
+                st = os.stat(i)
+                key.append([i, st.st_mtime, st.st_size])
+            except OSError:
+                key.append([i, None])
+        return key
+
+    def warm(self):
+        ''' Load everything a typical invocation needs.'''
+        import WebappConfig.wrapper     as wrapper
+        import WebappConfig.permissions as Perm
+        import WebappConfig.config, WebappConfig.server, WebappConfig.worker
+        import WebappConfig.content, WebappConfig.ebuild
+        import WebappConfig.dotconfig, WebappConfig.filetype
+        import argparse
+
+        from WebappConfig.db       import WebappSource, read_cached, \
+                                          parse_manifest
+        from WebappConfig.template import parse_template
+
+        OUT.debug('Warming caches', 6)
+
+        self.__state['settings'] = wrapper.settings_key()
+        try:
+            wrapper.portage_setting('ROOT')
+            vdb = wrapper.installed_packages(
+                self.config.maybe_get('package_manager'))
+            if vdb.exists():
+                vdb.index()
+            self.__state['vdb'] = vdb.key()
+        except Exception as e:
+            OUT.warn('Unable to load the portage settings: ' + str(e))
+
+        self.__state['nss'] = self.nss_key()
+        Perm.clear_nss_cache()
+        self.config.prefetch_principals()
+
+        root    = wrapper.get_root(self.config)
+        approot = self.config.maybe_get('my_approot')
+        if not os.path.isdir(root + approot):
+            return
+
+        hierarchy = WebappSource(root, approot)
+        for location, (cat, pn, pvr) in hierarchy.iter_locations():
+            # The old layout (PN/PVR) has no category
+            if cat == os.path.basename(hierarchy.root):
+                cat = ''
+            source = WebappSource(root, approot, cat, pn, pvr,
+                                  cachedir = self.config.maybe_get(
+                                      'my_cachedir'))
+            for name, parse in [(source.appdir() + '/' + source.manifest,
+                                 parse_manifest),
+                                (source.type_cache(), json.load),
+                                (source.appdir() + '/postinst-en.txt',
+                                 parse_template),
+                                (source.appdir() + '/postupgrade-en.txt',
+                                 parse_template)]:
+                try:
+                    if name and os.path.isfile(name):
+                        read_cached(name, parse)
+                except (IOError, OSError, ValueError):
+                    pass
+
+    def refresh(self):
+        ''' Reload caches that went stale since they were loaded.'''
+        import WebappConfig.wrapper as wrapper
+
+        stale = self.__state.get('nss') != self.nss_key()
+
+        if self.__state.get('settings') != wrapper.settings_key():
+            wrapper._settings.clear()
+            del wrapper._vdb[:]
+            stale = True
+        elif wrapper._vdb and wrapper._vdb[0].key() != self.__state.get('vdb'):
+            del wrapper._vdb[:]
+            stale = True
+
+        if stale:
+            self.warm()
+
+    # --------------------------------------------------------------------
+    # Server
+
+    def serve(self):
+        ''' Accept invocations until terminated.'''
+        import signal
+
+        if not supported():
+            OUT.die('The webapp-config daemon requires Python 3.3 or newer.')
+
+        self.warm()
+
+        sock = self.listen()
+
+        def terminate(signum, frame):
+            raise SystemExit(0)
+
+        signal.signal(signal.SIGTERM, terminate)
+
+        OUT.info('Listening on ' + self.path)
+
+        # Wake up regularly to collect the finished children
+        sock.settimeout(5)
+
+        try:
+            while True:
+                try:
+                    conn, addr = sock.accept()
+                except socket.timeout:
+                    self.reap()
+                    continue
+
+                conn.settimeout(None)
+                self.reap()
+
+                if not self.authorized(conn):
+                    OUT.warn('Rejected a connection from another user')
+                    conn.close()
+                    continue
+
+                self.refresh()
+
+                pid = os.fork()
+                if pid == 0:
+                    status = 1
+                    try:
+                        # A terminated invocation must not report success
+                        # to the client
+                        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+                        sock.close()
+                        status = self.handle(conn)
+                    finally:
+                        os._exit(status)
+
+                conn.close()
+                self.__children.add(pid)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            sock.close()
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+
+    def listen(self):
+        ''' Create the socket. Only the owner may connect.'''
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+                probe.close()
+                OUT.die('A daemon is already listening on ' + self.path)
+            except (socket.error, OSError):
+                os.unlink(self.path)
+
+        if not os.path.isdir(os.path.dirname(self.path)):
+            os.makedirs(os.path.dirname(self.path), 0o755)
+
+        sock  = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        umask = os.umask(0o077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        sock.listen(64)
+
+        return sock
+
+    def authorized(self, conn):
+        ''' Only accept root and the user running the daemon.'''
+        if not hasattr(socket, 'SO_PEERCRED'):
+            # Rely on the permissions of the socket
+            return True
+
+        size = struct.calcsize('3i')
+        pid, uid, gid = struct.unpack(
+            '3i', conn.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, size))
+
+        return uid in [0, os.getuid()]
+
+    def reap(self):
+        ''' Collect finished children.'''
+        for pid in list(self.__children):
+            try:
+                done, status = os.waitpid(pid, os.WNOHANG)
+            except OSError:
+                done = pid
+            if done:
+                self.__children.discard(pid)
+
+    # --------------------------------------------------------------------
+    # Child
+
+    def handle(self, conn):
+        ''' Run a single invocation. Returns the exit status.'''
+        try:
+            request, fds = receive_request(conn)
+        except (ValueError, socket.error, OSError) as e:
+            OUT.warn('Invalid request: ' + str(e))
+            return 1
+
+        if len(fds) != FDS:
+            for i in fds:
+                os.close(i)
+            OUT.warn('Invalid request: missing file descriptors')
+            return 1
+
+        status = self.execute(request, fds)
+
+        try:
+            conn.sendall((json.dumps({'status' : status}) + '\n').encode(
+                'utf-8'))
+            conn.close()
+        except (socket.error, OSError):
+            pass
+
+        return status
+
+    def execute(self, request, fds):
+        ''' Take over the environment of the client and run webapp-config.'''
+        import traceback
+        import WebappConfig.wrapper as wrapper
+
+        from WebappConfig.config import Config
+
+        sys.stdout.flush()
+        sys.stderr.flush()
+
+        for target, fd in enumerate(fds):
+            os.dup2(fd, target)
+            os.close(fd)
+
+        if hasattr(sys.stdout, 'reconfigure'):
+            sys.stdout.reconfigure(line_buffering = os.isatty(1))
+
+        OUT.__init__('webapp-config')
+        METRICS.__init__()
+
+        # --profile accounts for this request only
+        PROFILE.__init__()
+
+        # Only stdin, stdout and stderr belong to the client
+        EVENTS.descriptors = False
+
+        status = 1
+        try:
+            argv = request['argv']
+            if '--daemon' in argv or '--client' in argv:
+                OUT.die('--daemon and --client cannot be forwarded.')
+
+            os.environ.clear()
+            os.environ.update(request['env'])
+            os.chdir(request['cwd'])
+            os.umask(request['umask'])
+            sys.argv = argv
+
+            # The settings depend on the environment of the client
+            if self.__state.get('settings') != wrapper.settings_key():
+                wrapper._settings.clear()
+                del wrapper._vdb[:]
+
+            config = Config()
+            config.lock_dir = self.lockdir
+            config.parseparams()
+            PROFILE.run(config.run)
+            status = 0
+        except SystemExit as e:
+            if e.code is None:
+                status = 0
+            elif isinstance(e.code, int):
+                status = e.code
+            else:
+                print(e.code, file = sys.stderr)
+                status = 1
+        except Exception:
+            traceback.print_exc()
+
+        try:
+            # The child leaves through os._exit() which skips the
+            # handlers registered with atexit
+            OUT.summary()
+            EVENTS.flush()
+            METRICS.write()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        except (IOError, OSError):
+            pass
+
+        return status
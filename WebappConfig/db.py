@@ -21,13 +21,70 @@ well as the database of virtual installs.  '''
 # Dependencies
 # ------------------------------------------------------------------------
 
-import time, os, os.path, re
+import time, os, os.path, re, json
 
 import WebappConfig.wrapper as wrapper
 
 from WebappConfig.debug       import OUT
 from WebappConfig.eprefix     import EPREFIX
+from WebappConfig.metrics     import METRICS
 from WebappConfig.permissions import PermissionMap
+from WebappConfig.records     import make_record
+
+# Bump this whenever the layout of the type cache changes
+TYPE_CACHE_VERSION = 1
+
+# Parsed source files (manifests, type caches) by file name together
+# with the state of the file they were read from. A long running
+# process (see WebappConfig.daemon) keeps them between operations.
+source_cache = {}
+
+def read_cached(filename, parse):
+    '''
+    Return parse(f) for the opened file. The result is kept in memory
+    and reused as long as inode, modification time and size of the
+    file do not change. Raises IOError/OSError if the file cannot be
+    read.
+    '''
+    st  = os.stat(filename)
+    key = [st.st_ino, st.st_mtime, st.st_size]
+
+    cached = source_cache.get(filename)
+    if cached is not None and cached[0] == key:
+        return cached[1]
+
+    f = open(filename)
+    try:
+        result = parse(f)
+    finally:
+        f.close()
+
+    source_cache[filename] = (key, result)
+    return result
+
+def parse_manifest(f):
+    ''' Parse a manifest as described in WebappSource.read_manifest().'''
+    manifest = {}
+    slashes  = re.compile('/+')
+
+    for i in f:
+        # The path is the last field and may contain spaces
+        line_split = i.rstrip('\n').split(' ', 5)
+        if len(line_split) != 6 or not line_split[0] in ['file',
+                                                         'dir',
+                                                         'sym']:
+            OUT.debug('Invalid line in manifest', 8)
+            continue
+        try:
+            manifest[slashes.sub('/', line_split[5])] = [
+                line_split[0],
+                int(line_split[2]),
+                int(line_split[3]),
+                line_split[4]]
+        except ValueError:
+            OUT.debug('Invalid line in manifest', 8)
+
+    return manifest
 
 
 # ========================================================================
@@ -105,21 +162,26 @@ class AppHierarchy:
 
     def list_locations(self):
         ''' List all available db files.'''
+        return dict(self.iter_locations())
+
+    def iter_locations(self):
+        ''' Yield (location, [category, package, version]) for all
+        available db files as they are discovered.'''
 
         OUT.debug('Retrieving hierarchy locations', 6)
 
         dbpath = self.appdb()
 
         if dbpath and os.path.isfile(dbpath):
-            return {dbpath : [ self.category, self.pn, self.pvr]}
+            yield dbpath, [ self.category, self.pn, self.pvr]
+            return
 
         if dbpath and not os.path.isfile(dbpath):
             OUT.debug('Package "' + self.package_name()
                       + '" not listed in the hierarchy (file "'
                       + dbpath + ' is missing)!', 8)
-            return {}
+            return
 
-        locations = {}
         packages  = []
 
         if self.pn:
@@ -151,9 +213,7 @@ class AppHierarchy:
                             cat = os.path.basename(os.path.split(i)[0])
                             if cat == "webapps":
                                 cat = ""
-                            locations[location] = [ cat, pn, j ]
-
-        return locations
+                            yield location, [ cat, pn, j ]
 
 # ========================================================================
 # Handler for /var/db/webapps
@@ -323,21 +383,69 @@ class WebappDB(AppHierarchy):
 
             installs = open(j).readlines()
 
+            METRICS.add('db_files_read')
+
             for i in installs:
                 if len(i.split(' ')) == 4:
                     add.append(i.split(' '))
 
+            METRICS.add('db_installs_read', len(add))
+
             if add:
                 result[p] = add
 
         return result
 
-    def prune_database(self, action):
+    def iter_installs(self):
+        '''
+        Yields one record per virtual install as soon as it has been
+        read from the db files. In contrast to read_db() this does not
+        keep the whole database in memory.
+        '''
+
+        for location, package in self.iter_locations():
+
+            OUT.debug('Streaming install records', 8)
+
+            installs = open(location)
+
+            METRICS.add('db_files_read')
+
+            for i in installs:
+                j = i.split(' ')
+                if len(j) == 4:
+                    METRICS.add('db_installs_read')
+                    yield make_record(package[0], package[1], package[2],
+                                      j[3], j[1], j[2], j[0])
+
+            installs.close()
+
+    def outdated(self, installdir, package):
+        '''
+        True if the install directory holds no contents file for the
+        package ("CATEGORY/PN-PVR" or "PN-PVR"), i.e. the application is
+        no longer installed there. Contents files are named
+        ".webapp-CATEGORY_PN-PVR" (see Contents.appdb()), those written
+        before categories were supported ".webapp-PN-PVR".
+        '''
+        for i in [package.replace('/', '_'), package.split('/')[-1]]:
+            if os.path.exists(installdir + '/.webapp-' + i):
+                return False
+        return True
+
+    def prune_database(self, action, writer = None):
         '''
         Prunes the installs files to ensure no webapp
         is incorrectly listed as installed.
+
+        If a record writer is given the outdated entries are streamed
+        to it instead of being reported as text.
         '''
 
+        if writer:
+            self.prune_stream(action, writer)
+            return
+
         loc = self.read_db()
         
         if not loc and self.__v:
@@ -352,7 +460,7 @@ class WebappDB(AppHierarchy):
             for i in loc[j]:
                 appdir = i[3].strip()
                 # We check to see if the webapp is installed.
-                if not os.path.exists(appdir+'/.webapp-'+j):
+                if self.outdated(appdir, j):
                     if self.__v:
                        OUT.warn('No .webapp file found in dir: ')
                        OUT.warn(appdir)
@@ -373,18 +481,63 @@ class WebappDB(AppHierarchy):
                     else:
                         OUT.warn(appdir)
 
+    def prune_stream(self, action, writer):
+        '''
+        Streams all outdated entries to the record writer. If the
+        action is "clean" the entries are removed from the db files
+        afterwards.
+        '''
+
+        outdated = {}
+
+        for record in self.iter_installs():
+
+            if record['cat']:
+                p = record['cat'] + '/' + record['pn'] + '-' + record['pvr']
+            else:
+                p = record['pn'] + '-' + record['pvr']
+
+            appdir = record['installdir']
+
+            # We check to see if the webapp is installed.
+            if self.outdated(appdir, p):
+                writer.write(record)
+                outdated[appdir] = True
+
+        if action != 'clean' or not outdated:
+            return
+
+        for installs in list(self.list_locations().keys()):
+            contents = open(installs).readlines()
+            new_entries = [entry for entry in contents
+                           if not (len(entry.split(' ')) == 4
+                                   and entry.split(' ')[3].strip()
+                                   in outdated)]
+            if len(new_entries) != len(contents):
+                f = open(installs, 'w')
+                f.write(''.join(new_entries))
+                f.close()
+
     def has_installs(self):
         ''' Return True in case there are any virtual install locations 
         listed in the db file '''
-        if self.read_db():
+        for i in self.iter_installs():
             return True
         return False
 
-    def listinstalls(self):
+    def listinstalls(self, writer = None):
         '''
         Outputs a list of what has been installed so far.
+
+        If a record writer is given the installs are streamed to it as
+        they are discovered.
         '''
 
+        if writer:
+            for record in self.iter_installs():
+                writer.write(record)
+            return
+
         loc = self.read_db()
 
         if not loc and self.__v:
@@ -423,7 +576,10 @@ class WebappSource(AppHierarchy):
                  package    = '',
                  version    = '',
                  installed  = 'installed_by_webapp_eclass',
-                 pm         = ''):
+                 pm         = '',
+                 cachedir   = '',
+                 manifest   = 'manifest',
+                 pretend    = False):
 
         AppHierarchy.__init__(self,
                               fs_root,
@@ -434,8 +590,20 @@ class WebappSource(AppHierarchy):
                               dbfile = installed)
 
         self.__types = None
+        self.__re    = re.compile('/+')
+        self.__p     = pretend
         self.pm = pm
 
+        # Where to keep the compiled type lists. Empty disables caching.
+        if cachedir:
+            cachedir = self.__re.sub('/', fs_root + cachedir)
+        self.cachedir = cachedir
+
+        # The manifest written by the eclass. It is only read once a
+        # checksum is requested.
+        self.manifest   = manifest
+        self.__manifest = None
+
         # Ignore specific files from the install location
         self.ignore = []
 
@@ -446,9 +614,32 @@ class WebappSource(AppHierarchy):
              default_dirs  = 'default-owned'):
         '''
         Initialize the type cache.
+
+        The compiled type lists are cached in the cache directory and
+        reused as long as modification time and size of the lists do
+        not change.
         '''
         import WebappConfig.filetype
 
+        self.__types = WebappConfig.filetype.FileType([],
+                                                      [],
+                                                      virtual_files,
+                                                      default_dirs)
+
+        sources = [self.appdir() + '/' + config_owned,
+                   self.appdir() + '/' + server_owned]
+
+        key = [self.source_stat(i) for i in sources]
+
+        cached = self.read_type_cache(key)
+
+        if cached is not None:
+
+            OUT.debug('Using cached file types.', 7)
+
+            self.__types.restore(cached)
+            return
+
         server_files = []
         config_files = []
 
@@ -473,6 +664,170 @@ class WebappSource(AppHierarchy):
                                                       virtual_files,
                                                       default_dirs)
 
+        self.write_type_cache(key, self.__types.dump())
+
+    def source_stat(self, filename):
+        ''' Returns the values identifying the current state of a type
+        list. Missing lists are represented by None.'''
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return None
+        return [os.path.basename(filename), st.st_mtime, st.st_size]
+
+    def type_cache(self):
+        ''' Return the path of the type cache for this package.'''
+        if self.cachedir and self.appdir():
+            return self.cachedir + '/types/' + \
+                self.package_name().replace('/', '_') + '.json'
+
+    def read_type_cache(self, key):
+        ''' Return the cached type trie if it is still valid.'''
+        cache = self.type_cache()
+
+        if not cache or not os.path.isfile(cache):
+            return None
+
+        try:
+            data = read_cached(cache, json.load)
+        except (IOError, OSError, ValueError):
+            OUT.debug('Ignoring broken type cache.', 7)
+            return None
+
+        if (not isinstance(data, dict) or
+            data.get('version') != TYPE_CACHE_VERSION or
+            data.get('appdir') != self.appdir() or
+            data.get('sources') != key):
+            return None
+
+        return data.get('types')
+
+    def write_type_cache(self, key, types):
+        ''' Store the type trie. Failing to do so is not an error.'''
+        cache = self.type_cache()
+
+        if not cache or self.__p:
+            return
+
+        try:
+            if not os.path.isdir(os.path.dirname(cache)):
+                os.makedirs(os.path.dirname(cache), 0o755)
+
+            # Write to a temporary file first so that concurrent runs
+            # never see a partially written cache
+            tmp = cache + '.' + str(os.getpid())
+            f = open(tmp, 'w')
+            json.dump({'version' : TYPE_CACHE_VERSION,
+                       'appdir'  : self.appdir(),
+                       'sources' : key,
+                       'types'   : types}, f)
+            f.close()
+            os.rename(tmp, cache)
+        except (IOError, OSError):
+            OUT.debug('Unable to write type cache', 7)
+
+    def prune_type_cache(self):
+        '''
+        Remove the cached type lists of applications that are no longer
+        available in the hierarchy. Returns the removed files.
+        '''
+        if not self.cachedir or not os.path.isdir(self.cachedir + '/types'):
+            return []
+
+        valid = []
+        for location, (cat, pn, pvr) in self.iter_locations():
+            # The old layout (PN/PVR) has no category
+            if cat and cat != os.path.basename(self.root):
+                valid.append(cat + '_' + pn + '-' + pvr + '.json')
+            else:
+                valid.append(pn + '-' + pvr + '.json')
+
+        removed = []
+        for i in sorted(os.listdir(self.cachedir + '/types')):
+            if i in valid:
+                continue
+            removed.append(self.cachedir + '/types/' + i)
+            if self.__p:
+                continue
+            try:
+                os.unlink(removed[-1])
+            except OSError:
+                OUT.warn('Unable to remove the type cache ' + removed[-1])
+
+        return removed
+
+    def read_manifest(self):
+        '''
+        Read the manifest generated by the eclass at src_install time.
+        Each line describes a single entry of the application directory:
+
+        <kind> <mode> <size> <mtime> <sum> <path>
+
+        where <kind> is one of file|dir|sym, <mode> the octal
+        permissions, <mtime> the modification time in seconds, <sum> the
+        md5sum of the file (0 for directories and symlinks) and <path>
+        the path relative to the application directory.
+
+        A missing manifest is not an error. Checksums will be
+        calculated from the file contents in that case.
+        '''
+        self.__manifest = {}
+
+        if not self.appdir():
+            return
+
+        filename = self.appdir() + '/' + self.manifest
+
+        if not os.access(filename, os.R_OK):
+
+            OUT.debug('No manifest available.', 7)
+
+            return
+
+        try:
+            self.__manifest = read_cached(filename, parse_manifest)
+        except (IOError, OSError):
+            OUT.warn('Unable to read manifest ' + filename + '!')
+            return
+
+        OUT.debug('Read manifest.', 7)
+
+    def checksum(self, filename):
+        '''
+        Returns the md5sum recorded in the manifest for the given file
+        (relative to the application directory). None is returned if the
+        manifest does not list the file or if size or modification time
+        of the file changed since the manifest was written.
+        '''
+        if self.__manifest is None:
+            self.read_manifest()
+
+        if not self.__manifest:
+            return None
+
+        filename = self.__re.sub('/', filename).lstrip('/')
+        entry    = self.__manifest.get(filename)
+
+        if not entry or entry[0] != 'file':
+            return None
+
+        METRICS.add('stat_calls')
+
+        try:
+            st = os.lstat(self.appdir() + '/' + filename)
+        except OSError:
+            return None
+
+        if st.st_size != entry[1] or int(st.st_mtime) != entry[2]:
+
+            OUT.debug('Manifest entry is stale', 8)
+
+            return None
+
+        METRICS.add('manifest_checksums')
+
+        return entry[3]
+
     def filetype(self, filename):
         ''' Determine filetype for the given file.'''
         if self.__types:
@@ -550,11 +905,26 @@ class WebappSource(AppHierarchy):
 
         return files
 
-    def listunused(self, db):
+    def listunused(self, db, writer = None):
         '''
         Outputs a list of what has not been installed so far
+
+        If a record writer is given the unused packages are streamed
+        to it as they are discovered.
         '''
 
+        if writer:
+            for location, package in self.iter_locations():
+
+                db.set_category(package[0])
+                db.set_package (package[1])
+                db.set_version (package[2])
+
+                if not db.has_installs():
+                    writer.write(make_record(package[0], package[1],
+                                             package[2]))
+            return
+
         packages = self.list_locations()
 
         if not packages:
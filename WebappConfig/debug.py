@@ -13,7 +13,7 @@ from __future__ import print_function
 ##
 #################################################################################
 
-import sys, inspect
+import atexit, sys, time
 
 #################################################################################
 ##
@@ -69,7 +69,7 @@ class Message:
 
         # The highest level of debugging messages acceptable for output
         # The higher the level the more output you will get
-        self.debug_lev = debugging_level
+        self.set_debug_level(debugging_level)
 
         # The debugging output can range from very verbose (3) to
         # very compressed (1)
@@ -87,6 +87,9 @@ class Message:
         # Use '*' to indicate 'All variables'
         self.debug_var = var
 
+        # The filters above as sets (None meaning "all")
+        self.compile_filters()
+
         # Exclude class variables by default
         self.show_class_variables = False
 
@@ -95,6 +98,22 @@ class Message:
 
         self.has_error = False
 
+        # Per-file messages waiting to be written (see record())
+        self.__records = []
+        self.__size    = 0
+
+        # Flush the per-file messages once they reach this size
+        self.buffer_size = 65536
+
+        # Show a progress line instead of the per-file messages
+        self.progress = False
+
+        # Per-file messages by kind since the last summary
+        self.__counts   = {}
+        self.__started  = None
+        self.__shown    = 0
+        self.__progress = ''
+
 
     ############################################################################
     # Add command line options
@@ -220,26 +239,53 @@ class Message:
 
         self.debug_env = module
 
+    def split_names(self, names):
+        '''
+        Accepts names separated by commas as well as lists of them (as
+        returned by the command line parser).
+
+        >>> OUT.split_names(['a,b', 'c'])
+        ['a', 'b', 'c']
+        '''
+        if not isinstance(names, list):
+            names = [names]
+
+        return [j for i in names for j in i.split(',') if j]
+
+    def compile_filters(self):
+
+        def compile(names):
+            if '*' in names:
+                return None
+            return frozenset(names)
+
+        self.__methods   = compile(self.debug_mth)
+        self.__classes   = compile(self.debug_obj)
+        self.__variables = compile(self.debug_var)
+
     def set_debug_methods(self, methods):
 
-        methods = methods.split(',')
+        methods = self.split_names(methods)
 
         if methods:
             self.debug_mth = methods
+            self.compile_filters()
 
     def set_debug_classes(self, classes):
 
-        classes = classes.split(',')
+        classes = self.split_names(classes)
 
         if classes:
             self.debug_obj = classes
+            self.compile_filters()
 
     def set_debug_variables(self, variables):
 
-        variables = variables.split(',')
+        variables = self.split_names(variables)
 
         if variables:
             self.debug_var = variables
+            self.compile_filters()
 
     def maybe_color (self, col, text):
         if self.use_color:
@@ -266,6 +312,13 @@ class Message:
 
     def set_debug_level(self, debugging_level = 4):
         self.debug_lev = debugging_level
+        # False as long as no debugging message can pass the debug
+        # level. Call sites in tight loops may check this before
+        # calling debug() to save the method call:
+        #
+        #   if OUT.debug_enabled:
+        #       OUT.debug('Handling file', 7)
+        self.debug_enabled = debugging_level > 0
 
     def set_debug_verbosity(self, debugging_verbosity = 2):
         self.debug_vrb = debugging_verbosity
@@ -288,10 +341,118 @@ class Message:
     def class_variables_on(self):
         self.show_class_variables = True
 
+    #############################################################################
+    ## Per-file Output
+    ##
+    ## Installing or removing an application reports every single file.
+    ## These messages are collected and written in large chunks. In
+    ## progress mode only a single line with the totals and the
+    ## throughput is shown instead.
+
+    def progress_on(self):
+        self.progress = True
+
+    def progress_off(self):
+        self.progress = False
+
+    def record(self, kind, message, always = False):
+        '''
+        Output a per-file message. "kind" names the action (e.g.
+        "add", "remove") and is used for the totals; None is not counted.
+        Messages that need attention (e.g. failures) set "always" to be
+        shown in progress mode as well.
+
+        >>> out = Message()
+        >>> out.record('remove', '<<< file index.php')
+        >>> out.record('remove', '<<< dir  htdocs')
+        >>> out.flush()
+        <<< file index.php
+        <<< dir  htdocs
+        '''
+        self.count(kind)
+
+        if self.progress and not always:
+            return
+
+        self.__records.append(message)
+        self.__size += len(message) + 1
+
+        if self.__size >= self.buffer_size:
+            self.flush()
+
+    def count(self, kind):
+        ''' Count a per-file action without outputting a message.'''
+        if kind is None:
+            return
+
+        if self.__started is None:
+            self.__started = time.time()
+
+        self.__counts[kind] = self.__counts.get(kind, 0) + 1
+
+        if self.progress:
+            now = time.time()
+            if now - self.__shown >= 0.2:
+                self.__shown = now
+                self.show_progress()
+
+    def totals(self):
+        '''
+        Describe the per-file actions since the last summary.
+
+        >>> out = Message()
+        >>> for i in ['add', 'add', 'remove']:
+        ...     out.count(i)
+        >>> out.totals().split(' (')[0]
+        '3 entries: 2 add, 1 remove'
+        '''
+        total   = sum(self.__counts.values())
+        seconds = max(time.time() - (self.__started or time.time()), 0.001)
+
+        return '%d entries: %s (%.1f s, %.0f entries/s)' % (
+            total,
+            ', '.join(['%d %s' % (self.__counts[i], i)
+                       for i in sorted(self.__counts)]),
+            seconds,
+            total / seconds)
+
+    def show_progress(self):
+        ''' Redraw the progress line (terminals only).'''
+        if not sys.stdout.isatty():
+            return
+
+        line = self.maybe_color('green', '* ') + self.totals()
+        sys.stdout.write('\r' + line + ' ' * max(len(self.__progress)
+                                                   - len(line), 0))
+        sys.stdout.flush()
+        self.__progress = line
+
+    def flush(self):
+        ''' Write the collected per-file messages.'''
+        if self.__progress:
+            sys.stdout.write('\n')
+            self.__progress = ''
+
+        if self.__records:
+            sys.stdout.write('\n'.join(self.__records) + '\n')
+            self.__records = []
+            self.__size    = 0
+
+    def summary(self):
+        ''' In progress mode print the totals and start over.'''
+        self.flush()
+
+        if self.progress and self.__counts:
+            print(self.maybe_color('green', '* ') + self.totals())
+
+        self.__counts  = {}
+        self.__started = None
+
     #############################################################################
     ## Output Functions
 
     def notice (self, note):
+        self.flush()
         print(note)
 
     def info (self, info, level = 4):
@@ -301,11 +462,15 @@ class Message:
         if level > self.info_lev:
             return
 
+        self.flush()
+
         for i in info.split('\n'):
             print(self.maybe_color('green', '* ') + i)
 
     def status (self, message, status, info = 'ignored'):
 
+        self.flush()
+
         message = str(message)
 
         lines = message.split('\n')
@@ -338,11 +503,15 @@ class Message:
         if level > self.warn_lev:
             return
 
+        self.flush()
+
         for i in warn.split('\n'):
             print(self.maybe_color('yellow', '* ') + i)
 
     def error (self, error):
 
+        self.flush()
+
         error = str(error)
 
         for i in error.split('\n'):
@@ -366,52 +535,54 @@ class Message:
         if level > self.debug_lev:
             return
 
-        ## Maybe this should be debugged. So get the stack first.
-        stack = inspect.stack()
-
-        ## This can probably never happen but does not harm to check
-        ## that there is actually something calling this function
-        if len(stack) < 2:
+        ## Maybe this should be debugged. Get the calling frame. Unlike
+        ## inspect.stack() this does not look up any source code.
+        try:
+            caller = sys._getframe(1)
+        except ValueError:
+            ## This can probably never happen but does not harm to check
+            ## that there is actually something calling this function
             return
 
-        ## Get the stack length to determine indentation of the debugging output
-        stacklength = len(stack)
-        ls = '  ' * stacklength
+        ## The function name of the calling frame
+        callermethod = caller.f_code.co_name
 
-        ## Get the information about the caller
-        caller = stack[1]
+        ## Is this actually one of the methods that should be debugged?
+        if self.__methods is not None and not callermethod in self.__methods:
+            return
 
-        ## The function name of the calling frame is the fourth item in the list
-        callermethod = caller[3]
+        ## Is the caller an obejct? If so he provides 'self'
+        callerlocals = caller.f_locals
+        callerobject = callerlocals.get('self')
 
-        ## Is this actually one of the methods that should be debugged?
-        if not '*' in self.debug_mth and not callermethod in self.debug_mth:
+        ## Is the object among the list of objects to debug?
+        if (self.__classes is not None and
+            not str(callerobject.__class__.__name__) in self.__classes):
             return
 
         ## Still looks like this should be debugged. So retrieve the dictionary
         ## of local variables from the caller
-        callerlocals = inspect.getargvalues(caller[0])[3]
-
-        ## Is the caller an obejct? If so he provides 'self'
-        if 'self' in list(callerlocals.keys()):
-            callerobject = callerlocals['self']
+        callerlocals = dict(callerlocals)
+        if 'self' in callerlocals:
             del callerlocals['self']
             if self.show_class_variables:
+                import inspect
                 cv = inspect.getmembers(callerobject,
                                         lambda x: not inspect.ismethod(x))
                 callerlocals.update(cv)
-        else:
-            callerobject = None
 
         # Remove variables not requested
-        if not '*' in self.debug_var:
+        if self.__variables is not None:
             callerlocals = dict([i for i in list(callerlocals.items())
-                                 if i[0] in self.debug_var])
+                                 if i[0] in self.__variables])
 
-        ## Is the object among the list of objects to debug?
-        if (not '*' in self.debug_obj and
-            not str(callerobject.__class__.__name__) in self.debug_obj):
-            return
+        ## Get the stack length to determine indentation of the debugging output
+        stacklength = 0
+        frame = caller
+        while frame is not None:
+            stacklength += 1
+            frame = frame.f_back
+        ls = '  ' * (stacklength + 1)
 
         message = str(message)
 
@@ -497,3 +668,10 @@ class Message:
 
 ## gloabal message handler
 OUT = Message('webapp-config')
+
+## write the remaining per-file messages on exit
+atexit.register(OUT.summary)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
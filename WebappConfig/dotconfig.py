@@ -21,11 +21,12 @@ about the type of package installed.  '''
 # Dependencies
 # ------------------------------------------------------------------------
 
-import pwd, shlex, os.path
+import shlex, os.path
 
-from time                     import strftime
+from time                     import strftime, strptime, mktime
 from WebappConfig.debug       import OUT
-from WebappConfig.permissions import PermissionMap
+from WebappConfig.permissions import PermissionMap, getpwuid
+from WebappConfig.records     import make_record
 
 # ========================================================================
 # Handler for dotConfig files
@@ -99,7 +100,7 @@ class DotConfig:
             if i[:len(self.__file)] == self.__file and i != self.__file:
                 return '!morecontents ' + i
 
-    def show_installed(self):
+    def show_installed(self, writer = None):
         ''' Show which application has been installed in the install 
         location.'''
         if not self.has_dotconfig():
@@ -108,6 +109,10 @@ class DotConfig:
 
         self.read()
 
+        if writer:
+            writer.write(self.record())
+            return
+
         if 'WEB_CATEGORY' in self.__data:
             OUT.notice(self.__data['WEB_CATEGORY'] + ' ' +
                    self.__data['WEB_PN'] + ' ' +
@@ -117,6 +122,25 @@ class DotConfig:
                    self.__data['WEB_PN'] + ' ' +
                    self.__data['WEB_PVR'])
 
+    def record(self):
+        ''' Return the data read from the dot config file as an output
+        record.'''
+        owner = (self['WEB_INSTALLEDFOR'] or '').split(':')
+        date  = self['WEB_INSTALLEDDATE'] or ''
+
+        try:
+            date = int(mktime(strptime(date, '%Y-%m-%d %H:%M:%S')))
+        except ValueError:
+            pass
+
+        return make_record(self['WEB_CATEGORY'],
+                           self['WEB_PN'] or '',
+                           self['WEB_PVR'] or '',
+                           self.__instdir,
+                           owner[0],
+                           owner[-1] if len(owner) > 1 else '',
+                           date)
+
     def packagename(self):
         ''' Retrieve the package name from the values specified in the dot
         config file'''
@@ -147,7 +171,8 @@ class DotConfig:
             b = tokens.get_token()
             c = tokens.get_token()
 
-            OUT.debug('Reading token', 8)
+            if OUT.debug_enabled:
+                OUT.debug('Reading token', 8)
 
             if (a in self.__tokens and
                 b == '=' and c):
@@ -177,7 +202,7 @@ class DotConfig:
         self.__data['WEB_CATEGORY']      = category
         self.__data['WEB_PN']            = package
         self.__data['WEB_PVR']           = version
-        self.__data['WEB_INSTALLEDBY']   = pwd.getpwuid(os.getuid())[0]
+        self.__data['WEB_INSTALLEDBY']   = getpwuid(os.getuid())[0]
         self.__data['WEB_INSTALLEDDATE'] = strftime('%Y-%m-%d %H:%M:%S')
         self.__data['WEB_INSTALLEDFOR']  = user_group
         self.__data['WEB_HOSTNAME']      = host
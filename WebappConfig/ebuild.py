@@ -20,11 +20,21 @@
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os.path, re, pwd, grp
+import os, os.path, re
 
 from WebappConfig.debug     import OUT
+from WebappConfig.hooks     import HookRunner
+from WebappConfig.metrics   import METRICS
 import WebappConfig.wrapper as wrapper
-from WebappConfig.sandbox   import Sandbox
+from WebappConfig.permissions import getpwuid, getgrgid
+from WebappConfig.sandbox   import Sandbox, parse_limits
+from WebappConfig.template  import read_template
+
+try:
+    from types import MappingProxyType as frozen_map
+except ImportError:
+    # python 2 has no read-only view of a dictionary
+    frozen_map = dict
 
 # ========================================================================
 # Handler for ebuild related tasks
@@ -47,6 +57,12 @@ class Ebuild:
         self.__hooksd  = self.__re.sub('/', self.__root
                            + self.get_config('my_hookscriptsdir'))
 
+        # The hooks run by run_hooks()
+        self.hook_results = []
+
+        # The variables of run_vars() by server user and group
+        self.__vars = {}
+
     def get_config(self, option):
         ''' Return a config option.'''
         return self.config.config.get('USER', option)
@@ -65,14 +81,21 @@ class Ebuild:
         env_map = self.run_vars(server)
 
         if os.path.isdir(self.__hooksd):
-            for x in os.listdir(self.__hooksd):
+            try:
+                timeout = float(self.config.maybe_get('g_hook_timeout') or 0)
+            except ValueError:
+                OUT.die('The hook timeout must be a number of seconds')
 
-                if (os.path.isfile(self.__hooksd + '/' + x) and
-                    os.access(self.__hooksd + '/' + x, os.X_OK)):
+            try:
+                limits = parse_limits(self.config.maybe_get('g_hook_limits'))
+            except ValueError as e:
+                OUT.die(str(e))
 
-                    OUT.debug('Running hook script', 7)
+            with METRICS.timer('hook_seconds'):
+                self.hook_results = HookRunner(sandbox, timeout, limits).run(
+                    self.__hooksd, type, env_map)
 
-                    sandbox.spawn(self.__hooksd + '/' + x + ' ' + type, env_map)
+            METRICS.add('hooks_run', len(self.hook_results))
 
     def show_post(self, filename, ptype, server = None):
         '''
@@ -86,9 +109,10 @@ class Ebuild:
         if not os.path.isfile(post_file):
             return
 
-        self.run_vars(server)
+        variables = dict(os.environ)
+        variables.update(self.run_vars(server))
 
-        post_instructions = open(post_file).readlines()
+        post_instructions = read_template(post_file)
 
         OUT.debug('Read post instructions', 7)
 
@@ -99,11 +123,7 @@ class Ebuild:
             '=================================================================',
             '']
 
-        for i in post_instructions:
-            i = i.replace('"', '\\"')
-            post.append(os.popen('printf "' + i + '"\n').read()[:-1])
-
-        post = post + [
+        post = post + post_instructions.render(variables) + [
             '',
             '=================================================================',
             '']
@@ -131,11 +151,26 @@ class Ebuild:
 
     def run_vars(self, server = None):
         '''
-        This function exports the necessary variables to the shell
-        environment so that they are accessible within the shell scripts
-        and/or files provided by the ebuild.
+        This function returns the variables that need to be accessible
+        within the shell scripts and/or files provided by the ebuild.
+
+        The variables are computed once per server and returned as a
+        read-only mapping. They are passed to the hooks and the
+        instructions explicitly; the environment of the process is not
+        touched.
         '''
 
+        # The same instance may be used for several install locations
+        # (e.g. by --batch), so these are part of the key as well
+        key = tuple([self.get_config(i) for i in
+                     ['g_installdir', 'g_orig_installdir', 'g_htdocsdir',
+                      'vhost_root', 'vhost_hostname']])
+        if server:
+            key += (server.vhost_server_uid, server.vhost_server_gid)
+
+        if key in self.__vars:
+            return self.__vars[key]
+
         v_root = self.get_config('vhost_root')
         v_cgi  = self.get_config('g_cgibindir')
         v_conf = self.get_config('vhost_config_dir')
@@ -149,8 +184,8 @@ class Ebuild:
         vsu = None
         vsg = None
         if server:
-            vsu = pwd.getpwuid(server.vhost_server_uid)[0]
-            vsg = grp.getgrgid(server.vhost_server_gid)[0]
+            vsu = getpwuid(server.vhost_server_uid)[0]
+            vsg = getgrgid(server.vhost_server_gid)[0]
 
         OUT.debug('Exporting variables', 7)
 
@@ -196,7 +231,8 @@ class Ebuild:
             if not value:
                 value = self.get_config(i.lower())
 
-            os.putenv(i, str(value))
             result[i] = str(value)
 
-        return result
+        self.__vars[key] = frozen_map(result)
+
+        return self.__vars[key]
@@ -0,0 +1,213 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Records the file operations of a run as JSON lines.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import atexit, fcntl, json, os, time
+
+# Monotonic clock for the durations (python 2 only has time.time())
+clock = getattr(time, 'monotonic', time.time)
+
+# ========================================================================
+# Event log
+# ------------------------------------------------------------------------
+
+# Events creating the path: the size is taken afterwards
+CREATING = frozenset(['link', 'copy', 'symlink'])
+
+# Events removing the path: the size is taken before
+REMOVING = frozenset(['unlink'])
+
+class EventLog:
+    '''
+    Writes one JSON record per operation on the virtual install
+    location:
+
+      {"event": "link", "path": "/var/www/localhost/htdocs/index.php",
+       "owner": "virtual", "bytes": 1204, "duration": 1.6e-05,
+       "time": 1700000000.5}
+
+    "owner" is the file or directory type, "duration" the time spent
+    in the operation in seconds (monotonic clock). Additional fields
+    describe failures ("error"), skipped entries ("reason") and hook
+    scripts ("status").
+
+    The records are collected and written in chunks of whole lines. A
+    run never waits for the log to reach the disk and several
+    processes may append to the same file.
+
+    >>> import tempfile
+    >>> log = EventLog()
+    >>> log.emit('mkdir', '/tmp')
+    >>> fd, name = tempfile.mkstemp()
+    >>> os.close(fd)
+    >>> log.open(name)
+    >>> log.run('chmod', name, 'virtual', os.chmod, name, 420)
+    >>> log.emit('skip', '/var/www/a.php', 'virtual', reason = 'time')
+    >>> log.close()
+    >>> records = [json.loads(i) for i in open(name)]
+    >>> [(i['event'], i['owner'], i['bytes']) for i in records]
+    [('chmod', 'virtual', None), ('skip', 'virtual', None)]
+    >>> records[1]['reason']
+    'time'
+    >>> os.unlink(name)
+    '''
+
+    def __init__(self):
+
+        # Call sites may check this before collecting event details
+        self.enabled = False
+
+        # Whether open() accepts file descriptor numbers. Processes
+        # that did not inherit the descriptors of the user (the
+        # children of the daemon) must not write to their own.
+        self.descriptors = True
+
+        self.buffer_size = 65536
+
+        self.__fd      = None
+        self.__close   = False
+        self.__records = []
+        self.__size    = 0
+
+    def open(self, target):
+        '''
+        Start logging to the given file. A number selects an already
+        open file descriptor (e.g. "3" together with "3>events.jsonl").
+        Raises ValueError if the descriptor may not be used.
+        '''
+        self.close()
+
+        if target.isdigit():
+            if not self.descriptors:
+                raise ValueError('File descriptors cannot be used as event'
+                                 ' log here')
+            try:
+                flags = fcntl.fcntl(int(target), fcntl.F_GETFL)
+            except (IOError, OSError):
+                raise ValueError('File descriptor ' + target
+                                 + ' is not open')
+            if not flags & (os.O_WRONLY | os.O_RDWR):
+                raise ValueError('File descriptor ' + target
+                                 + ' is not open for writing')
+            self.__fd    = int(target)
+            self.__close = False
+        else:
+            self.__fd    = os.open(target,
+                                   os.O_WRONLY | os.O_APPEND | os.O_CREAT,
+                                   0o644)
+            self.__close = True
+
+        self.enabled = True
+
+    def emit(self, event, path, owner = None, size = None, duration = None,
+             **fields):
+        ''' Record a single event.'''
+        if not self.enabled:
+            return
+
+        fields['event']    = event
+        fields['path']     = path
+        fields['owner']    = owner
+        fields['bytes']    = size
+        fields['duration'] = duration
+        fields['time']     = time.time()
+
+        line = json.dumps(fields, sort_keys = True)
+
+        self.__records.append(line)
+        self.__size += len(line) + 1
+
+        if self.__size >= self.buffer_size:
+            self.flush()
+
+    def run(self, event, path, owner, function, *args):
+        '''
+        Call function(*args) and record it as an event on "path".
+        Without a log this is a plain call.
+        '''
+        if not self.enabled:
+            return function(*args)
+
+        size = None
+        if event in REMOVING:
+            size = self.size(path)
+
+        start = clock()
+        try:
+            result = function(*args)
+        except Exception as e:
+            self.emit(event, path, owner, size, clock() - start,
+                      error = str(e))
+            raise
+        duration = clock() - start
+
+        if event in CREATING:
+            size = self.size(path)
+
+        self.emit(event, path, owner, size, duration)
+
+        return result
+
+    def size(self, path):
+        ''' Size of the path (without following links) or None.'''
+        try:
+            return os.lstat(path).st_size
+        except OSError:
+            return None
+
+    def flush(self):
+        ''' Write the collected records.'''
+        if not self.__records:
+            return
+
+        data = ('\n'.join(self.__records) + '\n').encode('utf-8')
+        self.__records = []
+        self.__size    = 0
+
+        try:
+            while data:
+                data = data[os.write(self.__fd, data):]
+        except OSError:
+            # The log must never break an install
+            self.enabled = False
+
+    def close(self):
+        ''' Write the remaining records and stop logging.'''
+        if self.__fd is None:
+            return
+
+        self.flush()
+
+        if self.__close:
+            os.close(self.__fd)
+
+        self.__fd    = None
+        self.enabled = False
+
+## global event log
+EVENTS = EventLog()
+
+## write the remaining records on exit
+atexit.register(EVENTS.close)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
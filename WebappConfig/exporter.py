@@ -0,0 +1,282 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Exports the virtual installs for the textfile collector of the
+Prometheus node exporter (--export-metrics).  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import os, os.path, stat, time
+
+from multiprocessing.pool import ThreadPool
+
+from WebappConfig.content   import Contents
+from WebappConfig.debug     import OUT
+from WebappConfig.dotconfig import DotConfig
+from WebappConfig.events    import clock
+from WebappConfig.metrics   import format_metric, write_atomic
+
+# ========================================================================
+# Checking installs
+# ------------------------------------------------------------------------
+
+# The file written into the textfile directory
+FILENAME = 'webapp-config.prom'
+
+# Installs read before their files are checked by the threads. This
+# bounds the memory used on hosts with thousands of installs.
+BATCH    = 64
+
+# Threads stat()ing the installed files. They mostly wait for the disk
+# or a network file system.
+THREADS  = 8
+
+# Reasons why an installed entry differs from its CONTENTS record
+DRIFT    = ['missing', 'type', 'modified', 'dotconfig']
+
+# File type tests by CONTENTS type
+TYPES    = {'dir': stat.S_ISDIR, 'sym': stat.S_ISLNK, 'file': stat.S_ISREG}
+
+def check(entries):
+    '''
+    stat() the entries of one install, as returned by
+    Contents.get_entries(). Returns the number of entries found, the
+    size of the files and the drift by reason.
+
+    Files are modified if their modification time differs from the
+    recorded one. Checksums are not compared as this would read every
+    file on every run.
+
+    >>> import tempfile
+    >>> fd, name = tempfile.mkstemp()
+    >>> os.write(fd, b'12345')
+    5
+    >>> os.close(fd)
+    >>> mtime = str(int(os.stat(name).st_mtime))
+    >>> result = check([(name, 'file', mtime), (name, 'dir', '0'),
+    ...                 (name + '.missing', 'file', mtime)])
+    >>> result[0], result[1], sorted(result[2].items())
+    (2, 5, [('missing', 1), ('modified', 0), ('type', 1)])
+    >>> os.unlink(name)
+    '''
+    found, size = 0, 0
+    drift = {'missing': 0, 'type': 0, 'modified': 0}
+
+    for entry, kind, mtime in entries:
+        try:
+            st = os.lstat(entry)
+        except OSError:
+            drift['missing'] += 1
+            continue
+
+        found += 1
+
+        if not TYPES[kind](st.st_mode):
+            drift['type'] += 1
+            continue
+
+        if kind == 'file':
+            size += st.st_size
+            if str(int(st.st_mtime)) != mtime:
+                drift['modified'] += 1
+
+    return found, size, drift
+
+def dotconfig_drift(installdir, record):
+    ''' 1 if the .webapp file is missing or names another package.'''
+    dotconfig = DotConfig(installdir)
+    if not dotconfig.has_dotconfig():
+        return 1
+    try:
+        dotconfig.read()
+    except Exception:
+        return 1
+    return int(dotconfig['WEB_PN'] != record['pn'] or
+               dotconfig['WEB_PVR'] != record['pvr'])
+
+# ========================================================================
+# Exporter
+# ------------------------------------------------------------------------
+
+class Exporter:
+    '''
+    Collects per host gauges from the install database, the CONTENTS
+    files and the .webapp files of all virtual installs and writes
+    them in the Prometheus text format:
+
+      webapp_config_installs           installs per application version
+      webapp_config_stale_installs     installs --prune-database would
+                                       remove
+      webapp_config_install_inodes     entries found per install
+      webapp_config_install_bytes      size of the files per install
+      webapp_config_install_drift      entries differing from CONTENTS
+                                       per install and reason
+
+    The database is streamed. CONTENTS files are read in batches and
+    the files of a batch are checked by a pool of threads.
+    '''
+
+    def __init__(self, db, threads = THREADS):
+
+        self.db       = db
+        self.threads  = threads
+
+        # Number of installs and stale installs by package
+        self.installs = {}
+        self.stale    = {}
+
+        # Installs already checked. The database may list one twice.
+        self.seen     = set()
+
+        # Per install samples by metric name
+        self.samples  = {'install_inodes' : [],
+                         'install_bytes'  : [],
+                         'install_drift'  : []}
+
+    def category(self, record):
+        ''' The category of a record, empty for the old layout.'''
+        if record['cat'] == os.path.basename(self.db.root):
+            return ''
+        return record['cat']
+
+    def collect(self):
+        ''' Check all installs.'''
+        pool = ThreadPool(self.threads)
+        try:
+            batch = []
+            for record in self.db.iter_installs():
+
+                cat     = self.category(record)
+                key     = (cat, record['pn'], record['pvr'])
+                package = record['pn'] + '-' + record['pvr']
+                if cat:
+                    package = cat + '/' + package
+
+                self.installs[key] = self.installs.get(key, 0) + 1
+
+                if self.db.outdated(record['installdir'], package):
+                    self.stale[key] = self.stale.get(key, 0) + 1
+                    continue
+
+                if (key, record['installdir']) in self.seen:
+                    continue
+                self.seen.add((key, record['installdir']))
+
+                batch.append((key, record))
+                if len(batch) >= BATCH:
+                    self.scan(pool, batch)
+                    batch = []
+
+            self.scan(pool, batch)
+        finally:
+            pool.close()
+            pool.join()
+
+    def scan(self, pool, batch):
+        ''' Read the CONTENTS files of a batch and check their entries.'''
+        if not batch:
+            return
+
+        entries = []
+        for key, record in batch:
+            content = Contents(record['installdir'], key[0], key[1], key[2])
+            if key[0] and not os.path.exists(content.appdb()):
+                # Installed before categories were supported
+                content.set_category('')
+            content.read()
+            entries.append(content.get_entries())
+
+        for (key, record), result in zip(batch, pool.map(check, entries)):
+            installdir = record['installdir']
+            labels = {'category'   : key[0],
+                      'package'    : key[1],
+                      'version'    : key[2],
+                      'installdir' : installdir}
+
+            found, size, drift = result
+            drift['dotconfig'] = dotconfig_drift(installdir, record)
+
+            self.samples['install_inodes'].append((labels, found))
+            self.samples['install_bytes'].append((labels, size))
+            for reason in DRIFT:
+                drift_labels = dict(labels)
+                drift_labels['reason'] = reason
+                self.samples['install_drift'].append((drift_labels,
+                                                      drift[reason]))
+
+    def lines(self, duration):
+        ''' The metrics in the Prometheus text format.'''
+
+        def by_package(counts):
+            return [({'category' : i[0],
+                      'package'  : i[1],
+                      'version'  : i[2]}, counts.get(i, 0))
+                    for i in sorted(self.installs)]
+
+        return (
+            format_metric('installs', 'gauge',
+                          'Virtual installs per application version',
+                          by_package(self.installs)) +
+            format_metric('stale_installs', 'gauge',
+                          'Database entries without contents file in the '
+                          'install directory (see --prune-database)',
+                          by_package(self.stale)) +
+            format_metric('install_inodes', 'gauge',
+                          'Files, directories and links of an install',
+                          self.samples['install_inodes']) +
+            format_metric('install_bytes', 'gauge',
+                          'Size of the files of an install in bytes',
+                          self.samples['install_bytes']) +
+            format_metric('install_drift', 'gauge',
+                          'Entries of an install that differ from its '
+                          'CONTENTS file (missing, type, modified) and '
+                          'installs whose .webapp file names another '
+                          'package (dotconfig)',
+                          self.samples['install_drift']) +
+            format_metric('export_timestamp_seconds', 'gauge',
+                          'Time of the last export',
+                          [({}, time.time())]) +
+            format_metric('export_duration_seconds', 'gauge',
+                          'Duration of the last export',
+                          [({}, duration)]))
+
+    def write(self, directory):
+        ''' Collect all metrics and replace the file in "directory".'''
+        start = clock()
+
+        if not os.path.isdir(directory):
+            OUT.die('"' + directory + '" is no directory!')
+
+        self.collect()
+
+        filename = os.path.join(directory, FILENAME)
+
+        OUT.debug('Writing metrics', 6)
+
+        try:
+            write_atomic(filename,
+                         '\n'.join(self.lines(clock() - start)) + '\n')
+        except (IOError, OSError) as e:
+            OUT.die('Unable to write ' + filename + ': ' + str(e))
+
+        OUT.info('Wrote ' + str(sum(self.installs.values()))
+                 + ' installs to ' + filename)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -22,8 +22,34 @@
 
 import re
 
+from fnmatch                import fnmatchcase
 from WebappConfig.debug     import OUT
 
+# ========================================================================
+# Path trie
+# ------------------------------------------------------------------------
+
+# Characters that turn a path component into a shell pattern
+GLOB_CHARS = re.compile('[*?[]')
+
+# Collapses double slashes
+SLASHES    = re.compile('/+')
+
+# Each node of the path trie is a plain list representing one path
+# component. Plain lists keep the trie cheap to build and allow it to be
+# stored as JSON and used again without any conversion. The fields are
+#
+#   - the type of the path itself (EXACT)
+#   - the type of everything underneath it (TREE, set by "dir/**")
+#   - shell patterns matching the components directly below it (GLOBS)
+#   - the nodes of the components directly below it (CHILDREN)
+
+EXACT, TREE, GLOBS, CHILDREN = list(range(4))
+
+def type_node():
+    ''' Return an empty trie node.'''
+    return [None, None, [], {}]
+
 # ========================================================================
 # Handler for File Types
 # ------------------------------------------------------------------------
@@ -36,6 +62,29 @@ class FileType:
 
     - a list of all files and directories owned by the config user
     - a list of all files and directories owned by the server user
+
+    Both lists are compiled into a trie of path components so that a
+    lookup only costs as much as the depth of the path. Apart from
+    plain paths the lists may contain
+
+    - shell patterns in the last path component (e.g. "htdocs/*.ini")
+    - "dir/**" to mark a directory and everything below it
+
+    Plain paths take precedence over patterns and patterns take
+    precedence over "dir/**" rules; the deepest "dir/**" rule wins.
+
+    >>> types = FileType(['htdocs/config.php', 'htdocs/conf/*.ini'],
+    ...                  ['htdocs/cache/**', 'htdocs/config.php'])
+    >>> types.filetype('htdocs/config.php')
+    'config-server-owned'
+    >>> types.filetype('htdocs/conf/local.ini')
+    'config-owned'
+    >>> types.filetype('htdocs/conf/local.php')
+    'virtual'
+    >>> types.dirtype('htdocs/cache')
+    'server-owned'
+    >>> types.filetype('htdocs//cache/a/b/c.tmp')
+    'server-owned'
     '''
 
     def __init__(self,
@@ -48,7 +97,7 @@ class FileType:
         ebuild.
         '''
 
-        self.__cache = {}
+        self.__root = type_node()
 
         # Validity of entries are checked by the command line parser
         self.__virtual_files = virtual_files
@@ -57,24 +106,119 @@ class FileType:
         # populate cache
         for i in config_owned:
 
-            OUT.debug('Adding config-owned file', 8)
+            if OUT.debug_enabled:
+                OUT.debug('Adding config-owned file', 8)
 
-            self.__cache[self.__fix(i)] = 'config-owned'
+            self.__add(i, 'config-owned')
 
         for i in server_owned:
 
-            if self.__fix(i) in list(self.__cache.keys()):
+            if OUT.debug_enabled:
+                OUT.debug('Adding server-owned file', 8)
+
+            self.__add(i, 'server-owned')
+
+    def dump(self):
+        '''
+        Returns the compiled trie. It consists of plain lists and
+        dictionaries only and can be stored as JSON.
+
+        >>> FileType(['a/b'], ['a/*.c']).dump()
+        [None, None, [], {'a': [None, None, [['*.c', 'server-owned']], {'b': ['config-owned', None, [], {}]}]}]
+        '''
+        return self.__root
+
+    def restore(self, data):
+        '''
+        Replaces the trie with one previously returned by dump().
+
+        >>> types = FileType([], [])
+        >>> types.restore(FileType(['a/b'], ['a/*.c']).dump())
+        >>> types.filetype('a/b'), types.filetype('a/x.c')
+        ('config-owned', 'server-owned')
+        '''
+        self.__root = data
 
+    def __add(self, entry, ftype):
+        ''' Insert a single entry of the type lists into the trie.'''
+
+        entry = self.__fix(entry)
+
+        if not entry:
+            return
+
+        components = entry.split('/')
+        last       = components[-1]
+
+        # "dir/**" covers the directory and everything below it
+        recursive  = last == '**' and len(components) > 1
+        if recursive:
+            components = components[:-1]
+            last       = components[-1]
+
+        pattern = bool(GLOB_CHARS.search(last)) and not recursive
+
+        node = self.__root
+        for i in components[:-1]:
+            node = node[CHILDREN].setdefault(i, type_node())
+
+        if pattern:
+            for glob in node[GLOBS]:
+                if glob[0] == last:
+                    glob[1] = self.__combine(glob[1], ftype)
+                    return
+            node[GLOBS].append([last, ftype])
+            return
+
+        node = node[CHILDREN].setdefault(last, type_node())
+
+        if recursive:
+            node[TREE]  = self.__combine(node[TREE], ftype)
+        else:
+            node[EXACT] = self.__combine(node[EXACT], ftype)
+
+    def __combine(self, old, new):
+        ''' Files listed as config and server owned are both.'''
+        if old == 'config-owned' and new == 'server-owned':
+
+            if OUT.debug_enabled:
                 OUT.debug('Adding config-server-owned file', 8)
 
-                self.__cache[self.__fix(i)] = 'config-server-owned'
+            return 'config-server-owned'
+        return new
 
-            else:
+    def __lookup(self, path):
+        ''' Walk the trie and return the type of the given path or
+        None if no rule matches.'''
 
-                OUT.debug('Adding server-owned file', 8)
+        components = self.__fix(path).split('/')
+        last       = len(components) - 1
+        node       = self.__root
+        inherited  = None
+
+        for n, i in enumerate(components):
+
+            if node[TREE]:
+                inherited = node[TREE]
+
+            child = node[CHILDREN].get(i)
 
-                self.__cache[self.__fix(i)] = 'server-owned'
+            if n == last:
+                if child and child[EXACT]:
+                    return child[EXACT]
+                for glob, gtype in node[GLOBS]:
+                    if fnmatchcase(i, glob):
+                        return gtype
+                if child and child[TREE]:
+                    return child[TREE]
+                return inherited
 
+            if not child:
+                return inherited
+
+            node = child
+
+        return inherited
 
     def filetype(self, filename):
         '''
@@ -99,12 +243,10 @@ class FileType:
           what type virtual files are really reported as
         '''
 
-        # remove any whitespace and trailing /
-        filename = self.__fix(filename)
-
         # look for config-protected files in the cache
-        if filename in list(self.__cache.keys()):
-            return self.__cache[filename]
+        result = self.__lookup(filename)
+        if result:
+            return result
 
         # unspecified file (and thus virtual)
         return self.__virtual_files
@@ -130,12 +272,10 @@ class FileType:
           what type default directories are really reported as
         '''
 
-        # remove any whitespace and trailing /
-        directory = self.__fix(directory)
-
         # check the cache
-        if directory in list(self.__cache.keys()):
-            return self.__cache[directory]
+        result = self.__lookup(directory)
+        if result:
+            return result
 
         # unspecified directories are default-owned
         return self.__default_dirs
@@ -143,10 +283,12 @@ class FileType:
     def __fix(self, filename):
         ''' Removes trailing slash and whitespace from a path '''
         filename = filename.strip()
-        while filename[-1] == '/':
+        while filename and filename[-1] == '/':
             filename = filename[:-1]
 
         # Fix double slashes
-        filename = re.compile('/+').sub('/', filename) 
+        return SLASHES.sub('/', filename)
 
-        return filename
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -0,0 +1,294 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Runs the hook scripts provided by an ebuild.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import os, os.path, re, signal, sys, tempfile, time
+
+from WebappConfig.debug  import OUT
+from WebappConfig.events import EVENTS, clock
+
+# ========================================================================
+# Stages
+# ------------------------------------------------------------------------
+
+# Hooks starting with the same number (e.g. "10-warm-cache" and
+# "10-compile-templates") are independent of each other
+STAGE = re.compile('([0-9]+)[-_.]')
+
+# Seconds between SIGTERM and SIGKILL for hooks that timed out
+GRACE = 5
+
+# Whether we can sleep until a child exits (python 3.3 and newer).
+# Otherwise the hooks are polled.
+SIGWAIT = hasattr(signal, 'sigtimedwait')
+
+# Polling interval without SIGWAIT
+POLL  = 0.05
+
+def stages(names):
+    '''
+    Order the hooks by name and group them into stages. The hooks of a
+    stage run at the same time, the stages one after the other. Hooks
+    without a number run on their own.
+
+    >>> stages(['20-migrate', 'zz', '10-b', 'aa', '10-a', '10b'])
+    [['10-a', '10-b'], ['10b'], ['20-migrate'], ['aa'], ['zz']]
+    '''
+    result = []
+    last   = None
+
+    for name in sorted(names):
+        match = STAGE.match(name)
+        stage = match and match.group(1)
+
+        if stage and stage == last:
+            result[-1].append(name)
+        else:
+            result.append([name])
+
+        last = stage
+
+    return result
+
+def exit_status(retval):
+    '''
+    Convert a status as returned by waitpid() the way Sandbox.spawn()
+    does: the signal shifted by 8 bits or the exit code.
+
+    >>> exit_status(3 << 8), exit_status(signal.SIGKILL)
+    (3, 2304)
+    '''
+    if retval & 0xff:
+        return (retval & 0xff) << 8
+    return retval >> 8
+
+# ========================================================================
+# Hook runner
+# ------------------------------------------------------------------------
+
+class Hook:
+    ''' A single hook script and the result of running it.'''
+
+    def __init__(self, directory, name):
+
+        self.name      = name
+        self.path      = directory + '/' + name
+
+        # The action (install, clean)
+        self.type      = None
+
+        self.pid       = None
+        self.started   = None
+        self.duration  = None
+        self.status    = None
+        self.timed_out = False
+
+        # When the hook is signalled next (None for never)
+        self.deadline  = None
+
+        # Captured output
+        self.stdout    = None
+        self.stderr    = None
+
+class HookRunner:
+    '''
+    Runs the executables of a hook directory through the sandbox.
+
+    Every hook gets its own process group, /dev/null as input and files
+    capturing its output. The output is shown once the hook finished so
+    that hooks running at the same time do not mix their output. Hooks
+    running longer than the timeout (in seconds, 0 meaning none) are
+    terminated. The resource limits (see sandbox.parse_limits()) apply
+    to every single hook.
+    '''
+
+    def __init__(self, sandbox, timeout = 0, limits = None):
+
+        self.sandbox = sandbox
+        self.timeout = timeout
+        self.limits  = limits
+
+    def run(self, directory, type, env):
+        ''' Run all hooks for the given action and return them.'''
+
+        names = [i for i in os.listdir(directory)
+                 if (os.path.isfile(directory + '/' + i) and
+                     os.access(directory + '/' + i, os.X_OK))]
+
+        hooks = []
+        for stage in stages(names):
+            running = [self.start(Hook(directory, i), type, env)
+                       for i in stage]
+            self.wait(running)
+            hooks += running
+
+        self.report(hooks, type)
+
+        return hooks
+
+    def start(self, hook, type, env):
+        ''' Start a hook in the background.'''
+
+        OUT.debug('Running hook script', 7)
+
+        hook.type   = type
+        hook.stdout = tempfile.TemporaryFile()
+        hook.stderr = tempfile.TemporaryFile()
+
+        null = os.open(os.devnull, os.O_RDONLY)
+        try:
+            hook.started = clock()
+            hook.pid     = self.sandbox.start(hook.path + ' ' + type, env,
+                                              {0: null,
+                                               1: hook.stdout.fileno(),
+                                               2: hook.stderr.fileno()},
+                                              group  = True,
+                                              limits = self.limits)
+        finally:
+            os.close(null)
+
+        if self.timeout:
+            hook.deadline = hook.started + self.timeout
+
+        return hook
+
+    def wait(self, running):
+        ''' Wait for the hooks, enforcing the timeout.'''
+
+        if not self.timeout:
+            # Nothing to enforce, simply block until each hook exits
+            for hook in running:
+                pid, retval = os.waitpid(hook.pid, 0)
+                self.done(hook, retval)
+            return
+
+        # A hook exiting after it has been checked below leaves SIGCHLD
+        # pending, so the wait for the signal cannot miss it
+        if SIGWAIT:
+            mask = signal.pthread_sigmask(signal.SIG_BLOCK, [signal.SIGCHLD])
+
+        try:
+            pending = list(running)
+
+            while True:
+                for hook in list(pending):
+                    pid, retval = os.waitpid(hook.pid, os.WNOHANG)
+
+                    if pid:
+                        pending.remove(hook)
+                        self.done(hook, retval)
+
+                    elif (hook.deadline is not None and
+                          clock() >= hook.deadline):
+                        self.kill(hook)
+
+                if not pending:
+                    break
+
+                deadlines = [i.deadline for i in pending
+                             if i.deadline is not None]
+
+                # Sleep until a child exits or the next deadline
+                if not SIGWAIT:
+                    time.sleep(POLL)
+                elif deadlines:
+                    signal.sigtimedwait([signal.SIGCHLD],
+                                        max(min(deadlines) - clock(), 0))
+                else:
+                    signal.sigwaitinfo([signal.SIGCHLD])
+        finally:
+            if SIGWAIT:
+                signal.pthread_sigmask(signal.SIG_SETMASK, mask)
+
+    def done(self, hook, retval):
+        ''' Record the status of an exited hook.'''
+
+        hook.duration = clock() - hook.started
+        hook.status   = exit_status(retval)
+        hook.deadline = None
+        self.finish(hook)
+
+    def kill(self, hook):
+        ''' Terminate a hook that passed its deadline.'''
+
+        if not hook.timed_out:
+            hook.timed_out = True
+            hook.deadline  = clock() + GRACE
+            sig            = signal.SIGTERM
+        else:
+            hook.deadline  = None
+            sig            = signal.SIGKILL
+
+        try:
+            os.killpg(hook.pid, sig)
+        except OSError:
+            pass
+
+    def finish(self, hook):
+        ''' Show the output of a hook and log the result.'''
+
+        sizes = []
+        for captured, stream in [(hook.stdout, sys.stdout),
+                                 (hook.stderr, sys.stderr)]:
+            captured.seek(0)
+            data = captured.read()
+            captured.close()
+            sizes.append(len(data))
+
+            if data:
+                OUT.flush()
+                stream.write(data.decode('utf-8', 'replace'))
+                stream.flush()
+
+        hook.stdout = hook.stderr = None
+
+        if hook.timed_out:
+            OUT.warn('Hook ' + hook.name + ' timed out after '
+                     + str(self.timeout) + ' seconds')
+        elif hook.status:
+            OUT.warn('Hook ' + hook.name + ' failed with status '
+                     + str(hook.status))
+
+        EVENTS.emit('hook-run', hook.path,
+                    duration  = hook.duration,
+                    hook      = hook.type,
+                    status    = hook.status,
+                    timed_out = hook.timed_out,
+                    stdout    = sizes[0],
+                    stderr    = sizes[1])
+
+    def report(self, hooks, type):
+        ''' Summarize duration and exit status of all hooks.'''
+
+        if not hooks:
+            return
+
+        OUT.info('  Ran ' + str(len(hooks)) + ' ' + type + ' hook(s)', 1)
+
+        width = max([len(i.name) for i in hooks])
+        for hook in hooks:
+            OUT.info('    %-*s %8.2f s  status %d%s' % (
+                width, hook.name, hook.duration, hook.status,
+                hook.timed_out and '  (timed out)' or ''), 1)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
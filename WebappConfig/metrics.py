@@ -0,0 +1,266 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Counts the work done by a run (--metrics).  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import atexit, json, os, time
+
+from WebappConfig.debug  import OUT
+from WebappConfig.events import clock
+
+# ========================================================================
+# Prometheus text format
+# ------------------------------------------------------------------------
+
+# All metric names start with this prefix
+PREFIX = 'webapp_config_'
+
+def escape(value):
+    '''
+    Escape a label value.
+
+    >>> print(escape('a "b"\\\\c'))
+    a \\"b\\"\\\\c
+    '''
+    return str(value).replace('\\', '\\\\').replace('"', '\\"') \
+                     .replace('\n', '\\n')
+
+def format_labels(labels):
+    '''
+    >>> format_labels({'pn': 'horde', 'cat': 'www-apps'})
+    '{cat="www-apps",pn="horde"}'
+    >>> format_labels({})
+    ''
+    '''
+    if not labels:
+        return ''
+    return '{' + ','.join(['%s="%s"' % (i, escape(labels[i]))
+                           for i in sorted(labels)]) + '}'
+
+def format_value(value):
+    '''
+    >>> format_value(3), format_value(0.25)
+    ('3', '0.25')
+    '''
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+def format_metric(name, kind, help, samples):
+    '''
+    The lines of a metric family. "samples" is a list of (labels,
+    value) pairs.
+
+    >>> for i in format_metric('installs', 'gauge', 'Virtual installs',
+    ...                        [({'pn': 'horde'}, 2)]):
+    ...     print(i)
+    # HELP webapp_config_installs Virtual installs
+    # TYPE webapp_config_installs gauge
+    webapp_config_installs{pn="horde"} 2
+    '''
+    lines = ['# HELP ' + PREFIX + name + ' ' + help,
+             '# TYPE ' + PREFIX + name + ' ' + kind]
+    for labels, value in samples:
+        lines.append(PREFIX + name + format_labels(labels) + ' '
+                     + format_value(value))
+    return lines
+
+def write_atomic(filename, text):
+    '''
+    Replace the file in a single step so that readers like the textfile
+    collector of the node exporter never see a partial file. The
+    temporary name does not end in ".prom" and is therefore ignored by
+    the collector.
+    '''
+    tmp = filename + '.' + str(os.getpid())
+    try:
+        f = open(tmp, 'w')
+        try:
+            f.write(text)
+        finally:
+            f.close()
+        os.rename(tmp, filename)
+    except (IOError, OSError):
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+
+# ========================================================================
+# Registry
+# ------------------------------------------------------------------------
+
+# The metrics counted during a run. Names ending in "_seconds" are
+# timers.
+HELP = {
+    'files_linked'         : 'Files hard linked into the install location',
+    'files_copied'         : 'Files copied into the install location',
+    'symlinks_created'     : 'Symbolic links created in the install location',
+    'directories_created'  : 'Directories created in the install location',
+    'files_removed'        : 'Files and links removed from the install '
+                             'location',
+    'directories_removed'  : 'Directories removed from the install location',
+    'files_protected'      : 'Files installed under a CONFIG_PROTECT name',
+    'files_hashed'         : 'Files whose md5 sum was calculated',
+    'bytes_hashed'         : 'Bytes read to calculate md5 sums',
+    'manifest_checksums'   : 'md5 sums taken from the manifest instead',
+    'stat_calls'           : 'stat() calls for modification times, sizes '
+                             'and permissions',
+    'nss_lookups'          : 'User and group lookups that missed the cache',
+    'hooks_run'            : 'Hook scripts run',
+    'hook_seconds'         : 'Time spent running hook scripts',
+    'contents_entries_read': 'Entries read from CONTENTS files',
+    'contents_read_seconds': 'Time spent reading CONTENTS files',
+    'db_files_read'        : 'Install database files read',
+    'db_installs_read'     : 'Install records read from the database',
+    }
+
+class Timer:
+    ''' Adds the duration of a "with" statement to a metric.'''
+
+    def __init__(self, metrics, name):
+
+        self.metrics = metrics
+        self.name    = name
+
+    def __enter__(self):
+        self.start = clock()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        self.metrics.add(self.name, clock() - self.start)
+
+class Metrics:
+    '''
+    Counters that are always collected. Incrementing one costs a
+    dictionary update, so call sites do not need to check whether the
+    metrics are written at all.
+
+    >>> m = Metrics()
+    >>> m.add('files_linked')
+    >>> m.add('bytes_hashed', 512)
+    >>> with m.timer('hook_seconds'):
+    ...     pass
+    >>> m.values['files_linked'], m.values['bytes_hashed']
+    (1, 512)
+    >>> m.summary()
+    '512 bytes hashed, 1 files linked'
+    >>> data = json.loads(m.json())
+    >>> data['metrics']['files_linked'], data['metrics']['hooks_run']
+    (1, 0)
+    >>> [i for i in m.prometheus().split('\\n') if 'files_linked' in i]
+    ['# HELP webapp_config_files_linked Files hard linked into the install location during the last run', '# TYPE webapp_config_files_linked gauge', 'webapp_config_files_linked 1']
+    '''
+
+    def __init__(self):
+
+        self.values  = {}
+
+        # Where to write the metrics at exit (empty for nowhere)
+        self.output  = ''
+        self.format  = 'json'
+
+        # Added to every Prometheus sample (e.g. the action)
+        self.labels  = {}
+
+        self.__start = clock()
+
+    def add(self, name, amount = 1):
+        ''' Increase a metric.'''
+        self.values[name] = self.values.get(name, 0) + amount
+
+    def timer(self, name):
+        ''' Return a context manager adding its duration to a metric.'''
+        return Timer(self, name)
+
+    def enable(self, output, format = None):
+        '''
+        Write the metrics to "output" at exit. Without a format, files
+        ending in ".prom" get the Prometheus text format and all others
+        JSON.
+        '''
+        if not format:
+            if output.endswith('.prom'):
+                format = 'prometheus'
+            else:
+                format = 'json'
+        self.output = output
+        self.format = format
+
+    def all(self):
+        ''' All known metrics (zero if not counted) and all counted.'''
+        result = dict((i, 0) for i in HELP)
+        result.update(self.values)
+        return result
+
+    def summary(self):
+        ''' The counted metrics in a single line.'''
+        return ', '.join(['%s %s' % (format_value(self.values[i]),
+                                     i.replace('_', ' '))
+                          for i in sorted(self.values)
+                          if not i.endswith('_seconds')])
+
+    def json(self):
+        return json.dumps({'time'     : time.time(),
+                           'duration' : clock() - self.__start,
+                           'labels'   : self.labels,
+                           'metrics'  : self.all()},
+                          indent = 2, sort_keys = True) + '\n'
+
+    def prometheus(self):
+        lines = []
+        values = self.all()
+        for name in sorted(values):
+            lines += format_metric(name, 'gauge',
+                                   HELP.get(name, name.replace('_', ' '))
+                                   + ' during the last run',
+                                   [(self.labels, values[name])])
+        lines += format_metric('last_run_timestamp_seconds', 'gauge',
+                               'End of the last run',
+                               [(self.labels, time.time())])
+        lines += format_metric('last_run_duration_seconds', 'gauge',
+                               'Duration of the last run',
+                               [(self.labels, clock() - self.__start)])
+        return '\n'.join(lines) + '\n'
+
+    def write(self):
+        ''' Write the metrics if requested. Never fails the run.'''
+        if not self.output:
+            return
+
+        if self.format == 'prometheus':
+            text = self.prometheus()
+        else:
+            text = self.json()
+
+        try:
+            write_atomic(self.output, text)
+        except (IOError, OSError) as e:
+            OUT.warn('Unable to write the metrics to ' + self.output + ': '
+                     + str(e))
+
+## global metrics
+METRICS = Metrics()
+
+## write the metrics on exit
+atexit.register(METRICS.write)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -25,6 +25,9 @@ file permission settings with values supplied by the user.
 
 import re, grp, pwd
 
+from WebappConfig.metrics  import METRICS
+from WebappConfig.profiler import PROFILE
+
 # ========================================================================
 # Permission Helper
 # ------------------------------------------------------------------------
@@ -58,75 +61,98 @@ class PermissionMap:
         Test the simple case:
 
         >>> a = PermissionMap('0777')
-        >>> a(0644)
+        >>> a(0o644)
         511
-        >>> a(0000)
+        >>> a(0o000)
         511
         >>> a = PermissionMap('o+x')
-        >>> a(0000)
+        >>> a(0o000)
         1
         >>> a = PermissionMap('ugo+rwx')
-        >>> a(0000)
+        >>> a(0o000)
         511
         >>> a = PermissionMap('u=rwx,g=x,o=w')
-        >>> a(0644)
+        >>> a(0o644)
         458
         >>> a = PermissionMap('u-rw,g=x,o+x')
-        >>> a(0644)
+        >>> a(0o644)
         13
         >>> a = PermissionMap('u-rwx,g-rwx,o-x')
-        >>> a(0751)
+        >>> a(0o751)
         0
         >>> a = PermissionMap('u=rw,g=r,o=')
-        >>> a(0000)
+        >>> a(0o000)
         416
-        '''
 
-        # Check if the permissions are absolute
+        Absolute permissions do not depend on the argument at all:
+
+        >>> PermissionMap('0755')('0644')
+        493
+        '''
 
+        # Absolute permissions
         if self.__absolute:
-            return self.__permissions
-        else:
+            return self.__or
+
+        # The permission map has been compiled into two masks
+        return (permissions & self.__and) | self.__or
+
+    def __compile(self, clauses):
+        ''' Compile the symbolic clauses into a pair of masks.
+
+        Each clause clears some bits and sets others, i.e. it maps the
+        permissions p to (p & and_mask) | or_mask. Applying a second
+        clause with the masks a2 and o2 yields
+
+          (p & and_mask & a2) | (or_mask & a2) | o2
+
+        which is of the same form again. So the whole list collapses
+        into a single pair of masks.
+
+        >>> PermissionMap('a+r')._PermissionMap__compile(['go-w', 'u+x'])
+        (-19, 64)
+        '''
 
-            for i in self.__permissions:
+        and_mask = ~0
+        or_mask  = 0
 
-                # Permission mask. More complex
+        for i in clauses:
 
-                entity   = self.valid.match(i).group(1)
-                operator = self.valid.match(i).group(2)
-                perm     = self.valid.match(i).group(3)
+            entity, operator, perm = self.valid.match(i).groups()
 
-                # Generate the permission bits
+            # Generate the permission bits
 
-                perm_bit = 0
+            perm_bit = 0
 
-                for i in perm:
-                    if i == 'r':
-                        perm_bit |= READ
-                    if i == 'w':
-                        perm_bit |= WRITE
-                    if i == 'x':
-                        perm_bit |= EXECUTE
+            for i in perm:
+                if i == 'r':
+                    perm_bit |= READ
+                if i == 'w':
+                    perm_bit |= WRITE
+                if i == 'x':
+                    perm_bit |= EXECUTE
 
-                for i in entity:
-                    if i == 'u':
-                        shift = [ USER  ]
-                    if i == 'g':
-                        shift = [ GROUP ]
-                    if i == 'o':
-                        shift = [ OTHER ]
-                    if i == 'a':
-                        shift = [ USER, GROUP, OTHER ]
+            for i in entity:
+                if i == 'u':
+                    shift = [ USER  ]
+                if i == 'g':
+                    shift = [ GROUP ]
+                if i == 'o':
+                    shift = [ OTHER ]
+                if i == 'a':
+                    shift = [ USER, GROUP, OTHER ]
 
-                    for j in shift:
-                        if operator == '=':
-                            permissions &= ~(ALL << j)
-                        if operator == '-':
-                            permissions &= ~(perm_bit << j)
-                        if operator == '+' or operator == '=':
-                            permissions |= (perm_bit << j)
+                for j in shift:
+                    if operator == '=':
+                        and_mask &= ~(ALL << j)
+                        or_mask  &= ~(ALL << j)
+                    if operator == '-':
+                        and_mask &= ~(perm_bit << j)
+                        or_mask  &= ~(perm_bit << j)
+                    if operator == '+' or operator == '=':
+                        or_mask  |= (perm_bit << j)
 
-        return permissions
+        return (and_mask, or_mask)
 
     def __init__(self, permissions):
         '''Check that the given permission map evaluates to something
@@ -162,6 +188,8 @@ class PermissionMap:
         if re.compile('[0-7]{4}').match(permissions):
             self.__absolute    = True
             self.__permissions = eval("0o"+permissions)
+            self.__and         = 0
+            self.__or          = self.__permissions
 
         else:
             # Split on commas first
@@ -179,12 +207,96 @@ class PermissionMap:
             self.__permissions = splitted_permissions
             self.__absolute    = False
 
+            (self.__and, self.__or) = self.__compile(splitted_permissions)
+
     def __str__(self):
       if self.__absolute:
         return 'Absolute: {}'.format(oct(self.__permissions))
       else:
         return 'Relative: {}'.format(self.__permissions)
 
+# ========================================================================
+# User and group lookups
+# ------------------------------------------------------------------------
+
+# The results of all user and group lookups of this process. Depending on
+# the NSS setup (e.g. LDAP) a single lookup can be expensive, so failed
+# lookups are remembered as well.
+nss_cache = {}
+
+# Marks failed lookups in the cache
+MISSING = object()
+
+def nss_lookup(function, key):
+    '''
+    Call one of the pwd/grp lookup functions at most once per key.
+    Raises KeyError if the user or group does not exist.
+
+    >>> nss_lookup(pwd.getpwnam, 'root')[2]
+    0
+    >>> (pwd.getpwnam, 'root') in nss_cache
+    True
+    '''
+    try:
+        result = nss_cache[(function, key)]
+    except KeyError:
+        try:
+            METRICS.add('nss_lookups')
+            with PROFILE.phase('nss', False):
+                result = function(key)
+        except KeyError:
+            result = MISSING
+        nss_cache[(function, key)] = result
+
+    if result is MISSING:
+        # A fresh exception does not keep the traceback of the first
+        # failure alive
+        raise KeyError(key)
+
+    return result
+
+def getpwuid(uid):
+    ''' Cached pwd.getpwuid().'''
+    return nss_lookup(pwd.getpwuid, uid)
+
+def getpwnam(name):
+    ''' Cached pwd.getpwnam().'''
+    return nss_lookup(pwd.getpwnam, name)
+
+def getgrgid(gid):
+    ''' Cached grp.getgrgid().'''
+    return nss_lookup(grp.getgrgid, gid)
+
+def getgrnam(name):
+    ''' Cached grp.getgrnam().'''
+    return nss_lookup(grp.getgrnam, name)
+
+def prefetch(users = [], groups = []):
+    '''
+    Resolve a set of users and groups in one go, e.g. before a batch
+    of installs. Unknown principals are remembered as such and do not
+    raise an error here.
+
+    >>> prefetch(['root', 'does_not_exist'], [0])
+    >>> (pwd.getpwnam, 'does_not_exist') in nss_cache
+    True
+    '''
+    for i in users:
+        try:
+            get_user(i)
+        except KeyError:
+            pass
+
+    for i in groups:
+        try:
+            get_group(i)
+        except KeyError:
+            pass
+
+def clear_nss_cache():
+    ''' Forget all lookups, e.g. in long running processes.'''
+    nss_cache.clear()
+
 def get_group(group):
     '''
     Specify a group id either as integer, as string that can
@@ -220,14 +332,14 @@ def get_group(group):
     if ngroup != -1:
         try:
             # Try to match the integer to a group id
-            gid = grp.getgrgid(ngroup)[2]
+            gid = getgrgid(ngroup)[2]
         except KeyError:
             pass
 
     if gid == -1:
         # No success yet. Try to match to the group name
         try:
-            gid = grp.getgrnam(str(group))[2]
+            gid = getgrnam(str(group))[2]
         except KeyError:
             raise KeyError('The given group "' + str(group)
                            + '" does not exist!')
@@ -268,14 +380,14 @@ def get_user(user):
     if nuser != -1:
         try:
             # Try to match the integer to a user id
-            uid = pwd.getpwuid(nuser)[2]
+            uid = getpwuid(nuser)[2]
         except KeyError:
             pass
 
     if uid == -1:
         # No success yet. Try to match to the user name
         try:
-            uid = pwd.getpwnam(str(user))[2]
+            uid = getpwnam(str(user))[2]
         except KeyError:
             raise KeyError('The given user "' + str(user)
                            + '" does not exist!')
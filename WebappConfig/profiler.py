@@ -0,0 +1,250 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Measures where a run spends its time (--profile).  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import sys, textwrap
+
+from WebappConfig.debug  import OUT
+from WebappConfig.events import clock
+from WebappConfig.metrics import METRICS
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# ========================================================================
+# Phases
+# ------------------------------------------------------------------------
+
+# The resource usage fields recorded per phase
+USAGE = ['ru_utime', 'ru_stime', 'ru_majflt', 'ru_inblock', 'ru_oublock',
+         'ru_nvcsw']
+
+def usage():
+    ''' The resource usage of this process so far.'''
+    if resource is None:
+        return [0] * len(USAGE)
+    current = resource.getrusage(resource.RUSAGE_SELF)
+    return [getattr(current, i) for i in USAGE]
+
+class Phase:
+    '''
+    The accumulated cost of a part of the run.
+
+    "wait" is the wall clock time not spent on the CPU: waiting for the
+    disk or a network file system, for hook scripts or for NSS.
+    '''
+
+    def __init__(self, name):
+
+        self.name    = name
+        self.calls   = 0
+        self.wall    = 0.0
+
+        # None for phases measured by the wall clock only
+        self.usage   = None
+
+    def add(self, wall, usage = None):
+        self.calls += 1
+        self.wall  += wall
+        if usage:
+            self.usage = [i + j for i, j in
+                          zip(self.usage or [0] * len(USAGE), usage)]
+
+    def wait(self):
+        if not self.usage:
+            return None
+        return max(self.wall - self.usage[0] - self.usage[1], 0.0)
+
+    def note(self):
+        ''' What dominates the phase.'''
+        if not self.usage:
+            return ''
+        user, system = self.usage[0], self.usage[1]
+        if self.wait() > user + system and self.wait() > 0.01:
+            return 'waiting'
+        if system > user:
+            return 'syscalls'
+        return ''
+
+class Timer:
+    ''' Measures a phase within a "with" statement.'''
+
+    def __init__(self, profiler, name, rusage):
+
+        self.profiler = profiler
+        self.name     = name
+        self.rusage   = rusage
+
+    def __enter__(self):
+        # Phases are listed in the order they are entered
+        self.phase = self.profiler.get(self.name)
+        if self.rusage:
+            self.usage = usage()
+        self.start = clock()
+        return self
+
+    def __exit__(self, type, value, traceback):
+        wall  = clock() - self.start
+        delta = None
+        if self.rusage:
+            delta = [i - j for i, j in zip(usage(), self.usage)]
+        self.phase.add(wall, delta)
+
+class Null:
+    ''' Stands in for a timer while profiling is disabled.'''
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type, value, traceback):
+        pass
+
+NULL = Null()
+
+# ========================================================================
+# Profiler
+# ------------------------------------------------------------------------
+
+class Profiler:
+    '''
+    Collects per-phase timers and optionally runs the work under
+    cProfile. The counters are those of WebappConfig.metrics.
+
+    >>> p = Profiler()
+    >>> with p.phase('install'):
+    ...     pass
+    >>> p.phases()
+    []
+    >>> p.enable()
+    >>> with p.phase('install'):
+    ...     pass
+    >>> [(i.name, i.calls) for i in p.phases()]
+    [('startup', 1), ('install', 1)]
+    '''
+
+    def __init__(self):
+
+        # Call sites may check this before collecting details
+        self.enabled = False
+
+        # Where to write the cProfile statistics (empty for none)
+        self.output  = ''
+
+        self.__loaded  = clock()
+        self.__usage   = usage()
+        self.__phases  = {}
+        self.__order   = []
+
+    def enable(self, output = ''):
+        '''
+        Start profiling. Everything since this module was loaded is
+        accounted to the "startup" phase.
+        '''
+        self.enabled = True
+        self.output  = output
+
+        self.get('startup').add(clock() - self.__loaded,
+                                [i - j for i, j in
+                                 zip(usage(), self.__usage)])
+
+    def get(self, name):
+        if not name in self.__phases:
+            self.__phases[name] = Phase(name)
+            self.__order.append(name)
+        return self.__phases[name]
+
+    def phases(self):
+        return [self.__phases[i] for i in self.__order]
+
+    def phase(self, name, rusage = True):
+        '''
+        Return a context manager measuring a phase. Phases entered many
+        times per run (e.g. once per file) should skip the resource
+        usage.
+        '''
+        if not self.enabled:
+            return NULL
+        return Timer(self, name, rusage)
+
+    def run(self, function, *args):
+        ''' Run the work, under cProfile if requested.'''
+        if not self.enabled:
+            return function(*args)
+
+        profile = None
+        if self.output:
+            import cProfile
+            profile = cProfile.Profile()
+
+        try:
+            with self.phase('run'):
+                if profile:
+                    return profile.runcall(function, *args)
+                return function(*args)
+        finally:
+            if profile:
+                profile.dump_stats(self.output)
+            self.report()
+
+    def report(self):
+        ''' Print the summary table.'''
+        OUT.flush()
+
+        lines = ['', 'Profile (wall clock, CPU and waiting time in seconds):',
+                 '  %-22s %6s %9s %9s %9s %9s %7s %8s %8s %8s  %s' % (
+                     'phase', 'calls', 'wall', 'user', 'system', 'wait',
+                     'majflt', 'blk-in', 'blk-out', 'ctxsw', '')]
+
+        for i in self.phases():
+            line = '  %-22s %6d %9.3f' % (i.name, i.calls, i.wall)
+            if i.usage:
+                line += ' %9.3f %9.3f %9.3f %7d %8d %8d %8d  %s' % (
+                    tuple(i.usage[:2]) + (i.wait(),) + tuple(i.usage[2:])
+                    + (i.note(),))
+            lines.append(line.rstrip())
+
+        lines.append('')
+        lines.append('  ' + OUT.totals())
+
+        for line in textwrap.wrap(METRICS.summary(), 76):
+            lines.append('  ' + line)
+
+        if resource is not None:
+            own      = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            lines.append('  peak RSS %d KiB, children %d KiB'
+                         % (own, children))
+
+        if self.output:
+            lines.append('  cProfile statistics written to ' + self.output
+                         + ' (python -m pstats ' + self.output + ')')
+
+        for line in lines:
+            sys.stderr.write(line + '\n')
+
+## global profiler
+PROFILE = Profiler()
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -39,11 +39,21 @@ class Protection:
         '''
         This is distribution specific so the information is provided by
         wrapper.py
+
+        CONFIG_PROTECT is only determined once it is actually needed.
         '''
-        self.config_protect = WebappConfig.wrapper.config_protect(cat, pn, pvr, pm)
+        self.__package = (cat, pn, pvr, pm)
         self.protect_prefix = WebappConfig.wrapper.protect_prefix
         self.update_command = WebappConfig.wrapper.update_command
 
+    def __getattr__(self, name):
+        ''' Resolve CONFIG_PROTECT on first access.'''
+        if name == 'config_protect':
+            self.config_protect = WebappConfig.wrapper.config_protect(
+                *self.__package)
+            return self.config_protect
+        raise AttributeError(name)
+
     # ------------------------------------------------------------------------
     # Outputs:
     #   $my_return = the new mangled name (that you can use instead of
@@ -74,7 +84,8 @@ class Protection:
 
         entries = os.listdir(my_filedir)
 
-        OUT.debug('Identifying possible file number', 7)
+        if OUT.debug_enabled:
+            OUT.debug('Identifying possible file number', 7)
 
         numbers = []
         prefix  = self.protect_prefix
@@ -101,7 +112,7 @@ class Protection:
         '''
 
         my_master = []
-        for i in self.config_protect.split(' '):
+        for i in self.config_protect.split():
             if i[0] == '/':
                 if i[-1] == '/':
                     my_master.append(i[:-1])
@@ -0,0 +1,139 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Machine-readable output for the listing actions. Records are
+written as soon as they are handed over so that consumers can start
+processing before the scan has finished.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import sys, json
+
+from collections import OrderedDict
+
+# ========================================================================
+# Record fields
+# ------------------------------------------------------------------------
+
+# The order of the fields in every record we output
+FIELDS = ['cat', 'pn', 'pvr', 'installdir', 'uid', 'gid', 'timestamp']
+
+# Supported output formats
+FORMATS = ['json', 'jsonl', 'tsv']
+
+def make_record(cat = '', pn = '', pvr = '', installdir = '', uid = '',
+                gid = '', timestamp = ''):
+    '''
+    Build a record with all fields in a fixed order. Numerical ids
+    and timestamps are converted to integers where possible.
+
+    >>> list(make_record('www-apps', 'horde', '3.0.5', '/var/www', '0',
+    ...                  'root', '1124612110').values())
+    ['www-apps', 'horde', '3.0.5', '/var/www', 0, 'root', 1124612110]
+    '''
+    record = OrderedDict()
+    for key, value in zip(FIELDS, [cat, pn, pvr, installdir, uid, gid,
+                                   timestamp]):
+        value = str(value).strip()
+        if key in ['uid', 'gid', 'timestamp'] and value.isdigit():
+            value = int(value)
+        record[key] = value
+    return record
+
+# ========================================================================
+# Record writer
+# ------------------------------------------------------------------------
+
+class RecordWriter:
+    '''
+    Streams records in one of the supported formats:
+
+      json   - a single JSON array, one record per line
+      jsonl  - one JSON object per line
+      tsv    - tab separated values preceded by a header line
+
+    >>> w = RecordWriter('jsonl')
+    >>> w.write(make_record('', 'horde', '3.0.5', '/var/www/horde'))
+    {"cat": "", "pn": "horde", "pvr": "3.0.5", "installdir": "/var/www/horde", "uid": "", "gid": "", "timestamp": ""}
+    >>> w.close()
+    '''
+
+    def __init__(self, fmt, out = None):
+
+        if not fmt in FORMATS:
+            raise ValueError('Unknown output format "' + str(fmt) + '"')
+
+        self.__fmt   = fmt
+        self.__out   = out
+        self.__count = 0
+
+    def __stream(self):
+        # Resolve stdout lazily so that redirections done after the
+        # writer was created are honoured.
+        if self.__out:
+            return self.__out
+        return sys.stdout
+
+    def __tsv_field(self, value):
+        ''' Escape characters that would break the tsv layout.'''
+        return str(value).replace('\\', '\\\\').replace('\t', '\\t')\
+            .replace('\n', '\\n')
+
+    def write(self, record):
+        ''' Output a single record.'''
+        out = self.__stream()
+
+        if self.__fmt == 'json':
+            if not self.__count:
+                out.write('[\n')
+            else:
+                out.write(',\n')
+            out.write(json.dumps(record))
+
+        elif self.__fmt == 'jsonl':
+            out.write(json.dumps(record) + '\n')
+
+        elif self.__fmt == 'tsv':
+            if not self.__count:
+                out.write('\t'.join(FIELDS) + '\n')
+            out.write('\t'.join([self.__tsv_field(record.get(i, ''))
+                                 for i in FIELDS]) + '\n')
+
+        self.__count += 1
+
+    def count(self):
+        ''' Return the number of records written so far.'''
+        return self.__count
+
+    def close(self):
+        ''' Terminate the output.'''
+        out = self.__stream()
+
+        if self.__fmt == 'json':
+            if not self.__count:
+                out.write('[')
+            out.write('\n]\n')
+
+        elif self.__fmt == 'tsv' and not self.__count:
+            out.write('\t'.join(FIELDS) + '\n')
+
+        out.flush()
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod(sys.modules[__name__])
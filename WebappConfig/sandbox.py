@@ -22,13 +22,14 @@ Sandbox operations
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os, os.path, sys
+import os, os.path, signal, sys
 
 # stolen from portage
 try:
     import resource
     max_fd_limit = resource.getrlimit(resource.RLIMIT_NOFILE)[0]
 except ImportError:
+    resource = None
     max_fd_limit = 256
 if os.path.isdir("/proc/%i/fd" % os.getpid()):
     def get_open_fds():
@@ -37,6 +38,39 @@ else:
     def get_open_fds():
         return list(range(max_fd_limit))
 
+# Size suffixes for resource limits
+UNITS = {'': 1, 'K': 1024, 'M': 1024 ** 2, 'G': 1024 ** 3}
+
+def parse_limits(limits):
+    '''
+    Parse resource limits given as "name=value" pairs separated by
+    commas. The names are those of the RLIMIT_* constants, sizes may
+    use the suffixes K, M and G.
+
+    >>> sorted(parse_limits('cpu=60, as=512M').items()) == sorted(
+    ...     [(resource.RLIMIT_CPU, 60), (resource.RLIMIT_AS, 512 * 1024 ** 2)])
+    True
+    >>> parse_limits('')
+    {}
+    >>> parse_limits('cpu')
+    Traceback (most recent call last):
+    ...
+    ValueError: Invalid resource limit "cpu"
+    '''
+    result = {}
+
+    for i in [j.strip() for j in limits.split(',') if j.strip()]:
+        name, _, value = i.partition('=')
+        value = value.strip().upper()
+        unit  = value[-1:] if value[-1:] in UNITS else ''
+        try:
+            rlimit = getattr(resource, 'RLIMIT_' + name.strip().upper())
+            result[rlimit] = int(value[:len(value) - len(unit)]) * UNITS[unit]
+        except (AttributeError, TypeError, ValueError):
+            raise ValueError('Invalid resource limit "' + i + '"')
+
+    return result
+
 
 class Sandbox:
     '''
@@ -65,38 +99,64 @@ class Sandbox:
         ''' Return a config option.'''
         return self.config.config.get('USER', option)
 
-    # stolen from portage
-    def spawn(self, mycommand, full_env):
+    # Start commands through posix_spawn() where available. Unlike
+    # fork() this does not need to copy the page tables of the (possibly
+    # large) python process. Requires /proc to find the descriptors that
+    # need to be closed.
+    use_posix_spawn = (hasattr(os, 'posix_spawn') and
+                       os.path.isdir('/proc/%i/fd' % os.getpid()))
+
+    def start(self, mycommand, full_env, fd_pipes = None, group = False,
+              limits = None):
         """
-        Spawns a given command.
+        Starts a given command without waiting for it.
 
         @param mycommand: the command to execute
         @type mycommand: String or List (Popen style list)
         @param full_env: A dict of Key=Value pairs for env variables
         @type full_env: Dictionary
+        @param fd_pipes: Mapping pipes to destination; { 0:0, 1:1, 2:2 }
+        @type fd_pipes: Dictionary
+        @param group: Run the command in a process group of its own
+        @type group: Boolean
+        @param limits: Resource limits for the command (see parse_limits)
+        @type limits: Dictionary
+        @rtype: Integer
+        @returns: The pid of the started process
         """
 
         # Default to propagating our stdin, stdout and stderr.
-        fd_pipes = {0:0, 1:1, 2:2}
-
-        # mypids will hold the pids of all processes created.
-        mypids = []
+        if fd_pipes is None:
+            fd_pipes = {0:0, 1:1, 2:2}
 
         command = []
         command.append(self.sandbox_binary)
         command.append(mycommand)
 
         # merge full_env (w-c variables) with env (write path)
-        self.env.update(full_env)
-        for a in list(self.env.keys()):
-            if not self.env[a]:
-                self.env[a] = ''
+        env = dict(self.env)
+        env.update(full_env)
+        for a in list(env.keys()):
+            if not env[a]:
+                env[a] = ''
+
+        # Resource limits can only be set in a forked child
+        if self.use_posix_spawn and not limits:
+            try:
+                return self._spawn(command, env, fd_pipes, group)
+            except OSError:
+                # Let the forked child report the problem
+                pass
 
         pid = os.fork()
 
         if not pid:
             try:
-                self._exec(command, self.env, fd_pipes)
+                if group:
+                    os.setpgid(0, 0)
+                for rlimit, value in (limits or {}).items():
+                    resource.setrlimit(rlimit, (value, value))
+                self._exec(command, env, fd_pipes)
             except Exception as e:
                 # We need to catch _any_ exception so that it doesn't
                 # propagate out of this function and cause exiting
@@ -105,8 +165,31 @@ class Sandbox:
                 sys.stderr.flush()
                 os._exit(1)
 
+        if group:
+            # Also done here so that the group exists once we return
+            try:
+                os.setpgid(pid, pid)
+            except OSError:
+                pass
+
+        return pid
+
+    # stolen from portage
+    def spawn(self, mycommand, full_env):
+        """
+        Spawns a given command.
+
+        @param mycommand: the command to execute
+        @type mycommand: String or List (Popen style list)
+        @param full_env: A dict of Key=Value pairs for env variables
+        @type full_env: Dictionary
+        """
+
+        # mypids will hold the pids of all processes created.
+        mypids = []
+
         # Add the pid to our list
-        mypids.append(pid)
+        mypids.append(self.start(mycommand, full_env))
 
         # Clean up processes
         while mypids:
@@ -137,6 +220,51 @@ class Sandbox:
         # Everything succeeded
         return 0
 
+    def _spawn(self, binary, env, fd_pipes, group):
+        """
+        Start a given binary with options in a sandbox using
+        posix_spawn().
+
+        @param binary: Name of program to execute
+        @type binary: String
+        @param env: Key,Value mapping for Environmental Variables
+        @type env: Dictionary
+        @param fd_pipes: Mapping pipes to destination; { 0:0, 1:1, 2:2 }
+        @type fd_pipes: Dictionary
+        @param group: Run the command in a process group of its own
+        @type group: Boolean
+        @rtype: Integer
+        @returns: The pid of the started process
+        """
+
+        # Duplicates of the sources are free in the child as well, so
+        # mappings like {1:2, 2:1} cannot clobber each other. They are
+        # not inheritable and go away with the exec.
+        sources = dict([(fd, os.dup(fd_pipes[fd])) for fd in fd_pipes])
+        try:
+            actions = [(os.POSIX_SPAWN_DUP2, sources[fd], fd)
+                       for fd in sources]
+
+            # Close the inheritable descriptors that are not requested.
+            # Only the open descriptors are checked.
+            for fd in get_open_fds():
+                if fd in sources or fd in sources.values():
+                    continue
+                try:
+                    if os.get_inheritable(fd):
+                        actions.append((os.POSIX_SPAWN_CLOSE, fd))
+                except OSError:
+                    pass
+
+            kwargs = {'file_actions': actions}
+            if group:
+                kwargs['setpgroup'] = 0
+
+            return os.posix_spawn(binary[0], binary, env, **kwargs)
+        finally:
+            for fd in sources.values():
+                os.close(fd)
+
     # stolen from portage
     def _exec(self, binary, env, fd_pipes):
 
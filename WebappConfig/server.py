@@ -23,8 +23,10 @@ import os, os.path
 
 from WebappConfig.debug        import OUT
 from WebappConfig.eprefix      import EPREFIX
+from WebappConfig.events       import EVENTS
 from WebappConfig.worker       import WebappRemove, WebappAdd
 from WebappConfig.permissions  import get_group, get_user
+from WebappConfig.profiler     import PROFILE
 
 from WebappConfig.wrapper      import package_installed
 
@@ -108,6 +110,11 @@ class Basic:
 
     def upgrade(self, new_category, new_package, new_version):
 
+        with PROFILE.phase('upgrade'):
+            self.__upgrade(new_category, new_package, new_version)
+
+    def __upgrade(self, new_category, new_package, new_version):
+
         # I have switched the order of upgrades
         # we are now removing the olde app and then installing the new one
         # I am not sure why it was the other way around before
@@ -132,13 +139,20 @@ class Basic:
 
     def clean(self):
 
+        with PROFILE.phase('clean'):
+            self.__clean()
+
+    def __clean(self):
+
         self.file_behind_flag = False
 
         OUT.debug('Basic server clean', 7)
 
-        self.file_behind_flag |= self.__del.remove_files()
+        with PROFILE.phase('clean/files'):
+            self.file_behind_flag |= self.__del.remove_files()
 
-        self.file_behind_flag |= self.__del.remove_dirs()
+        with PROFILE.phase('clean/directories'):
+            self.file_behind_flag |= self.__del.remove_dirs()
 
         OUT.info('Any files or directories listed above must be removed b'
                  'y hand')
@@ -154,7 +168,8 @@ class Basic:
 
         # run the hooks
 
-        self.__ebuild.run_hooks('clean', self)
+        with PROFILE.phase('clean/hooks'):
+            self.__ebuild.run_hooks('clean', self)
 
         # do we need the dotconfig file?
         #
@@ -167,7 +182,8 @@ class Basic:
 
         if not os.listdir(self.__destd) and os.path.isdir(self.__destd):
             if not self.__p:
-                os.rmdir(self.__destd)
+                EVENTS.run('rmdir', self.__destd, 'install-owned',
+                           os.rmdir, self.__destd)
         else:
             OUT.notice('--- ' + self.__destd)
 
@@ -183,6 +199,11 @@ class Basic:
 
     def install(self, upgrade = False):
 
+        with PROFILE.phase('install'):
+            self.__install(upgrade)
+
+    def __install(self, upgrade):
+
         self.config_protected_dirs = []
 
         OUT.debug('Basic server install', 7)
@@ -206,12 +227,12 @@ class Basic:
             # Create the directories
             for i in dirs:
                 if not os.path.isdir(i):
-                    os.mkdir(i)
-                    os.chmod(i, 
-                             self.__perm['dir']['install-owned'][2]('0755'))
-                    os.chown(i,
-                             self.__perm['dir']['install-owned'][0],
-                             self.__perm['dir']['install-owned'][1])
+                    EVENTS.run('mkdir', i, 'install-owned', os.mkdir, i)
+                    EVENTS.run('chmod', i, 'install-owned', os.chmod, i,
+                               self.__perm['dir']['install-owned'][2]('0755'))
+                    EVENTS.run('chown', i, 'install-owned', os.chown, i,
+                               self.__perm['dir']['install-owned'][0],
+                               self.__perm['dir']['install-owned'][1])
 
                 if self.__v:
                     OUT.info('  Creating installation directory: '
@@ -238,7 +259,8 @@ class Basic:
         OUT.info('  Linking in required files', 1)
         OUT.info('    This can take several minutes for larger apps', 1)
 
-        self.__add.mkdirs()
+        with PROFILE.phase('install/files'):
+            self.__add.mkdirs()
 
         self.config_protected_dirs += self.__add.config_protected_dirs
 
@@ -254,7 +276,8 @@ class Basic:
 
         self.__add = wa
 
-        self.__add.mkdirs()
+        with PROFILE.phase('install/hostroot'):
+            self.__add.mkdirs()
 
         self.config_protected_dirs += self.__add.config_protected_dirs
 
@@ -274,14 +297,16 @@ class Basic:
 
         # run the hooks
 
-        self.__ebuild.run_hooks('install', self)
+        with PROFILE.phase('install/hooks'):
+            self.__ebuild.run_hooks('install', self)
 
         # show the post-installation instructions
 
-        if not upgrade:
-            self.__ebuild.show_postinst(self)
-        else:
-            self.__ebuild.show_postupgrade(self)
+        with PROFILE.phase('install/instructions'):
+            if not upgrade:
+                self.__ebuild.show_postinst(self)
+            else:
+                self.__ebuild.show_postupgrade(self)
 
         # to finish, we need to tell the user if they need to run
         # etc-update or not
@@ -293,7 +318,8 @@ class Basic:
 
             self.__protect.how_to_update(self.config_protected_dirs)
 
-        self.__content.write()
+        with PROFILE.phase('install/contents'):
+            self.__content.write()
 
         # and we're done
 
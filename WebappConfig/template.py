@@ -0,0 +1,251 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Renders the post-installation instructions provided by an ebuild.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import re, subprocess
+
+from WebappConfig.db    import read_cached
+from WebappConfig.debug import OUT
+
+# ========================================================================
+# Shell emulation
+# ------------------------------------------------------------------------
+
+# Each line of the instruction files used to be handed to the shell as
+#
+#   printf "<line>"
+#
+# with all double quotes of the line escaped. The functions below do the
+# same for the subset used by the ebuilds: "$VAR" and "${VAR}" and the
+# usual printf escapes. Everything else (command substitution, parameter
+# operators, printf conversions, ...) is still handed to the shell.
+
+# Variable names
+NAME = re.compile('[A-Za-z_][A-Za-z0-9_]*')
+
+# Special parameters, $(...) and $((...))
+SPECIAL = '0123456789@*#?$!-('
+
+# Characters a backslash escapes within double quotes
+QUOTED = '$`"\\'
+
+# The printf escapes that all shells agree on
+ESCAPES = {'\\': '\\', 'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n',
+           'r': '\r', 't': '\t', 'v': '\v'}
+
+def compile_line(line):
+    '''
+    Split a line into literal strings and variable references (as
+    one element tuples) the way the shell would expand it within
+    double quotes. Returns None if the line uses anything else.
+
+    >>> compile_line('Point ${VHOST_HOSTNAME}/$PN to \\\\$HOME\\n')
+    ['Point ', ('VHOST_HOSTNAME',), '/', ('PN',), ' to $HOME\\n']
+    >>> compile_line('Run $(id -u)') is None
+    True
+    '''
+    line   = line.replace('"', '\\"')
+    parts  = []
+    chunk  = []
+    i      = 0
+
+    while i < len(line):
+        c = line[i]
+
+        if c == '\\':
+            if line[i + 1:i + 2] == '\n':
+                # Line continuation
+                i += 2
+                continue
+            if line[i + 1:i + 2] and line[i + 1] in QUOTED:
+                chunk.append(line[i + 1])
+                i += 2
+                continue
+            chunk.append(c)
+            i += 1
+            continue
+
+        if c == '$':
+            braced = line[i + 1:i + 2] == '{'
+            start  = i + 1 + braced
+            name   = NAME.match(line, start)
+
+            if braced:
+                if not name or line[name.end():name.end() + 1] != '}':
+                    return None
+                end = name.end() + 1
+            elif name:
+                end = name.end()
+            elif line[start:start + 1] and line[start] in SPECIAL:
+                return None
+            else:
+                chunk.append(c)
+                i += 1
+                continue
+
+            if chunk:
+                parts.append(''.join(chunk))
+                chunk = []
+            parts.append((name.group(),))
+            i = end
+            continue
+
+        if c in '`"':
+            return None
+
+        chunk.append(c)
+        i += 1
+
+    if chunk:
+        parts.append(''.join(chunk))
+
+    return parts
+
+def printf(format):
+    '''
+    Output of printf for a format without arguments. Returns None for
+    conversions and escapes that shells handle differently.
+
+    >>> printf('100%% done\\\\tin %s\\\\n')
+    >>> printf('100%% done\\\\tin /var/www\\\\n')
+    '100% done\\tin /var/www\\n'
+    '''
+    if not '\\' in format and not '%' in format:
+        return format
+
+    result = []
+    i      = 0
+
+    while i < len(format):
+        c = format[i]
+
+        if c == '%':
+            if format[i + 1:i + 2] != '%':
+                return None
+            result.append('%')
+            i += 2
+            continue
+
+        if c == '\\':
+            escape = ESCAPES.get(format[i + 1:i + 2])
+            if escape is None:
+                return None
+            result.append(escape)
+            i += 2
+            continue
+
+        result.append(c)
+        i += 1
+
+    return ''.join(result)
+
+def shell(line, variables):
+    ''' Let the shell render a line.'''
+    command = 'printf "' + line.replace('"', '\\"') + '"\n'
+
+    OUT.debug('Rendering line in the shell', 8)
+
+    output = subprocess.Popen(command,
+                              shell  = True,
+                              env    = variables,
+                              stdout = subprocess.PIPE,
+                              universal_newlines = True).communicate()[0]
+    return output[:-1]
+
+# ========================================================================
+# Templates
+# ------------------------------------------------------------------------
+
+class Template:
+    '''
+    The lines of an instruction file, compiled once.
+
+    >>> t = Template(['Installed into ${MY_INSTALLDIR}\\n',
+    ...               'User: $(whoami)\\n'])
+    >>> sorted(t.references)
+    ['MY_INSTALLDIR']
+    >>> t.render({'MY_INSTALLDIR': '/var/www/localhost/htdocs/horde'})[0]
+    'Installed into /var/www/localhost/htdocs/horde'
+    '''
+
+    def __init__(self, lines):
+
+        self.lines    = lines
+        self.compiled = [compile_line(i) for i in lines]
+
+        # The variables a rendered template depends on
+        self.references = frozenset(
+            j[0]
+            for i in self.compiled if i is not None
+            for j in i if isinstance(j, tuple))
+
+        # True if any line needs the shell
+        self.shell = any(i is None for i in self.compiled)
+
+        # Rendered output by the values of the referenced variables
+        self.__rendered = {}
+
+    def key(self, variables):
+        ''' The part of the variables the output depends on.'''
+        if self.shell:
+            # The shell may refer to anything
+            return None
+        return tuple(sorted((i, variables.get(i))
+                            for i in self.references))
+
+    def render(self, variables):
+        ''' Render all lines, each one without its last character.'''
+        key = self.key(variables)
+        if key is not None and key in self.__rendered:
+            return self.__rendered[key]
+
+        result = []
+        for line, parts in zip(self.lines, self.compiled):
+
+            output = None
+            if parts is not None:
+                output = printf(''.join(
+                    [variables.get(i[0], '') if isinstance(i, tuple) else i
+                     for i in parts]))
+
+            if output is None:
+                output = shell(line, variables)
+            else:
+                output = output[:-1]
+
+            result.append(output)
+
+        if key is not None:
+            self.__rendered[key] = result
+
+        return result
+
+def parse_template(f):
+    ''' Compile an opened instruction file.'''
+    return Template(f.readlines())
+
+def read_template(filename):
+    ''' The compiled instruction file (kept in memory while unchanged).'''
+    return read_cached(filename, parse_template)
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
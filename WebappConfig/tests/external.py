@@ -18,19 +18,53 @@ from __future__ import print_function
 
 '''Runs external (non-doctest) test cases.'''
 
+import io
+import itertools
+import json
+import operator
 import os
+import pwd
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import tempfile
+import time
 import unittest
 import sys
 
-from  WebappConfig.config    import Config
+import WebappConfig.cleaner as cleaner
+import WebappConfig.config
+import WebappConfig.hooks as hooks
+import WebappConfig.wrapper as wrapper
+
+from  WebappConfig.batch     import Batch, Operation, read_operations
+from  WebappConfig.cleaner   import candidates, inventory, select, \
+                                    write_json
+from  WebappConfig.config    import BashConfigParser, Config
 from  WebappConfig.content   import Contents
-from  WebappConfig.db        import WebappDB, WebappSource
-from  WebappConfig.debug     import OUT
+from  WebappConfig.daemon    import Daemon, lock_installdir, \
+                                    receive_request, send_request, supported
+from  WebappConfig.db        import WebappDB, WebappSource, read_cached, \
+                                    source_cache
+from  WebappConfig.debug     import Message, OUT
 from  WebappConfig.dotconfig import DotConfig
 from  WebappConfig.ebuild    import Ebuild
+from  WebappConfig.eprefix   import EPREFIX
+from  WebappConfig.events    import EventLog
+from  WebappConfig.exporter  import Exporter
 from  WebappConfig.filetype  import FileType
+from  WebappConfig.hooks     import HookRunner
+from  WebappConfig.metrics   import METRICS, Metrics
+from  WebappConfig.permissions import PermissionMap, nss_lookup, nss_cache
+from  WebappConfig.profiler  import Profiler
 from  WebappConfig.protect   import Protection
+from  WebappConfig.records   import FIELDS, RecordWriter
+from  WebappConfig.sandbox   import Sandbox, parse_limits
 from  WebappConfig.server    import Basic
+from  WebappConfig.template  import Template, compile_line, shell
+from  WebappConfig.vdb       import VDB
 from  WebappConfig.worker    import WebappAdd, WebappRemove
 from  warnings               import filterwarnings, resetwarnings
 
@@ -88,6 +122,20 @@ class ContentsTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
         self.assertTrue('file 1 config_owned "test1" ' in output[1])
 
+    def test_add_checksum(self):
+        loc = '/'.join((HERE, 'testfiles', 'contents', 'app'))
+        contents = Contents(loc, package = 'test', version = '1.0')
+        contents.add('file', 'config_owned', destination = loc, path = '/test1',
+                     real_path = loc + '/test0', relative = True,
+                     checksum = 'cafe')
+        self.assertTrue(' cafe ' in contents.entry(loc + '/test1'))
+
+        # Checksums are only used for files:
+        contents.add('dir', 'default_owned', destination = loc, path = '/dir1',
+                     real_path = loc + '/dir1', relative = True,
+                     checksum = 'cafe')
+        self.assertFalse(' cafe ' in contents.entry(loc + '/dir1'))
+
     def test_can_rm(self):
         contents = Contents('/'.join((HERE, 'testfiles', 'contents')),
                             package = 'test', version = '1.0')
@@ -155,6 +203,35 @@ class WebappDBTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
         self.assertEqual(output[5], '* Installs for horde-3.0.5')
 
+    def test_list_installs_format(self):
+        db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')),
+                      package = 'horde', version = '3.0.5')
+
+        writer = RecordWriter('jsonl')
+        db.listinstalls(writer)
+        writer.close()
+        output = sys.stdout.getvalue().split('\n')
+        self.assertEqual(json.loads(output[0]),
+                         {'cat': '', 'pn': 'horde', 'pvr': '3.0.5',
+                          'installdir': '/var/www/localhost/htdocs/horde',
+                          'uid': 'root', 'gid': 'root',
+                          'timestamp': 1124612110})
+
+        # The json format yields a single array:
+        writer = RecordWriter('json')
+        db.listinstalls(writer)
+        writer.close()
+        output = sys.stdout.getvalue().split('\n', 1)[1]
+        self.assertEqual(len(json.loads(output)), 1)
+
+        # tsv output starts with a header line:
+        writer = RecordWriter('tsv')
+        WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')),
+                 package = 'nihil', version = '3.0.5').listinstalls(writer)
+        writer.close()
+        self.assertEqual(sys.stdout.getvalue().split('\n')[-2],
+                         '\t'.join(FIELDS))
+
     def test_list_locations(self):
         OUT.color_off()
         db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')))
@@ -198,6 +275,50 @@ class WebappDBTest(unittest.TestCase):
         self.assertEqual(output[11], '* 1124612110 root root '\
                                      '/var/www/localhost/htdocs/horde')
 
+    def test_prune_database(self):
+        OUT.color_off()
+        root = tempfile.mkdtemp()
+        try:
+            os.mkdir(root + '/db')
+
+            def install(cat, name, dotfile):
+                installdir = root + '/www/' + name
+                os.makedirs(installdir)
+                if dotfile:
+                    open(installdir + '/.webapp-' + dotfile, 'w').close()
+                WebappDB(root = root + '/db', category = cat,
+                         package = 'horde', version = '3.0.5').add(
+                             installdir, 'root', 'root')
+                return installdir
+
+            # Contents files are named after the category and package ...
+            current = install('www-apps', 'a', 'www-apps_horde-3.0.5')
+            # ... or only after the package in old installs
+            old = install('www-apps', 'b', 'horde-3.0.5')
+            plain = install('', 'c', 'horde-3.0.5')
+            gone = install('www-apps', 'd', None)
+
+            writer = RecordWriter('jsonl')
+            WebappDB(root = root + '/db').prune_database('list', writer)
+            writer.close()
+            output = sys.stdout.getvalue().split('\n')
+            self.assertEqual([json.loads(i)['installdir']
+                              for i in output if i], [gone])
+
+            WebappDB(root = root + '/db').prune_database('list')
+            output = sys.stdout.getvalue().split('\n')
+            self.assertIn('* ' + gone, output)
+            for i in [current, old, plain]:
+                self.assertNotIn('* ' + i, output)
+
+            WebappDB(root = root + '/db').prune_database('clean')
+            self.assertEqual(sorted(i['installdir'] for i in
+                                    WebappDB(root = root + '/db')
+                                    .iter_installs()),
+                             [current, old, plain])
+        finally:
+            shutil.rmtree(root)
+
 
 class WebappSourceTest(unittest.TestCase):
         SHARE = '/'.join((HERE, 'testfiles', 'share-webapps'))
@@ -210,6 +331,19 @@ class WebappSourceTest(unittest.TestCase):
             output = sys.stdout.getvalue().split('\n')
             self.assertEqual(output[2], 'share-webapps/uninstalled-6.6.6')
 
+        def test_list_unused_format(self):
+            source = WebappSource(root = '/'.join((HERE,
+                                                  'testfiles',
+                                                  'share-webapps')))
+            db = WebappDB(root = '/'.join((HERE, 'testfiles', 'webapps')))
+            writer = RecordWriter('jsonl')
+            source.listunused(db, writer)
+            writer.close()
+            output = [json.loads(i) for i in
+                      sys.stdout.getvalue().split('\n') if i]
+            self.assertIn(('share-webapps', 'uninstalled', '6.6.6'),
+                          [(i['cat'], i['pn'], i['pvr']) for i in output])
+
         def test_read(self):
             source = WebappSource(root = '/'.join((HERE,
                                                    'testfiles',
@@ -222,6 +356,114 @@ class WebappSourceTest(unittest.TestCase):
             self.assertEqual(source.filetype('test1'), 'config-owned')
             self.assertEqual(source.filetype('test2'), 'server-owned')
 
+        def test_read_cache(self):
+            cachedir = tempfile.mkdtemp()
+            try:
+                source = WebappSource(root = '/'.join((HERE,
+                                                       'testfiles',
+                                                       'share-webapps')),
+                                      package = 'horde',
+                                      version = '3.0.5',
+                                      cachedir = cachedir)
+                source.read()
+                cache = source.type_cache()
+                self.assertTrue(os.path.isfile(cache))
+
+                # A valid cache is used instead of the type lists:
+                with open(cache) as f:
+                    data = json.load(f)
+                data['types'] = FileType(['test2'], []).dump()
+                with open(cache, 'w') as f:
+                    json.dump(data, f)
+
+                source.read()
+                self.assertEqual(source.filetype('test2'), 'config-owned')
+
+                # A stale cache is ignored and rewritten:
+                data['sources'][0][1] -= 1
+                with open(cache, 'w') as f:
+                    json.dump(data, f)
+
+                source.read()
+                self.assertEqual(source.filetype('test2'), 'server-owned')
+                with open(cache) as f:
+                    self.assertNotEqual(json.load(f)['sources'],
+                                        data['sources'])
+            finally:
+                shutil.rmtree(cachedir)
+
+        def test_type_cache_pretend(self):
+            cachedir = tempfile.mkdtemp()
+            try:
+                source = WebappSource(root = '/'.join((HERE,
+                                                       'testfiles',
+                                                       'share-webapps')),
+                                      package = 'horde',
+                                      version = '3.0.5',
+                                      cachedir = cachedir,
+                                      pretend = True)
+                source.read()
+                self.assertEqual(source.filetype('test1'), 'config-owned')
+                self.assertFalse(os.path.exists(source.type_cache()))
+            finally:
+                shutil.rmtree(cachedir)
+
+        def test_prune_type_cache(self):
+            cachedir = tempfile.mkdtemp()
+            try:
+                root = '/'.join((HERE, 'testfiles', 'share-webapps'))
+                WebappSource(root = root, package = 'horde',
+                             version = '3.0.5', cachedir = cachedir).read()
+                with open(cachedir + '/types/www-apps_gone-1.0.json',
+                          'w') as f:
+                    f.write('{}')
+
+                # Pretending only reports the caches of removed versions
+                source = WebappSource(root = root, cachedir = cachedir,
+                                      pretend = True)
+                self.assertEqual(source.prune_type_cache(),
+                                 [cachedir + '/types/www-apps_gone-1.0.json'])
+                self.assertEqual(len(os.listdir(cachedir + '/types')), 2)
+
+                source = WebappSource(root = root, cachedir = cachedir)
+                self.assertEqual(len(source.prune_type_cache()), 1)
+                self.assertEqual(os.listdir(cachedir + '/types'),
+                                 ['horde-3.0.5.json'])
+            finally:
+                shutil.rmtree(cachedir)
+
+        def test_manifest(self):
+            root = tempfile.mkdtemp()
+            try:
+                appdir = root + '/horde/3.0.5'
+                os.makedirs(appdir + '/htdocs')
+                with open(appdir + '/htdocs/test1', 'w') as f:
+                    f.write('test1')
+                st = os.stat(appdir + '/htdocs/test1')
+                with open(appdir + '/manifest', 'w') as f:
+                    f.write('dir 755 0 0 0 htdocs\n'
+                            'file 644 5 ' + str(int(st.st_mtime)) +
+                            ' cafe htdocs/test1\n')
+
+                source = WebappSource(root = root, package = 'horde',
+                                      version = '3.0.5')
+                self.assertEqual(source.checksum('htdocs//test1'), 'cafe')
+                self.assertEqual(source.checksum('htdocs'), None)
+                self.assertEqual(source.checksum('htdocs/test2'), None)
+
+                # Changed files are no longer trusted:
+                with open(appdir + '/htdocs/test1', 'w') as f:
+                    f.write('changed')
+                self.assertEqual(source.checksum('htdocs/test1'), None)
+
+                # A missing manifest is not an error:
+                os.unlink(appdir + '/manifest')
+                source = WebappSource(root = root, package = 'horde',
+                                      version = '3.0.5')
+                self.assertEqual(source.checksum('htdocs/test1'), None)
+            finally:
+                shutil.rmtree(root)
+
         def test_src_exists(self):
             source = WebappSource(root = '/'.join((HERE, 'testfiles',
                                                    'share-webapps')),
@@ -281,6 +523,16 @@ class DotConfigTest(unittest.TestCase):
         output = sys.stdout.getvalue().split('\n')
         self.assertEqual(output[0], 'horde 3.0.5')
 
+    def test_show_installed_format(self):
+        dotconf = DotConfig('/'.join((HERE, 'testfiles', 'htdocs', 'horde')))
+        writer = RecordWriter('jsonl')
+        dotconf.show_installed(writer)
+        writer.close()
+        record = json.loads(sys.stdout.getvalue().split('\n')[0])
+        self.assertEqual((record['pn'], record['pvr']), ('horde', '3.0.5'))
+        self.assertEqual(record['installdir'], '/'.join((HERE, 'testfiles',
+                                                         'htdocs', 'horde')))
+
     def test_install(self):
         dotconf = DotConfig('/nowhere', pretend=True)
         dotconf.write('www-apps', 'horde', '5.5.5', 'localhost', '/horde3',
@@ -299,8 +551,669 @@ class DotConfigTest(unittest.TestCase):
 
 
 
+class ConfigSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.etc  = self.root + '/webapp-config'
+        with open(self.etc, 'w') as f:
+            f.write('vhost_hostname="example.org"\n'
+                    'vhost_root="/var/www/${vhost_hostname}"\n'
+                    'vhost_config_dir="${vhost_root}/conf"\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def parser(self):
+        parser = BashConfigParser({'vhost_server': 'apache'})
+        parser.add_section('USER')
+        parser.read(self.etc)
+        return parser
+
+    def test_snapshot(self):
+        parser = self.parser()
+        snapshot = parser.take_snapshot()
+        self.assertEqual(snapshot['values']['vhost_config_dir'],
+                         ['/var/www/example.org/conf',
+                          ['vhost_hostname', 'vhost_root']])
+
+        # Snapshot values are used until a dependency changes:
+        snapshot['values']['vhost_root'][0] = '/srv/cached'
+        snapshot['values']['vhost_config_dir'][0] = '/srv/cached/conf'
+        parser.use_snapshot(snapshot)
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/srv/cached/conf')
+
+        parser.set('USER', 'vhost_hostname', 'example.com')
+        self.assertEqual(parser.get('USER', 'vhost_root'),
+                         '/var/www/example.com')
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/var/www/example.com/conf')
+
+    def test_memoize(self):
+        parser = self.parser()
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/var/www/example.org/conf')
+
+        # Changing an option drops all values depending on it:
+        parser.set('USER', 'vhost_hostname', 'example.com')
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/var/www/example.com/conf')
+        parser.set('USER', 'vhost_root', '/srv/${vhost_server}')
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/srv/apache/conf')
+
+        # Escapes are left to the regular interpolation:
+        parser.set('USER', 'vhost_root', '/srv/$$HOME')
+        self.assertEqual(parser.get('USER', 'vhost_config_dir'),
+                         '/srv/$HOME/conf')
+
+    def test_memoize_chain(self):
+        parser = BashConfigParser()
+        parser.add_section('USER')
+        parser.set('USER', 'v0', 'x')
+        for i in range(1, 10):
+            parser.set('USER', 'v%d' % i, '${v%d}x' % (i - 1))
+        self.assertEqual([parser.get('USER', 'v%d' % i) for i in range(10)],
+                         ['x' * (i + 1) for i in range(10)])
+        parser.set('USER', 'v0', 'y')
+        self.assertEqual(parser.get('USER', 'v9'), 'y' + 'x' * 9)
+        parser.set('USER', 'v5', 'z')
+        self.assertEqual(parser.get('USER', 'v9'), 'z' + 'x' * 4)
+
+    def test_config_cache(self):
+        config = Config()
+        config._Config__d.update({'my_etcconfig': self.etc,
+                                  'my_cachedir': self.root})
+        config.read_config()
+        self.assertEqual(config.maybe_get('vhost_config_dir'),
+                         '/var/www/example.org/conf')
+
+        # The next run uses the cache:
+        with open(config.config_cache()) as f:
+            data = json.load(f)
+        data['snapshot']['values']['vhost_server'][0] = 'nginx'
+        with open(config.config_cache(), 'w') as f:
+            json.dump(data, f)
+
+        config = Config()
+        config._Config__d.update({'my_etcconfig': self.etc,
+                                  'my_cachedir': self.root})
+        config.read_config()
+        self.assertEqual(config.maybe_get('vhost_server'), 'nginx')
+        self.assertEqual(config.maybe_get('vhost_config_dir'),
+                         '/var/www/example.org/conf')
+
+        # Unless the configuration file changed:
+        with open(self.etc, 'a') as f:
+            f.write('vhost_server="lighttpd"\n')
+
+        config = Config()
+        config._Config__d.update({'my_etcconfig': self.etc,
+                                  'my_cachedir': self.root})
+        config.read_config()
+        self.assertEqual(config.maybe_get('vhost_server'), 'lighttpd')
+
+
+class BatchTest(unittest.TestCase):
+    def test_read_operations(self):
+        operations = read_operations([
+            '{"action": "install", "package": "horde", "version": "3.0.5",'
+            ' "host": "www.example.org", "dir": "/horde", "secure": true,'
+            ' "args": ["-s", "nginx"]}\n',
+            '\n',
+            '# Comments are ignored\n',
+            '{"action": "clean", "package": "horde"}\n',
+            '["install"]\n',
+            '{"action": "install", "package": "horde", "version": "3.0.5",'
+            ' "args": "-S"}\n',
+            '{broken\n'])
+
+        self.assertEqual([i.line for i in operations], [1, 4, 5, 6, 7])
+        self.assertEqual(operations[0].error, '')
+        self.assertEqual(operations[0].argv(),
+                         ['-I', 'horde', '3.0.5', '-h', 'www.example.org',
+                          '-d', '/horde', '-S', '-s', 'nginx'])
+        self.assertEqual(operations[1].error,
+                         'Package and version are required')
+        self.assertEqual(operations[2].error, 'Expected an object')
+        self.assertEqual(operations[3].error,
+                         '"args" must be a list of strings')
+        self.assertTrue(operations[4].error.startswith('Invalid JSON'))
+        self.assertEqual(operations[4].record()['line'], 7)
+
+    def test_installdir(self):
+        config = Config()
+        config.config.set('USER', 'vhost_hostname', 'localhost')
+        config.config.set('USER', 'my_htdocsbase', '${vhost_htdocs_insecure}')
+        root   = os.path.normpath(wrapper.get_root(config) + '/'
+                                  + config.maybe_get('vhost_root'))
+        batch  = Batch(config, 1)
+
+        self.assertEqual(batch.installdir(Operation(1, {
+            'action': 'install', 'package': 'www-apps/horde',
+            'version': '3.0.5'})), root + '/htdocs/horde')
+        self.assertEqual(batch.installdir(Operation(2, {
+            'action': 'install', 'package': 'horde', 'version': '3.0.5',
+            'host': 'www.example.org', 'dir': '/horde//', 'secure': True})),
+                         root.replace('localhost', 'www.example.org')
+                         + '/htdocs-secure/horde')
+
+        # The configuration of the batch is left alone
+        self.assertEqual(config.maybe_get('vhost_hostname'), 'localhost')
+        self.assertEqual(config.maybe_get('g_htdocsdir'),
+                         config.maybe_get('vhost_root') + '/htdocs')
+
+    def test_run(self):
+        root    = tempfile.mkdtemp()
+        image   = root + '/image'
+        eprefix = WebappConfig.config.EPREFIX
+        environ = dict(os.environ)
+        try:
+            # The configuration is read from ${EPREFIX}, the applications
+            # are installed to ${ROOT}${EPREFIX}
+            os.makedirs(root + '/etc/portage')
+            os.makedirs(root + '/etc/vhosts')
+            os.makedirs(root + '/usr/share')
+            os.makedirs(image + root + '/usr/share')
+            os.makedirs(image + root + '/var/db/webapps')
+            os.makedirs(image + '/var/db/pkg/www-servers/apache-2.4.58')
+            with open(root + '/etc/portage/make.conf', 'w') as f:
+                f.write('ROOT="' + image + '"\n')
+            with open('/'.join((HERE, '..', '..', 'config',
+                                'webapp-config'))) as f:
+                data = f.read().replace('@GENTOO_PORTAGE_EPREFIX@', root)
+            with open(root + '/etc/vhosts/webapp-config', 'w') as f:
+                f.write(data)
+            for i in [root, image + root]:
+                os.symlink('/'.join((HERE, 'testfiles', 'share-webapps')),
+                           i + '/usr/share/webapps')
+            with open(root + '/batch.jsonl', 'w') as f:
+                f.write('{"action": "install", "package": "installtest",'
+                        ' "version": "1.0"}\n'
+                        '{"action": "install", "package": "missing",'
+                        ' "version": "1.0"}\n')
+
+            WebappConfig.config.EPREFIX = root
+            os.environ['PORTAGE_CONFIGROOT'] = root
+            wrapper._settings.clear()
+            del wrapper._vdb[:]
+
+            config = Config()
+            config.config.set('USER', 'vhost_hostname', 'localhost')
+
+            # Batch and operations write to the standard output descriptor
+            out    = tempfile.TemporaryFile()
+            saved  = os.dup(1)
+            stdout = sys.stdout
+            sys.stdout = sys.__stdout__
+            sys.stdout.flush()
+            os.dup2(out.fileno(), 1)
+            try:
+                status = Batch(config, 2).run(root + '/batch.jsonl')
+            finally:
+                sys.stdout.flush()
+                sys.stdout = stdout
+                os.dup2(saved, 1)
+                os.close(saved)
+            out.seek(0)
+            lines = out.read().decode('utf-8').splitlines()
+            out.close()
+        finally:
+            WebappConfig.config.EPREFIX = eprefix
+            os.environ.clear()
+            os.environ.update(environ)
+            wrapper._settings.clear()
+            del wrapper._vdb[:]
+
+        try:
+            # Every line of the output is a JSON record, the summary last
+            records = [json.loads(i) for i in lines]
+            self.assertEqual(status, 1)
+            self.assertEqual(len(records), 3)
+            self.assertEqual(sorted(records[-1].keys()),
+                             ['failed', 'operations', 'seconds'])
+
+            results = dict([(i['line'], i) for i in records[:-1]])
+            self.assertEqual(results[1]['installdir'],
+                             image + root
+                             + '/var/www/localhost/htdocs/installtest')
+            self.assertEqual(results[2]['status'], 1)
+            self.assertTrue('Unable to determine location of master copy'
+                            in results[2]['output'])
+
+            # The server user is taken from the system running the test
+            try:
+                pwd.getpwnam('apache')
+            except KeyError:
+                self.assertEqual(records[-1]['failed'], 2)
+                self.assertEqual(results[1]['status'], 1)
+                self.assertTrue('The user for the server type "Apache" '
+                                'does not exist!' in results[1]['output'])
+            else:
+                self.assertEqual(records[-1]['failed'], 1)
+                self.assertEqual(results[1]['status'], 0)
+                self.assertTrue(os.path.isfile(results[1]['installdir']
+                                               + '/test1'))
+        finally:
+            shutil.rmtree(root)
+
+class DebugTest(unittest.TestCase):
+    def message(self):
+        out = Message('test', dbg = io.StringIO(), col = False)
+        out.set_debug_level(8)
+        return out
+
+    def test_debug(self):
+        out = self.message()
+
+        def mkfile(filename):
+            out.debug('Creating file', 6)
+            out.debug('Ignored', 9)
+
+        mkfile('htdocs/index.php')
+        output = out.debug_out.getvalue()
+        self.assertTrue('Method: mkfile' in output)
+        self.assertTrue('htdocs/index.php' in output)
+        self.assertTrue('Creating file' in output)
+        self.assertFalse('Ignored' in output)
+
+    def test_filters(self):
+        out = self.message()
+        out.set_debug_methods(['mkdir,mkfile'])
+        out.set_debug_variables('filename')
+
+        class Worker:
+            def mkfile(self, filename, mode):
+                out.debug('In mkfile', 6)
+
+            def mkdirs(self, directory):
+                out.debug('In mkdirs', 6)
+
+        def mkdir(directory):
+            out.debug('In mkdir', 6)
+
+        Worker().mkfile('htdocs/index.php', 'ignored mode')
+        Worker().mkdirs('htdocs')
+        mkdir('htdocs')
+
+        output = out.debug_out.getvalue()
+        self.assertTrue('Object Class: Worker' in output)
+        self.assertTrue('htdocs/index.php' in output)
+        self.assertFalse('ignored mode' in output)
+        self.assertFalse('In mkdirs' in output)
+        self.assertTrue('In mkdir' in output)
+
+        # Only debug methods of the given classes:
+        out = self.message()
+        out.set_debug_classes('Worker')
+        Worker().mkfile('htdocs/index.php', 0)
+        mkdir('htdocs')
+
+        output = out.debug_out.getvalue()
+        self.assertTrue('In mkfile' in output)
+        self.assertFalse('In mkdir' in output)
+
+    def test_enabled(self):
+        enabled = OUT.debug_enabled
+        out = self.message()
+        out.debug_off()
+        self.assertFalse(out.debug_enabled)
+        out.debug_on()
+        self.assertTrue(out.debug_enabled)
+
+        # Other instances do not change the flag of OUT
+        out.set_debug_level(not enabled and 4 or 0)
+        self.assertEqual(OUT.debug_enabled, enabled)
+
+    def test_record(self):
+        out = self.message()
+        stdout = sys.stdout
+        sys.stdout = io.StringIO()
+        try:
+            out.record('added', '>>> file index.php')
+            out.record(None, '^o^ hiding .htaccess')
+            out.count('removed')
+            out.notice('* done')
+            out.record('added', '>>> file about.php')
+            self.assertEqual(sys.stdout.getvalue(),
+                             '>>> file index.php\n^o^ hiding .htaccess\n'
+                             '* done\n')
+            out.flush()
+            self.assertTrue(sys.stdout.getvalue().endswith('about.php\n'))
+            self.assertEqual(out.totals().split(' (')[0],
+                             '3 entries: 2 added, 1 removed')
+
+            # Progress mode only prints the totals and the messages
+            # that need attention
+            out.summary()
+            sys.stdout = io.StringIO()
+            out.progress_on()
+            out.record('added', '>>> file index.php')
+            out.record('failed', '!!!      index.php', True)
+            out.summary()
+            self.assertTrue(sys.stdout.getvalue().startswith(
+                '!!!      index.php\n* 2 entries: 1 added, 1 failed ('))
+        finally:
+            sys.stdout = stdout
+
+
+class DaemonTest(unittest.TestCase):
+    def test_request(self):
+        if not supported():
+            self.skipTest('Passing file descriptors is not supported')
+
+        client, server = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        read, write = os.pipe()
+        try:
+            request = {'argv': ['webapp-config', '--list-installs'],
+                       'env' : {'X': 'y' * 100000}}
+            send_request(client, request, [write, write, write])
+            received, fds = receive_request(server)
+            self.assertEqual(received, request)
+            self.assertEqual(len(fds), 3)
+
+            # The descriptors refer to the pipe of the client:
+            os.write(fds[1], b'output')
+            self.assertEqual(os.read(read, 6), b'output')
+            for i in fds:
+                os.close(i)
+        finally:
+            for i in [read, write]:
+                os.close(i)
+            client.close()
+            server.close()
+
+    def test_lock_installdir(self):
+        root = tempfile.mkdtemp()
+        try:
+            lock_installdir(root + '/locks', '/var/www/localhost/htdocs')
+            # Locking the same directory again does not block:
+            lock_installdir(root + '/locks', '/var/www/localhost/htdocs')
+            self.assertEqual(len(os.listdir(root + '/locks')), 1)
+        finally:
+            shutil.rmtree(root)
+
+    def test_warm(self):
+        root = tempfile.mkdtemp()
+        try:
+            approot = '/'.join((HERE, 'testfiles', 'share-webapps'))
+            config  = Config()
+            config.config.set('USER', 'my_approot', approot)
+            config.config.set('USER', 'my_cachedir', root)
+            Daemon(config).warm()
+
+            # The instructions of the (old layout) applications are loaded
+            self.assertTrue(approot + '/horde/3.0.5/postinst-en.txt'
+                            in source_cache)
+        finally:
+            shutil.rmtree(root)
+
+    def test_read_cached(self):
+        root = tempfile.mkdtemp()
+        try:
+            name = root + '/types.json'
+            with open(name, 'w') as f:
+                f.write('[1]')
+            self.assertEqual(read_cached(name, json.load), [1])
+            self.assertTrue(read_cached(name, json.load) is
+                            source_cache[name][1])
+
+            # Changes to the file are noticed:
+            with open(name, 'w') as f:
+                f.write('[1, 2]')
+            self.assertEqual(read_cached(name, json.load), [1, 2])
+        finally:
+            shutil.rmtree(root)
+
+
+class EventLogTest(unittest.TestCase):
+    def test_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            name = os.path.join(tmpdir, 'events.jsonl')
+            src  = os.path.join(tmpdir, 'src')
+            dst  = os.path.join(tmpdir, 'dst')
+            with open(src, 'w') as f:
+                f.write('12345')
+
+            log = EventLog()
+            log.open(name)
+            log.run('link', dst, 'virtual', os.link, src, dst)
+            log.run('unlink', dst, 'virtual', os.unlink, dst)
+            self.assertRaises(OSError, log.run, 'unlink', dst, 'virtual',
+                              os.unlink, dst)
+
+            # Nothing is written before the buffer is full
+            self.assertEqual(os.path.getsize(name), 0)
+            log.close()
+
+            records = [json.loads(i) for i in open(name)]
+            self.assertEqual([(i['event'], i['bytes']) for i in records],
+                             [('link', 5), ('unlink', 5), ('unlink', None)])
+            self.assertTrue(records[0]['duration'] >= 0)
+            self.assertTrue('error' in records[2])
+
+            # Full buffers are written as whole lines
+            log.open(name)
+            log.buffer_size = 1000
+            for i in range(100):
+                log.emit('chmod', dst, 'virtual')
+            size = os.path.getsize(name)
+            self.assertTrue(size > 0)
+            self.assertEqual(open(name).read()[-1], '\n')
+            log.close()
+            self.assertEqual(len(open(name).readlines()), 103)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_open_descriptor(self):
+        read, write = os.pipe()
+        try:
+            log = EventLog()
+            log.open(str(write))
+            log.emit('mkdir', '/tmp')
+            log.close()
+            self.assertEqual(json.loads(os.read(read, 4096))['event'],
+                             'mkdir')
+
+            # Descriptors that are not open for writing are rejected
+            self.assertRaises(ValueError, log.open, str(read))
+            os.close(write)
+            self.assertRaises(ValueError, log.open, str(write))
+            write = os.open(os.devnull, os.O_WRONLY)
+
+            # The children of the daemon reject descriptors altogether
+            log.descriptors = False
+            self.assertRaises(ValueError, log.open, str(write))
+            self.assertFalse(log.enabled)
+        finally:
+            for i in [read, write]:
+                os.close(i)
+
+
+class ProfilerTest(unittest.TestCase):
+    def test_run(self):
+        tmpdir = tempfile.mkdtemp()
+        stderr = sys.stderr
+        try:
+            name    = os.path.join(tmpdir, 'webapp-config.prof')
+            profile = Profiler()
+
+            def work():
+                with profile.phase('install'):
+                    with profile.phase('hash', False):
+                        METRICS.add('files_hashed', 3)
+                return 1
+
+            # Nothing is measured unless enabled
+            self.assertEqual(profile.run(work), 1)
+            self.assertEqual(profile.phases(), [])
+
+            sys.stderr = io.StringIO()
+            profile.enable(name)
+            self.assertEqual(profile.run(work), 1)
+            report = sys.stderr.getvalue()
+        finally:
+            sys.stderr = stderr
+
+        try:
+            self.assertEqual([i.name for i in profile.phases()],
+                             ['startup', 'run', 'install', 'hash'])
+            self.assertTrue(profile.get('hash').usage is None)
+            self.assertTrue(' install ' in report)
+            self.assertTrue('files hashed' in report)
+            self.assertTrue(os.path.getsize(name) > 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class MetricsTest(unittest.TestCase):
+    def setUp(self):
+        METRICS.__init__()
+
+    def test_install(self):
+        installdir = tempfile.mkdtemp()
+        try:
+            OUT.color_off()
+            contents = Contents(installdir, pretend = False)
+            source = WebappSource(root = '/'.join((HERE, 'testfiles',
+                                                 'share-webapps')),
+                                  category = '', package = 'installtest',
+                                  version = '1.0')
+            source.read()
+            source.ignore = ['.svn']
+
+            owner = (os.getuid(), os.getgid(), PermissionMap('0644'))
+            webadd = WebappAdd('htdocs', installdir,
+                               {'dir':  {'default-owned': owner},
+                                'file': {'virtual':       owner,
+                                         'server-owned':  owner,
+                                         'config-owned':  owner}},
+                               {'content': contents,
+                                'removal': WebappRemove(contents, False,
+                                                        False),
+                                'protect': Protection('', 'installtest',
+                                                      '1.0', 'portage'),
+                                'source' : source},
+                               {'relative': 1,
+                                'upgrade' : False,
+                                'pretend' : False,
+                                'verbose' : False,
+                                'linktype': 'hard'})
+            webadd.mkdirs('')
+        finally:
+            shutil.rmtree(installdir)
+
+        values = METRICS.all()
+        self.assertEqual(values['directories_created'], 2)
+        self.assertEqual(values['files_linked'] + values['files_copied']
+                         + values['symlinks_created'], 6)
+        self.assertEqual(values['files_removed'], 0)
+        self.assertTrue(values['stat_calls'] >= 6)
+
+    def test_write(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            metrics = Metrics()
+            metrics.labels['action'] = 'install'
+            metrics.add('files_linked', 2)
+            with metrics.timer('hook_seconds'):
+                pass
+
+            metrics.enable(os.path.join(tmpdir, 'webapp-config.json'))
+            metrics.write()
+            with open(metrics.output) as f:
+                data = json.load(f)
+            self.assertEqual(data['metrics']['files_linked'], 2)
+            self.assertEqual(data['metrics']['nss_lookups'], 0)
+            self.assertEqual(data['labels'], {'action': 'install'})
+
+            metrics.enable(os.path.join(tmpdir, 'webapp-config.prom'))
+            metrics.write()
+            with open(metrics.output) as f:
+                lines = f.read().splitlines()
+            self.assertTrue('# TYPE webapp_config_files_linked gauge'
+                            in lines)
+            self.assertTrue('webapp_config_files_linked{action="install"} 2'
+                            in lines)
+            self.assertEqual(sorted(os.listdir(tmpdir)),
+                             ['webapp-config.json', 'webapp-config.prom'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class ExporterTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.mkdir(self.root + '/db')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def install(self, cat, pn, pvr, name, files):
+        installdir = self.root + '/www/' + name
+        os.makedirs(installdir)
+        contents = Contents(installdir, cat, pn, pvr, pretend = False)
+        for i in files:
+            with open(installdir + '/' + i, 'w') as f:
+                f.write(i)
+            contents.add('file', 'virtual', installdir, i,
+                         installdir + '/' + i, True)
+        contents.write()
+        DotConfig(installdir).write(cat, pn, pvr, 'localhost', '/' + name,
+                                    'root:root')
+        WebappDB(root = self.root + '/db', category = cat, package = pn,
+                 version = pvr).add(installdir, 'root', 'root')
+        return installdir
+
+    def test_write(self):
+        OUT.color_off()
+        self.install('www-apps', 'horde', '3.0.5', 'a', ['a.php', 'b.php'])
+        changed = self.install('www-apps', 'horde', '3.0.5', 'b',
+                               ['a.php', 'b.php', 'c.php'])
+        gone = self.install('', 'gallery', '2.0', 'c', ['index.php'])
+
+        os.unlink(changed + '/a.php')
+        os.utime(changed + '/b.php', (0, 0))
+        shutil.rmtree(gone)
+
+        Exporter(WebappDB(root = self.root + '/db')).write(self.root)
+
+        with open(self.root + '/webapp-config.prom') as f:
+            lines = f.read().splitlines()
+        samples = dict(i.rsplit(' ', 1) for i in lines
+                       if not i.startswith('#'))
+
+        def value(name, **labels):
+            labels = ','.join(['%s="%s"' % (i, labels[i])
+                               for i in sorted(labels)])
+            return samples['webapp_config_' + name + '{' + labels + '}']
+
+        self.assertEqual(value('installs', category = 'www-apps',
+                               package = 'horde', version = '3.0.5'), '2')
+        self.assertEqual(value('stale_installs', category = '',
+                               package = 'gallery', version = '2.0'), '1')
+        self.assertEqual(value('stale_installs', category = 'www-apps',
+                               package = 'horde', version = '3.0.5'), '0')
+
+        install = {'category' : 'www-apps', 'package' : 'horde',
+                   'version'  : '3.0.5', 'installdir' : changed}
+        self.assertEqual(value('install_inodes', **install), '2')
+        self.assertEqual(value('install_bytes', **install), '10')
+        for reason, count in [('missing', '1'), ('modified', '1'),
+                              ('type', '0'), ('dotconfig', '0')]:
+            self.assertEqual(value('install_drift', reason = reason,
+                                   **install), count)
+
+        install['installdir'] = self.root + '/www/a'
+        self.assertEqual(value('install_drift', reason = 'modified',
+                               **install), '0')
+        self.assertEqual(os.listdir(self.root).count('webapp-config.prom'),
+                         1)
+
+
 class EbuildTest(unittest.TestCase):
-    def test_showpostinst(self):
+    def config(self):
         config = Config()
         approot = '/'.join((HERE, 'testfiles', 'share-webapps'))
         appdir  = '/'.join((approot, 'horde', '3.0.5'))
@@ -320,7 +1233,10 @@ class EbuildTest(unittest.TestCase):
         for key in conf.keys():
             config.config.set('USER', key, conf[key])
 
-        ebuild = Ebuild(config)
+        return config
+
+    def test_showpostinst(self):
+        ebuild = Ebuild(self.config())
         ebuild.show_postinst()
         output = sys.stdout.getvalue().split('\n')
 
@@ -331,6 +1247,300 @@ class EbuildTest(unittest.TestCase):
                                                                  '3.0.5',
                                                                  'hostroot')))
 
+    def test_run_vars(self):
+        ebuild    = Ebuild(self.config())
+        variables = ebuild.run_vars()
+
+        self.assertEqual(variables['PN'], 'horde')
+        self.assertTrue(ebuild.run_vars() is variables)
+        self.assertRaises(TypeError, operator.setitem, variables, 'PN', 'x')
+
+        # Another install location yields other variables
+        ebuild.config.config.set('USER', 'vhost_hostname', 'www.example.org')
+        ebuild.config.config.set('USER', 'g_installdir', '/horde')
+        other = ebuild.run_vars()
+        self.assertEqual((other['VHOST_HOSTNAME'], other['MY_INSTALLDIR']),
+                         ('www.example.org', '/horde'))
+        self.assertTrue(other['VHOST_HTDOCSDIR'].startswith(
+            other['VHOST_ROOT']))
+        self.assertTrue('www.example.org' in other['VHOST_ROOT'])
+
+        # The environment of the process is left alone
+        self.assertFalse('MY_HOSTROOTDIR' in os.environ)
+        self.assertEqual(subprocess.check_output(
+            ['/bin/sh', '-c', 'echo "$MY_HOSTROOTDIR"']), b'\n')
+
+
+class TemplateTest(unittest.TestCase):
+    LINES = ['Plain text\n',
+             'Quotes: "${PN}" and \'$PVR\'\n',
+             'Escaped: \\$PN \\\\ \\`\n',
+             'printf: 100%% a\\tb \\\\n \\n\n',
+             'Unset: [$UNSET_VARIABLE] [${UNSET_VARIABLE}]\n',
+             'Dollars: $ $/ $. ${PN}x $PN-x\n',
+             'Values: ${PERCENT} ${BACKSLASH}\n',
+             'Shell: $(echo sub) `echo tick` $((1 + 2)) ${PN:-x} $1\n',
+             'Conversions: %s %d \\101 \\x41\n',
+             'No newline at the end']
+
+    def variables(self):
+        return {'PN': 'horde', 'PVR': '3.0.5', 'PERCENT': '50%% \\t',
+                'BACKSLASH': 'a\\nb', 'PATH': os.environ.get('PATH', '')}
+
+    def test_shell_compatibility(self):
+        variables = self.variables()
+        postinst  = '/'.join((HERE, 'testfiles', 'share-webapps', 'horde',
+                              '3.0.5', 'postinst-en.txt'))
+        variables.update((i.split(':')[0], i.split(':')[0].lower())
+                         for i in open(postinst))
+
+        for lines in [self.LINES, open(postinst).readlines()]:
+            expected = [shell(i, variables) for i in lines]
+            self.assertEqual(Template(lines).render(variables), expected)
+
+        # Only the shell constructs need the shell
+        self.assertEqual([i for i in self.LINES if compile_line(i) is None],
+                         self.LINES[7:8])
+
+    def test_cache(self):
+        template = Template(self.LINES[:7])
+        first    = template.render(self.variables())
+        self.assertTrue(template.render(self.variables()) is first)
+
+        variables = self.variables()
+        variables['PN'] = 'phpmyadmin'
+        self.assertTrue('"phpmyadmin"' in template.render(variables)[1])
+
+        # Other variables do not matter
+        variables = self.variables()
+        variables['HOME'] = '/nonexistent'
+        self.assertTrue(template.render(variables) is first)
+
+
+class SandboxTest(unittest.TestCase):
+    def sandbox(self, tmpdir):
+        # The sandbox runs its argument as a shell command
+        sandbox = Sandbox(Config())
+        sandbox.sandbox_binary = os.path.join(tmpdir, 'sandbox')
+        with open(sandbox.sandbox_binary, 'w') as f:
+            f.write('#!/bin/sh\nexec /bin/sh -c "$1"\n')
+        os.chmod(sandbox.sandbox_binary, 0o755)
+        return sandbox
+
+    def run_command(self, sandbox, command, **kwargs):
+        output = tempfile.TemporaryFile()
+        read, write = os.pipe()
+        os.set_inheritable(write, True)
+        try:
+            pid = sandbox.start(command.replace('FD', str(write)),
+                                {'PATH': os.environ['PATH']},
+                                {0: read, 1: output.fileno(),
+                                 2: output.fileno()},
+                                **kwargs)
+            status = os.waitpid(pid, 0)[1]
+        finally:
+            os.close(read)
+            os.close(write)
+        output.seek(0)
+        return status, output.read().decode()
+
+    def test_start(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            sandbox = self.sandbox(tmpdir)
+            for posix_spawn in set([False, Sandbox.use_posix_spawn]):
+                sandbox.use_posix_spawn = posix_spawn
+
+                # Only the requested descriptors are passed on
+                status, output = self.run_command(
+                    sandbox, 'echo out; echo err >&2; '
+                    'test -e /dev/fd/FD && echo open; exit 4')
+                self.assertEqual(status >> 8, 4)
+                self.assertEqual(output, 'out\nerr\n')
+
+                status, output = self.run_command(
+                    sandbox, 'ulimit -n; echo $$; cut -d" " -f5 /proc/$$/stat',
+                    group = True, limits = parse_limits('nofile=64'))
+                limit, pid, pgid = output.split()
+                self.assertEqual(limit, '64')
+                self.assertEqual(pid, pgid)
+
+            # A missing sandbox is reported by the child
+            sandbox.sandbox_binary = os.path.join(tmpdir, 'missing')
+            status, output = self.run_command(sandbox, 'true')
+            self.assertEqual(status >> 8, 1)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class HookRunnerTest(unittest.TestCase):
+    HOOKS = {'10-a'   : 'sleep 0.5; echo "a $1 $PN"',
+             '10-b'   : 'sleep 0.5; echo b >&2; exit 3',
+             '20-slow': 'echo slow; sleep 30',
+             'README' : None}
+
+    def test_run(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            hooksdir = os.path.join(tmpdir, 'hooks')
+            os.mkdir(hooksdir)
+            for name, script in self.HOOKS.items():
+                with open(os.path.join(hooksdir, name), 'w') as f:
+                    f.write('#!/bin/sh\n' + (script or '') + '\n')
+                if script:
+                    os.chmod(os.path.join(hooksdir, name), 0o755)
+
+            # The sandbox runs its argument as a shell command
+            sandbox = Sandbox(Config())
+            sandbox.sandbox_binary = os.path.join(tmpdir, 'sandbox')
+            with open(sandbox.sandbox_binary, 'w') as f:
+                f.write('#!/bin/sh\nexec /bin/sh -c "$1"\n')
+            os.chmod(sandbox.sandbox_binary, 0o755)
+
+            OUT.color_off()
+            runner = HookRunner(sandbox, timeout = 1)
+            hooks  = runner.run(hooksdir, 'install',
+                                {'PN': 'horde', 'PATH': os.environ['PATH']})
+
+            self.assertEqual([(i.name, i.status, i.timed_out) for i in hooks],
+                             [('10-a', 0, False), ('10-b', 3, False),
+                              ('20-slow', signal.SIGTERM << 8, True)])
+
+            # Hooks of the same stage run at the same time
+            self.assertTrue(hooks[0].duration < 0.9)
+            self.assertTrue(hooks[1].duration < 0.9)
+            self.assertTrue(hooks[2].duration < 5)
+
+            output = sys.stdout.getvalue()
+            self.assertTrue('a install horde\n' in output)
+            self.assertTrue('slow\n' in output)
+            self.assertTrue('Hook 10-b failed with status 3' in output)
+            self.assertTrue('Hook 20-slow timed out' in output)
+            self.assertTrue('b\n' in sys.stderr.getvalue())
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_wait(self):
+        tmpdir = tempfile.mkdtemp()
+        grace  = hooks.GRACE
+        try:
+            hooksdir = os.path.join(tmpdir, 'hooks')
+            os.mkdir(hooksdir)
+            for name, script in [('10-a', 'sleep 0.6'), ('10-b', 'exit 2')]:
+                with open(os.path.join(hooksdir, name), 'w') as f:
+                    f.write('#!/bin/sh\n' + script + '\n')
+                os.chmod(os.path.join(hooksdir, name), 0o755)
+
+            # Hooks started by this sandbox ignore SIGTERM
+            sandbox = Sandbox(Config())
+            sandbox.sandbox_binary = os.path.join(tmpdir, 'sandbox')
+            with open(sandbox.sandbox_binary, 'w') as f:
+                f.write('#!/bin/sh\ntrap "" TERM\nexec /bin/sh -c "$1"\n')
+            os.chmod(sandbox.sandbox_binary, 0o755)
+
+            OUT.color_off()
+            env = {'PATH': os.environ['PATH']}
+
+            # Without a timeout the runner blocks until the hooks exit
+            result = HookRunner(sandbox).run(hooksdir, 'install', env)
+            self.assertEqual([(i.status, i.timed_out) for i in result],
+                             [(0, False), (2, False)])
+
+            # Hooks ignoring SIGTERM are killed after the grace period
+            hooks.GRACE = 0.2
+            start  = time.time()
+            result = HookRunner(sandbox, timeout = 0.1).run(hooksdir,
+                                                            'install', env)
+            self.assertEqual([(i.status, i.timed_out) for i in result],
+                             [(signal.SIGKILL << 8, True), (2, False)])
+            self.assertTrue(time.time() - start < 2)
+        finally:
+            hooks.GRACE = grace
+            shutil.rmtree(tmpdir)
+
+
+def interpret_permissions(mode, permissions):
+    ''' Applies a permission map clause by clause, the way PermissionMap
+    did before the maps were compiled. Serves as reference.'''
+    if len(mode) == 4 and mode.isdigit():
+        return int(mode, 8)
+
+    for clause in [i.strip() for i in mode.split(',')]:
+        entity, operator, perm = PermissionMap.valid.match(clause).groups()
+
+        perm_bit = 0
+        for i in perm:
+            perm_bit |= {'r': 4, 'w': 2, 'x': 1}[i]
+
+        for i in entity:
+            shift = {'u': [6], 'g': [3], 'o': [0], 'a': [6, 3, 0]}[i]
+            for j in shift:
+                if operator == '=':
+                    permissions &= ~(7 << j)
+                if operator == '-':
+                    permissions &= ~(perm_bit << j)
+                if operator == '+' or operator == '=':
+                    permissions |= (perm_bit << j)
+
+    return permissions
+
+class PermissionMapTest(unittest.TestCase):
+    ENTITIES  = ['u', 'g', 'o', 'a', 'ug', 'go', 'ua', 'au', 'ugo', 'ugoa',
+                 'oo']
+    # The pattern also accepts characters between "+" and "=" as
+    # operators. These do not change anything.
+    OPERATORS = ['+', '-', '=', '0']
+    PERMS     = ['', 'r', 'w', 'x', 'rw', 'wx', 'xr', 'rwx', 'xxw']
+
+    def assert_equivalent(self, mode):
+        perm = PermissionMap(mode)
+        self.assertEqual([perm(i) for i in range(512)],
+                         [interpret_permissions(mode, i) for i in range(512)],
+                         'mode "' + mode + '"')
+
+    def test_absolute(self):
+        for i in range(0, 512, 7):
+            self.assert_equivalent('%04o' % i)
+
+    def test_single_clause(self):
+        for i in itertools.product(self.ENTITIES, self.OPERATORS,
+                                   self.PERMS):
+            self.assert_equivalent(''.join(i))
+
+    def test_clause_lists(self):
+        rand = random.Random(4711)
+        for n in range(150):
+            self.assert_equivalent(', '.join(
+                [rand.choice(self.ENTITIES) + rand.choice(self.OPERATORS)
+                 + rand.choice(self.PERMS)
+                 for i in range(rand.randint(2, 5))]))
+
+class NSSCacheTest(unittest.TestCase):
+    def test_lookup(self):
+        calls = []
+        def lookup(key):
+            calls.append(key)
+            if key == 'missing':
+                raise KeyError(key)
+            return (key, 'x', 42)
+
+        try:
+            self.assertEqual(nss_lookup(lookup, 'www'), ('www', 'x', 42))
+            self.assertEqual(nss_lookup(lookup, 'www'), ('www', 'x', 42))
+
+            # Misses are cached as well, each raising its own exception:
+            errors = []
+            for i in range(2):
+                try:
+                    nss_lookup(lookup, 'missing')
+                except KeyError as e:
+                    errors.append(e)
+            self.assertEqual([i.args for i in errors], [('missing',)] * 2)
+            self.assertFalse(errors[0] is errors[1])
+
+            self.assertEqual(calls, ['www', 'missing'])
+        finally:
+            nss_cache.clear()
 
 class FileTypeTest(unittest.TestCase):
     def test_filetypes(self):
@@ -368,6 +1578,28 @@ class FileTypeTest(unittest.TestCase):
         self.assertEqual(types.dirtype('foo.txt'), 'default-owned')
 
 
+    def test_patterns(self):
+        config_owned = ('htdocs/config.php', 'htdocs/conf/*.ini', '/e/**')
+        server_owned = ('htdocs/cache/**', 'htdocs/cache/keep',
+                        'htdocs/config.php', 'htdocs/conf/*.ini')
+
+        types = FileType(config_owned, server_owned)
+
+        self.assertEqual(types.filetype('htdocs/config.php'),
+                         'config-server-owned')
+        self.assertEqual(types.filetype('htdocs/conf/a.ini'),
+                         'config-server-owned')
+        self.assertEqual(types.filetype('htdocs/conf/a.php'), 'virtual')
+
+        # Everything below a "dir/**" rule inherits its type:
+        self.assertEqual(types.dirtype('htdocs/cache'),        'server-owned')
+        self.assertEqual(types.dirtype('htdocs/cache/a/b'),    'server-owned')
+        self.assertEqual(types.filetype('htdocs/cache/a/b/c'), 'server-owned')
+        self.assertEqual(types.filetype('/e/f/g'),             'config-owned')
+        self.assertEqual(types.dirtype('htdocs'),              'default-owned')
+        self.assertEqual(types.dirtype('e'),                   'default-owned')
+
+
 class ProtectTest(unittest.TestCase):
     def test_getprotectedname(self):
         pro = Protection('', 'horde', '3.0.5', 'portage')
@@ -421,6 +1653,223 @@ class ProtectTest(unittest.TestCase):
         self.assertEqual(output[8], '* etc-update')
         
 
+class WrapperTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.env  = dict(os.environ)
+        self.old  = wrapper.settings_cache
+        wrapper.settings_cache = self.root + '/cache.json'
+        wrapper._settings.clear()
+        del wrapper._vdb[:]
+        os.environ['PORTAGE_CONFIGROOT'] = self.root
+        for i in ['ROOT', 'CONFIG_PROTECT']:
+            os.environ.pop(i, None)
+        os.makedirs(self.root + '/etc/portage')
+        with open(self.root + '/etc/portage/make.conf', 'w') as f:
+            f.write('SRV="/srv"\n'
+                    '# CONFIG_PROTECT="/nope"\n'
+                    'CONFIG_PROTECT="${SRV}/www \\\n  /opt"\n')
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.env)
+        wrapper.settings_cache = self.old
+        wrapper._settings.clear()
+        del wrapper._vdb[:]
+        shutil.rmtree(self.root)
+
+    def test_parse_settings(self):
+        os.environ['CONFIG_PROTECT'] = '-/opt /etc'
+        self.assertEqual(wrapper.parse_settings(),
+                         {'ROOT': '', 'CONFIG_PROTECT': '/srv/www /etc'})
+
+    def test_parse_settings_profile(self):
+        profiles = self.root + '/profiles'
+        for i in ['base', 'default/linux/amd64']:
+            os.makedirs(profiles + '/' + i)
+        with open(profiles + '/default/linux/amd64/parent', 'w') as f:
+            f.write('../../../base\n')
+        with open(profiles + '/base/make.defaults', 'w') as f:
+            f.write('CONFIG_PROTECT="/etc /usr/share/config"\n')
+        with open(profiles + '/default/linux/amd64/make.defaults', 'w') as f:
+            f.write('CONFIG_PROTECT="-/usr/share/config /usr/share/gnupg"\n')
+        os.symlink(profiles + '/default/linux/amd64',
+                   self.root + '/etc/portage/make.profile')
+
+        # Portage stacks the profiles, make.conf and the environment
+        os.environ['CONFIG_PROTECT'] = '-/opt'
+        self.assertEqual(wrapper.parse_settings(),
+                         {'ROOT': '', 'CONFIG_PROTECT':
+                          '/etc /usr/share/gnupg /srv/www'})
+
+    def test_portage_setting_fallback(self):
+        try:
+            import portage
+            self.skipTest('Portage is available')
+        except ImportError:
+            pass
+
+        self.assertEqual(wrapper.portage_setting('CONFIG_PROTECT'),
+                         '/srv/www /opt')
+
+        # Only settings determined by portage are cached
+        self.assertFalse(os.path.exists(wrapper.settings_cache))
+
+    def test_settings_cache(self):
+        key = wrapper.settings_key()
+        wrapper.write_settings_cache(key, {'ROOT': '/mnt',
+                                           'CONFIG_PROTECT': '/cached'})
+
+        # A valid cache is used as is:
+        self.assertEqual(wrapper.portage_setting('CONFIG_PROTECT'), '/cached')
+        self.assertEqual(wrapper.portage_setting('ROOT'), '/mnt/')
+
+        # Changing the environment invalidates it:
+        os.environ['ROOT'] = '/other'
+        self.assertNotEqual(wrapper.settings_key(), key)
+        self.assertEqual(wrapper.read_settings_cache(wrapper.settings_key()),
+                         None)
+
+    def test_installed_packages(self):
+        os.makedirs(self.root + '/var/db/pkg/www-servers/nginx-1.4.0')
+        os.environ['ROOT'] = self.root
+
+        # Only portage takes ${ROOT} from its settings
+        self.assertTrue(wrapper.installed_packages('portage').exists())
+        self.assertEqual(wrapper.installed_packages('paludis').exists(),
+                         os.path.isdir(EPREFIX + '/var/db/pkg'))
+        self.assertTrue(wrapper.installed_packages().exists())
+
+    def test_settings_key_profile(self):
+        profiles = self.root + '/profiles'
+        for i in ['base', 'default/linux', 'default/linux/amd64']:
+            os.makedirs(profiles + '/' + i)
+        with open(profiles + '/default/linux/amd64/parent', 'w') as f:
+            f.write('# The parents\n..\n../../../base\ngentoo:targets/x\n')
+        with open(profiles + '/base/make.defaults', 'w') as f:
+            f.write('CONFIG_PROTECT="/etc"\n')
+        os.symlink(profiles + '/default/linux/amd64',
+                   self.root + '/etc/portage/make.profile')
+
+        self.assertEqual(wrapper.profile_dirs(
+                             self.root + '/etc/portage/make.profile'),
+                         [os.path.realpath(profiles + '/' + i) for i in
+                          ['default/linux', 'base', 'default/linux/amd64']])
+
+        # Changes to the files of inherited profiles are noticed:
+        key = wrapper.settings_key()
+        with open(profiles + '/base/make.defaults', 'a') as f:
+            f.write('CONFIG_PROTECT="/usr/share/config"\n')
+        self.assertNotEqual(wrapper.settings_key(), key)
+
+
+class CleanerTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for i in ['www-apps/gallery/1.4.4_p6', 'www-apps/gallery/2.0_rc2',
+                  'www-apps/gallery/2.0', 'www-apps/gallery/10.1',
+                  'horde/3.0.5', 'horde/3.0.10']:
+            os.makedirs(self.root + '/share/' + i)
+            open(self.root + '/share/' + i
+                 + '/installed_by_webapp_eclass', 'w').close()
+
+        installs = {'www-apps/gallery/2.0': 2, 'horde/3.0.5': 1,
+                    'horde/2.0': 1}
+        for i, count in installs.items():
+            os.makedirs(self.root + '/db/' + i)
+            with open(self.root + '/db/' + i + '/installs', 'w') as f:
+                for j in range(count):
+                    f.write('1124612110 root root /var/www/' + str(j) + '\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def inventory(self):
+        return inventory(WebappSource(root = self.root + '/share'),
+                         WebappDB(root = self.root + '/db'))
+
+    def test_inventory(self):
+        packages = self.inventory()
+        self.assertEqual([i.name() for i in packages],
+                         ['horde', 'www-apps/gallery'])
+
+        horde, gallery = packages
+        self.assertEqual(horde.versions, ['3.0.5', '3.0.10'])
+        self.assertEqual(horde.installs, {'3.0.5': 1, '2.0': 1})
+        self.assertEqual(gallery.best(), '10.1')
+
+        self.assertEqual(candidates(packages, 'prune'),
+                         ['=horde-3.0.5', '=www-apps/gallery-1.4.4_p6',
+                          '=www-apps/gallery-2.0_rc2',
+                          '=www-apps/gallery-2.0'])
+        self.assertEqual(candidates(packages, 'clean_unused'),
+                         ['=horde-3.0.10', '=www-apps/gallery-1.4.4_p6',
+                          '=www-apps/gallery-2.0_rc2',
+                          '=www-apps/gallery-10.1'])
+
+        self.assertEqual(select(packages, ['gallery']), [gallery])
+        self.assertEqual(select(packages, ['www-apps/gallery', 'horde']),
+                         [gallery, horde])
+        self.assertRaises(SystemExit, select, packages, ['nihil'])
+
+    def test_main(self):
+        # Removing versions of every package must be requested explicitly
+        for i in [['-P'], ['-C', '-p']]:
+            self.assertRaises(SystemExit, cleaner.main, i)
+
+    def test_json(self):
+        out = io.StringIO()
+        write_json(self.inventory(), out)
+        data = json.loads(out.getvalue())
+
+        self.assertEqual(data['prune'][0], '=horde-3.0.5')
+        self.assertEqual(data['packages'][1]['installs'],
+                         {'1.4.4_p6': 0, '2.0_rc2': 0, '2.0': 2, '10.1': 0})
+
+
+class VDBTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for i in ['www-servers/apache-2.2.22-r1', 'www-servers/nginx-1.4.0',
+                  'www-servers/-MERGING-lighttpd-1.4.32', 'app-misc/foo']:
+            os.makedirs(self.root + '/var/db/pkg/' + i)
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_match(self):
+        vdb = VDB(self.root)
+        self.assertEqual(vdb.match('>=www-servers/apache-1.3'),
+                         ['www-servers/apache-2.2.22-r1'])
+        self.assertEqual(vdb.match('<www-servers/apache-2'), [])
+        self.assertEqual(vdb.match('~www-servers/apache-2.2.22'),
+                         ['www-servers/apache-2.2.22-r1'])
+        self.assertEqual(vdb.match('www-servers/nginx:0'),
+                         ['www-servers/nginx-1.4.0'])
+        self.assertEqual(vdb.match('www-servers/lighttpd'), [])
+        self.assertRaises(ValueError, vdb.match, 'apache')
+
+    def test_index_cache(self):
+        vdb = VDB(self.root, cachedir = self.root + '/cache')
+        vdb.match('www-servers/nginx')
+        with open(vdb.index_cache()) as f:
+            data = json.load(f)
+        self.assertEqual(data['index']['www-servers/nginx'], ['1.4.0'])
+
+        # The cache is used as long as the database did not change:
+        data['index']['www-servers/apache'] = ['1.3.42']
+        with open(vdb.index_cache(), 'w') as f:
+            json.dump(data, f)
+        vdb = VDB(self.root, cachedir = self.root + '/cache')
+        self.assertEqual(vdb.match('www-servers/apache'),
+                         ['www-servers/apache-1.3.42'])
+
+        # Packages missing from the cache are still found:
+        os.makedirs(self.root + '/var/db/pkg/www-servers/cherokee-1.2.101')
+        self.assertEqual(vdb.match('www-servers/cherokee'),
+                         ['www-servers/cherokee-1.2.101'])
+
+
 class WebappAddTest(unittest.TestCase):
     def test_mk(self):
         OUT.color_off()
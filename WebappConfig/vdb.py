@@ -0,0 +1,348 @@
+#!/usr/bin/python -O
+#
+# /usr/sbin/webapp-config
+#       Python script for managing the deployment of web-based
+#       applications
+#
+#       Originally written for the Gentoo Linux distribution
+#
+# Copyright (c) 1999-2007 Authors
+#       Released under v2 of the GNU GPL
+#
+# Author(s)     Stuart Herbert
+#               Renat Lumpau   <rl03@gentoo.org>
+#               Gunnar Wrobel  <wrobel@gentoo.org>
+#
+# ========================================================================
+''' Queries the database of installed packages (/var/db/pkg) directly
+so that we do not need to ask the package manager if a package is
+installed.  '''
+
+# ========================================================================
+# Dependencies
+# ------------------------------------------------------------------------
+
+import os, os.path, re, json
+
+from WebappConfig.debug   import OUT
+from WebappConfig.eprefix import EPREFIX
+
+# ========================================================================
+# Versions
+# ------------------------------------------------------------------------
+
+VERSION  = r'(\d+)((?:\.\d+)*)([a-z]?)((?:_(?:alpha|beta|pre|rc|p)\d*)*)' \
+           r'(?:-r(\d+))?'
+
+# A version on its own
+VERSION_RE = re.compile('^' + VERSION + '$')
+
+# A package name followed by its version
+PF_RE      = re.compile(r'^(.+?)-(' + VERSION + ')$')
+
+# A single version suffix
+SUFFIX_RE  = re.compile(r'_(alpha|beta|pre|rc|p)(\d*)')
+
+# Ranking of the suffixes. No suffix ranks between "rc" and "p".
+SUFFIXES   = {'alpha' : 0, 'beta' : 1, 'pre' : 2, 'rc' : 3, 'p' : 5}
+NO_SUFFIX  = 4
+
+def split_pf(pf):
+    '''
+    Split "pn-pvr" into package name and version. Returns None if
+    the string does not end with a valid version.
+
+    >>> split_pf('apache-2.4.58-r1')
+    ('apache', '2.4.58-r1')
+    >>> split_pf('php-pear-1.9_rc2')
+    ('php-pear', '1.9_rc2')
+    >>> split_pf('apache') is None
+    True
+    '''
+    m = PF_RE.match(pf)
+    if not m:
+        return None
+    return (m.group(1), m.group(2))
+
+def cmp(a, b):
+    ''' Compare two values like the old cmp() builtin.'''
+    return (a > b) - (a < b)
+
+def vercmp(a, b):
+    '''
+    Compare two Gentoo versions. Returns a negative value if a is
+    older than b, zero if both are equal and a positive value if a is
+    newer.
+
+    >>> vercmp('1.3', '1.3.0') < 0
+    True
+    >>> vercmp('1.02', '1.1') < 0
+    True
+    >>> vercmp('2.0_rc1', '2.0') < 0 < vercmp('2.0_p1', '2.0')
+    True
+    >>> vercmp('1.2b', '1.2a-r5') > 0
+    True
+    >>> vercmp('1.0-r0', '1.0')
+    0
+    '''
+    ma = VERSION_RE.match(a)
+    mb = VERSION_RE.match(b)
+
+    if not ma or not mb:
+        raise ValueError('Invalid version "' + (ma and b or a) + '"')
+
+    # The first component is always numerical
+    result = cmp(int(ma.group(1)), int(mb.group(1)))
+    if result:
+        return result
+
+    # The remaining components are compared as strings if one of them
+    # has a leading zero
+    ca = ma.group(2).split('.')[1:]
+    cb = mb.group(2).split('.')[1:]
+    for x, y in zip(ca, cb):
+        if x[0] == '0' or y[0] == '0':
+            result = cmp(x.rstrip('0'), y.rstrip('0'))
+        else:
+            result = cmp(int(x), int(y))
+        if result:
+            return result
+    result = cmp(len(ca), len(cb))
+    if result:
+        return result
+
+    result = cmp(ma.group(3), mb.group(3))
+    if result:
+        return result
+
+    sa = [(SUFFIXES[s], int(n or 0)) for s, n in
+          SUFFIX_RE.findall(ma.group(4))]
+    sb = [(SUFFIXES[s], int(n or 0)) for s, n in
+          SUFFIX_RE.findall(mb.group(4))]
+    while len(sa) < len(sb):
+        sa.append((NO_SUFFIX, 0))
+    while len(sb) < len(sa):
+        sb.append((NO_SUFFIX, 0))
+    result = cmp(sa, sb)
+    if result:
+        return result
+
+    return cmp(int(ma.group(5) or 0), int(mb.group(5) or 0))
+
+# ========================================================================
+# Atoms
+# ------------------------------------------------------------------------
+
+ATOM_RE = re.compile(r'^(>=|<=|=|~|>|<)?([^/\s]+)/([^:\[\s]+?)'
+                     r'(\*)?(?::[^\[\s]*)?(?:\[.*\])?$')
+
+def split_atom(atom):
+    '''
+    Split a dependency atom into operator, category, package name and
+    version. Slots and USE dependencies are ignored.
+
+    >>> split_atom('>=www-servers/apache-1.3')
+    ('>=', 'www-servers', 'apache', '1.3')
+    >>> split_atom('www-servers/nginx:0')
+    ('', 'www-servers', 'nginx', '')
+    >>> split_atom('=dev-lang/php-5.4*')
+    ('=*', 'dev-lang', 'php', '5.4')
+    '''
+    m = ATOM_RE.match(atom.strip())
+    if not m:
+        raise ValueError('Invalid atom "' + atom + '"')
+
+    op, cat, pn, glob = m.groups()
+    op = op or ''
+
+    if not op:
+        return ('', cat, pn, '')
+
+    pf = split_pf(pn)
+    if not pf:
+        raise ValueError('Invalid atom "' + atom + '"')
+
+    if glob:
+        if op != '=':
+            raise ValueError('Invalid atom "' + atom + '"')
+        op = '=*'
+
+    return (op, cat, pf[0], pf[1])
+
+def version_matches(op, version, pvr):
+    '''
+    Check if the installed version pvr satisfies the operator and
+    version of an atom.
+
+    >>> version_matches('>=', '1.3', '2.2.22-r1')
+    True
+    >>> version_matches('~', '1.0', '1.0-r3')
+    True
+    >>> version_matches('=*', '5.4', '5.40')
+    False
+    '''
+    if not op:
+        return True
+
+    if op == '~':
+        return vercmp(version, re.sub(r'-r\d+$', '', pvr)) == 0
+
+    if op == '=*':
+        # The version has to be a prefix at a component boundary
+        return pvr == version or (pvr.startswith(version) and
+                                  not pvr[len(version)].isdigit())
+
+    result = vercmp(pvr, version)
+
+    return {'='  : result == 0,
+            '>=' : result >= 0,
+            '<=' : result <= 0,
+            '>'  : result >  0,
+            '<'  : result <  0}[op]
+
+# ========================================================================
+# Installed package database
+# ------------------------------------------------------------------------
+
+# Bump this whenever the layout of the index cache changes
+VDB_CACHE_VERSION = 1
+
+class VDB:
+    '''
+    An index of the installed packages. The index maps "cat/pn" to the
+    installed versions and is cached as long as the modification time
+    of the database does not change. Portage updates it whenever a
+    package gets merged or unmerged.
+
+    Negative answers are always verified against the category
+    directory so that a stale cache can never hide an installed
+    package.
+    '''
+
+    def __init__(self,
+                 root     = '/',
+                 vdb      = EPREFIX + '/var/db/pkg',
+                 cachedir = ''):
+
+        self.__re    = re.compile('/+')
+        self.__vdb   = self.__re.sub('/', root + '/' + vdb)
+        self.__index = None
+
+        # Where to cache the index. Empty disables caching. The cache
+        # is keyed by the location of the database so a single cache
+        # directory serves all roots.
+        self.cachedir = cachedir
+
+    def exists(self):
+        ''' Is there a database of installed packages?'''
+        return os.path.isdir(self.__vdb)
+
+    def index_cache(self):
+        ''' Return the path of the index cache.'''
+        if self.cachedir:
+            return self.cachedir + '/vdb.json'
+
+    def key(self):
+        ''' Returns the values identifying the state of the database.'''
+        try:
+            return [self.__vdb, os.stat(self.__vdb).st_mtime]
+        except OSError:
+            return None
+
+    def scan_category(self, cat):
+        ''' Return the installed "pn-pvr" entries of a category.'''
+        try:
+            entries = os.listdir(self.__vdb + '/' + cat)
+        except OSError:
+            return []
+        # Skip temporary directories used during merges
+        return [i for i in entries if not i[0] in '-.']
+
+    def build_index(self):
+        ''' Scan the database of installed packages.'''
+        index = {}
+
+        try:
+            categories = os.listdir(self.__vdb)
+        except OSError:
+            return index
+
+        for cat in categories:
+            for i in self.scan_category(cat):
+                pf = split_pf(i)
+                if pf:
+                    index.setdefault(cat + '/' + pf[0], []).append(pf[1])
+
+        return index
+
+    def index(self):
+        ''' Return the index of the installed packages.'''
+        if self.__index is not None:
+            return self.__index
+
+        key   = self.key()
+        cache = self.index_cache()
+
+        if key and cache and os.path.isfile(cache):
+            try:
+                f = open(cache)
+                data = json.load(f)
+                f.close()
+                if (isinstance(data, dict) and
+                    data.get('version') == VDB_CACHE_VERSION and
+                    data.get('key') == key):
+
+                    OUT.debug('Using cached package index.', 7)
+
+                    self.__index = data.get('index')
+                    return self.__index
+            except (IOError, OSError, ValueError):
+                OUT.debug('Ignoring broken package index cache.', 7)
+
+        OUT.debug('Scanning installed packages.', 7)
+
+        self.__index = self.build_index()
+
+        if key and cache:
+            try:
+                if not os.path.isdir(self.cachedir):
+                    os.makedirs(self.cachedir, 0o755)
+                tmp = cache + '.' + str(os.getpid())
+                f = open(tmp, 'w')
+                json.dump({'version' : VDB_CACHE_VERSION,
+                           'key'     : key,
+                           'index'   : self.__index}, f)
+                f.close()
+                os.rename(tmp, cache)
+            except (IOError, OSError):
+                OUT.debug('Unable to write package index cache', 7)
+
+        return self.__index
+
+    def versions(self, cp, verify = True):
+        ''' Return the installed versions of "cat/pn".'''
+        versions = self.index().get(cp, [])
+
+        if not versions and verify:
+            cat, pn = cp.split('/', 1)
+            for i in self.scan_category(cat):
+                pf = split_pf(i)
+                if pf and pf[0] == pn:
+                    versions.append(pf[1])
+
+        return versions
+
+    def match(self, atom):
+        '''
+        Return the installed packages ("cat/pn-pvr") matching a
+        dependency atom like ">=www-servers/apache-1.3".
+        '''
+        op, cat, pn, version = split_atom(atom)
+
+        return [cat + '/' + pn + '-' + i
+                for i in sorted(self.versions(cat + '/' + pn))
+                if version_matches(op, version, i)]
+
+if __name__ == '__main__':
+    import doctest, sys
+    doctest.testmod(sys.modules[__name__])
@@ -24,6 +24,8 @@ files of a virtual install location.  '''
 import sys, os, os.path, shutil, stat, re
 
 from WebappConfig.debug    import OUT
+from WebappConfig.events   import EVENTS
+from WebappConfig.metrics  import METRICS
 
 # ========================================================================
 # Helper functions
@@ -114,23 +116,31 @@ class WebappRemove:
                 if self.__content.etype(entry) == 'dir':
                     # its a directory -> rmdir
                     if not self.__p:
-                        os.rmdir(entry)
+                        EVENTS.run('rmdir', entry,
+                                   self.__content.eowner(entry),
+                                   os.rmdir, entry)
+                        METRICS.add('directories_removed')
                 else:
                     # its a file -> unlink
                     if not self.__p:
-                        os.unlink(entry)
+                        EVENTS.run('unlink', entry,
+                                   self.__content.eowner(entry),
+                                   os.unlink, entry)
+                        METRICS.add('files_removed')
             except:
                 # Report if there is a problem
-                OUT.notice('!!!      '
-                           + self.__content.epath(entry))
+                OUT.record('failed', '!!!      '
+                           + self.__content.epath(entry), True)
                 return
 
             if self.__v and not self.__p:
                 # Report successful deletion
 
-                OUT.notice('<<< ' + entry_type + ' '
+                OUT.record('removed', '<<< ' + entry_type + ' '
                            * (5 - len(entry_type))
                            + self.__content.epath(entry))
+            else:
+                OUT.count('removed')
 
             self.__content.delete(entry)
 
@@ -138,7 +148,11 @@ class WebappRemove:
 
         else:
 
-            OUT.notice(removeable)
+            OUT.record('kept', removeable, True)
+
+            if EVENTS.enabled:
+                EVENTS.emit('skip', entry, self.__content.eowner(entry),
+                            reason = removeable.split()[0].lstrip('!'))
 
             return False
 
@@ -201,7 +215,8 @@ class WebappAdd:
 
         for i in self.__ws.get_source_directories(sd):
 
-            OUT.debug('Handling directory', 7)
+            if OUT.debug_enabled:
+                OUT.debug('Handling directory', 7)
 
             # create directory first
             self.mkdir(directory + '/' + i)
@@ -211,7 +226,8 @@ class WebappAdd:
 
         for i in self.__ws.get_source_files(sd):
 
-            OUT.debug('Handling file', 7)
+            if OUT.debug_enabled:
+                OUT.debug('Handling file', 7)
 
             # handle the file
             self.mkfile(directory + '/' + i)
@@ -226,7 +242,8 @@ class WebappAdd:
         src_dir = self.__sourced + '/' + directory
         dst_dir = self.__destd + '/' + directory
 
-        OUT.debug('Creating directory', 6)
+        if OUT.debug_enabled:
+            OUT.debug('Creating directory', 6)
 
         # some special cases
         #
@@ -247,7 +264,8 @@ class WebappAdd:
 
         dirtype = self.__ws.dirtype(src_dir)
 
-        OUT.debug('Checked directory type', 8)
+        if OUT.debug_enabled:
+            OUT.debug('Checked directory type', 8)
 
         (user, group, perm) = self.__perm['dir'][dirtype]
 
@@ -255,14 +273,19 @@ class WebappAdd:
 
         if not os.path.isdir(dst_dir):
 
-            OUT.debug('Creating directory', 8)
+            if OUT.debug_enabled:
+                OUT.debug('Creating directory', 8)
 
             if not self.__p:
-                os.makedirs(dst_dir, perm(0o755))
+                EVENTS.run('mkdir', dst_dir, dirtype,
+                           os.makedirs, dst_dir, perm(0o755))
 
-                os.chown(dst_dir,
-                         user,
-                         group)
+                EVENTS.run('chown', dst_dir, dirtype,
+                           os.chown, dst_dir,
+                           user,
+                           group)
+
+                METRICS.add('directories_created')
 
         self.__content.add(dsttype,
                            dirtype,
@@ -271,6 +294,12 @@ class WebappAdd:
                            directory,
                            self.__relative)
 
+    def report(self, action, src_name, dst_name):
+        ''' Report how a file gets installed (verbose mode only).'''
+        if self.__v:
+            OUT.record(None, '\n>>> ' + action + ': \n>>> Source: ' + src_name
+                       + '\n>>> Destination: ' + dst_name + '\n')
+
     def mkfile(self, filename):
         '''
         This is what we are all about.  No more games - lets take a file
@@ -281,20 +310,24 @@ class WebappAdd:
 
         '''
 
-        OUT.debug('Creating file', 6)
+        if OUT.debug_enabled:
+            OUT.debug('Creating file', 6)
 
         dst_name  = self.__destd + '/' + filename
         file_type = self.__ws.filetype(self.__sourced + '/' + filename)
 
-        OUT.debug('File type determined', 7)
+        if OUT.debug_enabled:
+            OUT.debug('File type determined', 7)
 
         # are we overwriting an existing file?
 
-        OUT.debug('Check for existing file', 7)
+        if OUT.debug_enabled:
+            OUT.debug('Check for existing file', 7)
 
         if os.path.exists(dst_name):
 
-            OUT.debug('File in the way!', 7)
+            if OUT.debug_enabled:
+                OUT.debug('File in the way!', 7)
 
             my_canremove = True
 
@@ -315,11 +348,18 @@ class WebappAdd:
 
                 dst_name = self.__protect.get_protectedname(self.__destd,
                                                             filename)
-                OUT.notice('^o^ hiding ' + filename)
+                OUT.record(None, '^o^ hiding ' + filename)
+                METRICS.add('files_protected')
+
+                if EVENTS.enabled:
+                    EVENTS.emit('protect', dst_name, file_type,
+                                original = self.__destd + '/' + filename)
+
                 self.config_protected_dirs.append(self.__destd + '/' 
                                                   + os.path.dirname(filename))
 
-                OUT.debug('Hiding config protected file', 7)
+                if OUT.debug_enabled:
+                    OUT.debug('Hiding config protected file', 7)
 
             else:
 
@@ -331,9 +371,11 @@ class WebappAdd:
 
                 if not self.__p:
                     if os.path.isdir(dst_name):
-                        os.rmdir(dst_name)
+                        EVENTS.run('rmdir', dst_name, file_type,
+                                   os.rmdir, dst_name)
                     else:
-                        os.unlink(dst_name)
+                        EVENTS.run('unlink', dst_name, file_type,
+                                   os.unlink, dst_name)
                 else:
                     OUT.info('    would have removed "' +  dst_name + '" s'
                              'ince it is in the way for the current instal'
@@ -353,7 +395,8 @@ class WebappAdd:
         src_name = re.compile('/+').sub('/', src_name)
         dst_name = re.compile('/+').sub('/', dst_name)
 
-        OUT.debug('Creating File', 7)
+        if OUT.debug_enabled:
+            OUT.debug('Creating File', 7)
 
         # this is our default file type
         #
@@ -375,14 +418,14 @@ class WebappAdd:
             if self.__link_type == 'soft':
                 try:
 
-                    OUT.debug('Trying to softlink', 8)
+                    if OUT.debug_enabled:
+                        OUT.debug('Trying to softlink', 8)
 
                     if not self.__p:
-                        if self.__v:
-                            print("\n>>> SOFTLINKING FILE: ")
-                            print(">>> Source: " + src_name +
-                                  "\n>>> Destination: " + dst_name + "\n")
-                        os.symlink(src_name, dst_name)
+                        self.report('SOFTLINKING FILE', src_name, dst_name)
+                        EVENTS.run('symlink', dst_name, file_type,
+                                   os.symlink, src_name, dst_name)
+                        METRICS.add('symlinks_created')
 
                     my_contenttype = 'sym'
 
@@ -394,14 +437,14 @@ class WebappAdd:
             elif self.__link_type == 'copy':
                 try:
 
-                    OUT.debug('Trying to copy files directly', 8)
+                    if OUT.debug_enabled:
+                        OUT.debug('Trying to copy files directly', 8)
 
                     if not self.__p:
-                        if self.__v:
-                            print("\n>>> COPYING FILE: ")
-                            print(">>> Source: " + src_name +
-                                  "\n>>> Destination: " + dst_name + "\n")
-                        shutil.copy(src_name, dst_name)
+                        self.report('COPYING FILE', src_name, dst_name)
+                        EVENTS.run('copy', dst_name, file_type,
+                                   shutil.copy, src_name, dst_name)
+                        METRICS.add('files_copied')
 
                     my_contenttype = 'file'
 
@@ -413,14 +456,14 @@ class WebappAdd:
             elif os.path.islink(src_name):
                 try:
 
-                    OUT.debug('Trying to copy symlink', 8)
+                    if OUT.debug_enabled:
+                        OUT.debug('Trying to copy symlink', 8)
 
                     if not self.__p:
-                        if self.__v:
-                            print("\n>>> SYMLINK COPY: ")
-                            print(">>> Source: " + src_name +
-                                  "\n>>> Destination: " + dst_name + "\n")
-                        os.symlink(os.readlink(src_name), dst_name)
+                        self.report('SYMLINK COPY', src_name, dst_name)
+                        EVENTS.run('symlink', dst_name, file_type,
+                                   os.symlink, os.readlink(src_name), dst_name)
+                        METRICS.add('symlinks_created')
 
                     my_contenttype = 'sym'
 
@@ -432,14 +475,14 @@ class WebappAdd:
             else:
                 try:
 
-                    OUT.debug('Trying to hardlink', 8)
+                    if OUT.debug_enabled:
+                        OUT.debug('Trying to hardlink', 8)
 
                     if not self.__p:
-                        if self.__v:
-                            print("\n>>> HARDLINKING FILE: ")
-                            print(">>> Source: " + src_name +
-                                  "\n>>> Destination: " + dst_name + "\n")
-                        os.link(src_name, dst_name)
+                        self.report('HARDLINKING FILE', src_name, dst_name)
+                        EVENTS.run('link', dst_name, file_type,
+                                   os.link, src_name, dst_name)
+                        METRICS.add('files_linked')
 
                     my_contenttype = 'file'
 
@@ -451,28 +494,37 @@ class WebappAdd:
         if not my_contenttype:
 
             if not self.__p:
-                if self.__v:
-                    print("\n>>> COPYING FILE: ")
-                    print(">>> Source: " + src_name +
-                          "\n>>> Destination: " + dst_name + "\n")
-                shutil.copy(src_name, dst_name)
+                self.report('COPYING FILE', src_name, dst_name)
+                EVENTS.run('copy', dst_name, file_type,
+                           shutil.copy, src_name, dst_name)
+                METRICS.add('files_copied')
             my_contenttype = 'file'
 
 
         if not self.__p and not os.path.islink(src_name):
 
             old_perm =  os.stat(src_name)[stat.ST_MODE] & 511
+            METRICS.add('stat_calls')
 
-            os.chown(dst_name,
-                     user,
-                     group)
+            EVENTS.run('chown', dst_name, file_type,
+                       os.chown, dst_name,
+                       user,
+                       group)
 
-            os.chmod(dst_name,
-                     perm(old_perm))
+            EVENTS.run('chmod', dst_name, file_type,
+                       os.chmod, dst_name,
+                       perm(old_perm))
+
+        # Hardlinked and copied files share the content of the source
+        # so the checksum from the manifest can be used
+        checksum = None
+        if my_contenttype == 'file':
+            checksum = self.__ws.checksum(self.__sourced + '/' + filename)
 
         self.__content.add(my_contenttype,
                            file_type,
                            self.__destd,
                            filename,
                            dst_name,
-                           self.__relative)
+                           self.__relative,
+                           checksum)
@@ -24,11 +24,11 @@ to use the tool on other distributions.
 # Dependencies
 # ------------------------------------------------------------------------
 
-import os
-
-from WebappConfig.debug       import OUT
+import os, os.path, re, json
 
 from WebappConfig.debug   import OUT
+from WebappConfig.eprefix import EPREFIX
+from WebappConfig.profiler import PROFILE
 from WebappConfig.version import WCVERSION
 
 # ========================================================================
@@ -41,15 +41,291 @@ update_command  = 'etc-update'
 # Link for bug reporting
 bugs_link  = 'http://bugs.gentoo.org/'
 
+# ========================================================================
+# Portage settings
+# ------------------------------------------------------------------------
+
+# Importing portage and initializing its settings is by far the most
+# expensive part of starting webapp-config. The few settings we need
+# are therefore cached together with the state of the files they are
+# derived from. Portage is only imported if that state changed.
+
+# Bump this whenever the layout of the settings cache changes
+SETTINGS_CACHE_VERSION = 1
+
+# Where settings and package index are cached. Empty disables caching.
+cachedir       = EPREFIX + '/var/cache/webapp-config'
+settings_cache = cachedir + '/portage-settings.json'
+
+# The settings we take from portage
+SETTINGS = ['ROOT', 'CONFIG_PROTECT']
+
+# Environment variables that influence these settings
+SETTINGS_ENV = ['ROOT', 'PORTAGE_CONFIGROOT', 'CONFIG_PROTECT']
+
+# The files of a profile directory that influence these settings
+PROFILE_FILES = ['make.defaults', 'parent']
+
+# Matches variable assignments in make.conf style files
+ASSIGNMENT = re.compile(r'^[ \t]*(?:export[ \t]+)?([A-Za-z_][A-Za-z0-9_]*)='
+                        r'(?:"((?:[^"\\]|\\.)*)"|\'([^\']*)\'|([^\s#]*))',
+                        re.M | re.S)
+
+# Matches variable references
+REFERENCE  = re.compile(r'\$\{([A-Za-z_][A-Za-z0-9_]*)\}|'
+                        r'\$([A-Za-z_][A-Za-z0-9_]*)')
+
+# Settings resolved during this run
+_settings = {}
+
+def settings_files():
+    '''
+    Returns the files the settings are derived from in the order they
+    are applied.
+    '''
+    configroot = os.environ.get('PORTAGE_CONFIGROOT', EPREFIX + '/')
+    return [EPREFIX + '/usr/share/portage/config/make.globals',
+            EPREFIX + '/etc/profile.env',
+            configroot + '/etc/make.conf',
+            configroot + '/etc/portage/make.conf',
+            configroot + '/etc/portage/make.profile']
+
+def profile_dirs(profile):
+    '''
+    Returns the directories of the profile and of all the profiles it
+    inherits from (as listed in the "parent" files) in the order portage
+    stacks them: the parents of a profile precede it. Parents given as
+    "repository:path" cannot be resolved without portage; they are
+    covered by the "parent" file naming them.
+    '''
+    result = []
+
+    def add(directory, children):
+        if directory in result or directory in children:
+            return
+
+        try:
+            f = open(directory + '/parent')
+            lines = f.read().split('\n')
+            f.close()
+        except (IOError, OSError):
+            lines = []
+
+        for i in lines:
+            i = i.strip()
+            if i and not i.startswith('#') and not ':' in i:
+                add(os.path.realpath(os.path.join(directory, i)),
+                    children + [directory])
+
+        result.append(directory)
+
+    add(os.path.realpath(profile), [])
+
+    return result
+
+def settings_key():
+    '''
+    Returns the values identifying the current state of the settings
+    sources: the relevant environment variables as well as name,
+    modification time and size of the settings files (and of the
+    files within make.conf directories). The profile is identified by
+    its location and the make.defaults and parent files of the
+    profile and all its parents.
+    '''
+    key = [[i, os.environ.get(i)] for i in SETTINGS_ENV]
+
+    for i in settings_files():
+        if i.endswith('make.profile'):
+            key.append([i, os.path.realpath(i)])
+            names = [j + '/' + k for j in profile_dirs(i)
+                     for k in PROFILE_FILES]
+        else:
+            names = [i]
+            if os.path.isdir(i):
+                names += sorted([i + '/' + j for j in os.listdir(i)])
+
+        for j in names:
+            try:
+                st = os.stat(j)
+                key.append([j, st.st_mtime, st.st_size])
+            except OSError:
+                key.append([j, None])
+
+    return key
+
+def read_make_conf(filename, values):
+    '''
+    Read the variable assignments of a make.conf style file into
+    values. Only simple assignments and variable references are
+    understood, which is all we need for ROOT and CONFIG_PROTECT.
+    Returns the assignments found in the file.
+    '''
+    found = {}
+
+    names = [filename]
+    if os.path.isdir(filename):
+        names = sorted([filename + '/' + i for i in os.listdir(filename)])
+
+    for name in names:
+        try:
+            f = open(name)
+            data = f.read()
+            f.close()
+        except (IOError, OSError):
+            continue
+
+        for m in ASSIGNMENT.finditer(data):
+            if m.group(3) is not None:
+                value = m.group(3)
+            else:
+                value = m.group(2)
+                if value is None:
+                    value = m.group(4)
+                value = REFERENCE.sub(lambda r: values.get(r.group(1) or
+                                                           r.group(2), ''),
+                                      value.replace('\\\n', ' '))
+            found[m.group(1)] = value
+            values[m.group(1)] = value
+
+    return found
+
+def incremental(old, new):
+    '''
+    Stack incremental values just like portage does: "-*" removes all
+    previous entries, "-x" removes "x".
+
+    >>> incremental('/etc /usr/share/config', '-/etc /var/www')
+    '/usr/share/config /var/www'
+    >>> incremental('/etc', '-* /srv')
+    '/srv'
+    '''
+    result = old.split()
+    for i in new.split():
+        if i == '-*':
+            result = []
+        elif i[0] == '-':
+            result = [j for j in result if j != i[1:]]
+        elif not i in result:
+            result.append(i)
+    return ' '.join(result)
+
+def parse_settings():
+    '''
+    Determine the settings from the environment and the make.conf style
+    files without portage. The make.defaults files of the profile are
+    stacked on top of make.globals. Only used if portage is not available.
+    '''
+    values  = {}
+    protect = ''
+    root    = ''
+    names   = []
+
+    for i in settings_files():
+        if i.endswith('make.profile'):
+            names[1:1] = [j + '/make.defaults' for j in profile_dirs(i)]
+        else:
+            names.append(i)
+
+    for i in names:
+        found = read_make_conf(i, values)
+        if 'ROOT' in found:
+            root = found['ROOT']
+        if 'CONFIG_PROTECT' in found:
+            protect = incremental(protect, found['CONFIG_PROTECT'])
+
+    if 'CONFIG_PROTECT' in os.environ:
+        protect = incremental(protect, os.environ['CONFIG_PROTECT'])
+
+    return {'ROOT'           : root,
+            'CONFIG_PROTECT' : protect}
+
+def read_settings_cache(key):
+    ''' Return the cached settings if they are still valid.'''
+    if not settings_cache or not os.path.isfile(settings_cache):
+        return None
+
+    try:
+        f = open(settings_cache)
+        data = json.load(f)
+        f.close()
+    except (IOError, OSError, ValueError):
+        OUT.debug('Ignoring broken settings cache.', 7)
+        return None
+
+    if (not isinstance(data, dict) or
+        data.get('version') != SETTINGS_CACHE_VERSION or
+        data.get('key') != key):
+        return None
+
+    return data.get('settings')
+
+def write_settings_cache(key, settings):
+    ''' Store the settings. Failing to do so is not an error.'''
+    if not settings_cache:
+        return
+
+    try:
+        if not os.path.isdir(os.path.dirname(settings_cache)):
+            os.makedirs(os.path.dirname(settings_cache), 0o755)
+
+        tmp = settings_cache + '.' + str(os.getpid())
+        f = open(tmp, 'w')
+        json.dump({'version'  : SETTINGS_CACHE_VERSION,
+                   'key'      : key,
+                   'settings' : settings}, f)
+        f.close()
+        os.rename(tmp, settings_cache)
+    except (IOError, OSError):
+        OUT.debug('Unable to write settings cache', 7)
+
+def portage_setting(name):
+    '''
+    Return one of the SETTINGS as portage would. The settings are
+    resolved only once per run and are taken from the cache as long as
+    environment and settings files did not change.
+    '''
+    if not _settings:
+
+        key      = settings_key()
+        settings = read_settings_cache(key)
+
+        if settings is None:
+            try:
+                with PROFILE.phase('portage'):
+                    import portage
+
+                    OUT.debug('Reading settings from portage', 7)
+
+                    settings = dict([(i, portage.settings[i])
+                                     for i in SETTINGS])
+
+                # Only what portage determined is worth caching
+                write_settings_cache(key, settings)
+
+            except ImportError:
+
+                OUT.debug('Portage not available, parsing make.conf', 7)
+
+                settings = parse_settings()
+
+        # ROOT is taken from the environment by portage
+        if os.environ.get('ROOT'):
+            settings['ROOT'] = os.environ['ROOT']
+
+        if not settings.get('ROOT'):
+            settings['ROOT'] = '/'
+
+        if settings['ROOT'][-1] != '/':
+            settings['ROOT'] += '/'
+
+        _settings.update(settings)
+
+    return _settings[name]
+
 def config_protect(cat, pn, pvr, pm):
     '''Return CONFIG_PROTECT (used by protect.py)'''
     if pm == "portage":
-        try:
-            import portage
-        except ImportError as e:
-            OUT.die("Portage libraries not found, quitting:\n%s" % e)
-
-        return portage.settings['CONFIG_PROTECT']
+        return portage_setting('CONFIG_PROTECT')
 
     elif pm == "paludis":
         cmd="cave print-id-environment-variable -b --format '%%v\n' --variable-name CONFIG_PROTECT %s/%s" % (cat,pn)
@@ -85,12 +361,7 @@ def want_category(config):
 def get_root(config):
     '''Returns the $ROOT variable'''
     if config.config.get('USER', 'package_manager') == "portage":
-        try:
-            import portage
-        except ImportError as e:
-            OUT.die("Portage libraries not found, quitting:\n%s" % e)
-
-        return portage.settings['ROOT']
+        return portage_setting('ROOT')
 
     elif config.config.get('USER', 'package_manager') == "paludis":
         cat = config.maybe_get('cat')
@@ -114,13 +385,41 @@ def get_root(config):
     else:
         OUT.die("Unknown package manager: " + pm)
 
+# The database of installed packages used during this run
+_vdb = []
+
+def installed_packages(pm = 'portage'):
+    ''' Return the database of installed packages below ${ROOT}.'''
+    if pm == 'portage':
+        root = portage_setting('ROOT')
+    else:
+        # What get_root() returns for paludis without a package
+        root = '/'
+
+    if not _vdb or _vdb[0] != root:
+        from WebappConfig.vdb import VDB
+        _vdb[:] = [root, VDB(root, cachedir = cachedir)]
+    return _vdb[1]
+
 def package_installed(full_name, pm):
     '''
     This function identifies installed packages.
     The Portage part is stolen from gentoolkit.
     We are not using gentoolkit directly as it doesn't seem to support ${ROOT}
+
+    The database of installed packages below ${ROOT} is queried
+    directly. The package manager is only asked if there is no such
+    database or if the atom cannot be handled.
     '''
 
+    vdb = installed_packages(pm)
+
+    if vdb.exists():
+        try:
+            return vdb.match(full_name)
+        except ValueError as e:
+            OUT.debug('Unable to handle ' + full_name + ': ' + str(e), 7)
+
     if pm == "portage":
         try:
             import portage
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - DEBUG
+################################################################################
+# File:       debug.py
+#
+#             Measures the overhead of OUT.debug() per call: disabled,
+#             disabled behind the debug_enabled flag of the Message
+#             instance, enabled but filtered out and enabled with full
+#             output (written to /dev/null). inspect.stack() is measured
+#             for reference as this is what every passing call used to
+#             cost.
+#
+#             Usage: python bench/debug.py [calls]
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Measures the overhead of OUT.debug().'''
+
+import inspect
+import json
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from WebappConfig.debug import Message
+
+class Worker:
+    ''' Calls the debugging functions from a method like mkfile() does.'''
+
+    def __init__(self, out):
+        self.out = out
+
+    def call(self, filename = 'htdocs/index.php'):
+        self.out.debug('Creating file', 6)
+
+    def guarded(self, filename = 'htdocs/index.php'):
+        if self.out.debug_enabled:
+            self.out.debug('Creating file', 6)
+
+    def stack(self, filename = 'htdocs/index.php'):
+        inspect.stack()
+
+def best(function, calls):
+    ''' Return the best time per call in microseconds.'''
+    return min(timeit.repeat(function, number = calls, repeat = 5)) \
+        / calls * 1e6
+
+def main():
+    calls = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+
+    null = open(os.devnull, 'w')
+    out  = Message('bench', err = null, dbg = null)
+    work = Worker(out)
+
+    result = {'calls': calls}
+
+    out.debug_off()
+    result['disabled_us']         = best(work.call, calls)
+    result['disabled_guarded_us'] = best(work.guarded, calls)
+
+    out.debug_on()
+    out.set_debug_level(10)
+    out.set_debug_methods('mkdirs')
+    result['filtered_us']         = best(work.call, calls)
+
+    out.set_debug_methods('*')
+    result['enabled_us']          = best(work.call, calls // 10)
+    result['inspect_stack_us']    = best(work.stack, calls // 10)
+
+    null.close()
+
+    print(json.dumps(result, indent = 2, sort_keys = True))
+
+if __name__ == '__main__':
+    main()
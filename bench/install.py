@@ -0,0 +1,330 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - INSTALL
+################################################################################
+# File:       install.py
+#
+#             Generates a synthetic web application of configurable
+#             shape in a temporary directory and times complete runs of
+#             webapp-config on it: install (-I), upgrade (-U), clean
+#             (-C) with hard links, soft links and copies as well as
+#             --list-installs and --prune-database.
+#
+#             Every run is a separate process, so the times include the
+#             startup just like a run from the command line. Files get
+#             chowned to the web server user: run the benchmark as root
+#             on a system where that user exists.
+#
+#             Usage: python bench/install.py [--files N] [--depth N] ...
+#                    (see --help)
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Times install, upgrade and clean of a synthetic web application.'''
+
+import argparse
+import json
+import os
+import platform
+import pwd
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+HERE = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+sys.path.insert(0, HERE)
+
+from WebappConfig.version import WCVERSION
+
+# The user each server runs as (see WebappConfig/server.py)
+SERVERS = {'apache': 'apache', 'lighttpd': 'lighttpd', 'nginx': 'nginx',
+           'cherokee': 'cherokee', 'gatling': 'gatling'}
+
+LINKS   = {'hard': [], 'soft': ['--soft'], 'copy': ['--copy']}
+
+# Runs webapp-config in a fresh interpreter with the configuration file,
+# the caches and the package database of the benchmark root
+RUN = '''
+import sys
+import WebappConfig.wrapper as wrapper
+from WebappConfig.vdb import VDB
+wrapper.cachedir       = %(cache)r
+wrapper.settings_cache = %(cache)r + '/portage-settings.json'
+wrapper._vdb.append(VDB(%(root)r, cachedir = %(cache)r))
+from WebappConfig.config import Config
+config = Config()
+config._Config__d.update({'my_etcconfig': %(etc)r, 'my_cachedir': %(cache)r})
+sys.argv = ['webapp-config'] + %(args)r
+config.parseparams()
+config.run()
+'''
+
+# ========================================================================
+# Synthetic application
+# ------------------------------------------------------------------------
+
+def directories(rng, count, depth):
+    ''' Return "count" directories forming a tree of the given depth.'''
+    result = [('', 0)]
+    for i in range(count - 1):
+        parent, level = rng.choice([j for j in result[-64:] if j[1] < depth]
+                                   or result[:1])
+        result.append((parent + '/d' + str(i), level + 1))
+    return [i[0] for i in result]
+
+def size(rng, options):
+    ''' A file size, evenly distributed on a logarithmic scale.'''
+    low  = max(options.min_size, 1)
+    high = max(options.max_size, low)
+    result = int(low * (float(high) / low) ** rng.random())
+    # Allow empty files unless a minimum was requested
+    return result - (not options.min_size)
+
+def write(path, length):
+    ''' Create a file of the given length.'''
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+    try:
+        data = b'x' * length
+        while data:
+            data = data[os.write(fd, data):]
+    finally:
+        os.close(fd)
+
+def generate(appdir, options, previous = None):
+    '''
+    Create one version of the application. A following version shares
+    most files with the previous one (as hard links) and differs in
+    the changed, added and removed files.
+    '''
+    rng    = random.Random(options.seed + (previous is not None))
+    htdocs = appdir + '/htdocs'
+
+    dirs   = directories(random.Random(options.seed),
+                         max(options.files // options.per_dir, 1),
+                         options.depth)
+    for i in dirs:
+        os.makedirs(htdocs + i)
+
+    names = []
+    for i in range(options.files):
+        names.append(dirs[i % len(dirs)] + '/f' + str(i) + '.php')
+
+    if previous:
+        # Drop and add one percent of the files
+        drop  = set(rng.sample(range(len(names)), len(names) // 100))
+        names = [j for i, j in enumerate(names) if not i in drop]
+        names += [dirs[i % len(dirs)] + '/n' + str(i) + '.php'
+                  for i in range(options.files // 100)]
+
+    config = []
+    server = []
+    links  = 0
+
+    for name in names:
+        path = htdocs + name
+        pick = rng.random()
+
+        if previous and pick >= 0.1 and os.path.exists(previous + name):
+            os.link(previous + name, path)
+        elif rng.random() < options.symlinks and name != names[0]:
+            os.symlink(os.path.relpath(htdocs + names[0],
+                                       os.path.dirname(path)), path)
+            links += 1
+        else:
+            write(path, size(rng, options))
+
+        pick = rng.random()
+        if pick < options.config:
+            config.append('htdocs' + name)
+        elif pick < options.config + options.server_owned:
+            server.append('htdocs' + name)
+
+    with open(appdir + '/config-files', 'w') as f:
+        f.write(''.join([i + '\n' for i in config]))
+    with open(appdir + '/server-owned-files', 'w') as f:
+        f.write(''.join([i + '\n' for i in server]))
+    open(appdir + '/installed_by_webapp_eclass', 'w').close()
+
+    return {'files'        : len(names),
+            'directories'  : len(dirs),
+            'config_owned' : len(config),
+            'server_owned' : len(server),
+            'symlinks'     : links}
+
+def setup(root, options):
+    ''' Prepare the configuration, the package database and the
+    application.'''
+    os.makedirs(root + '/var/db/pkg/www-servers/' + options.server + '-9999')
+    os.makedirs(root + '/var/db/webapps')
+    os.makedirs(root + '/var/www/localhost/htdocs')
+
+    with open(os.path.join(HERE, 'config', 'webapp-config')) as f:
+        template = f.read()
+    os.makedirs(root + '/etc')
+    with open(root + '/etc/webapp-config', 'w') as f:
+        f.write(template.replace('@GENTOO_PORTAGE_EPREFIX@', ''))
+        f.write('vhost_server="' + options.server + '"\n')
+        f.write('vhost_hostname="localhost"\n')
+        f.write('vhost_root="' + root + '/var/www/${vhost_hostname}"\n')
+        f.write('my_approot="' + root + '/usr/share/webapps"\n')
+        f.write('my_persistroot="' + root + '/var/db/webapps"\n')
+
+    # The layout without category: packageavail() currently refuses
+    # packages with a category
+    approot = root + '/usr/share/webapps/bench'
+    start   = time.time()
+    shape   = generate(approot + '/1.0', options)
+    upgrade = generate(approot + '/1.1', options, approot + '/1.0/htdocs')
+    shape['generate_s'] = time.time() - start
+    shape['upgrade_files'] = upgrade['files']
+
+    return shape
+
+# ========================================================================
+# Runs
+# ------------------------------------------------------------------------
+
+def run(root, args, log):
+    ''' Run webapp-config and return wall and CPU time and peak RSS.'''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = HERE
+
+    script = RUN % {'root' : root,
+                    'cache': root + '/var/cache/webapp-config',
+                    'etc'  : root + '/etc/webapp-config',
+                    'args' : args}
+
+    start = time.time()
+    with open(log, 'a') as f:
+        f.write('\n### webapp-config ' + ' '.join(args) + '\n')
+        f.flush()
+        child = subprocess.Popen([sys.executable, '-c', script], env = env,
+                                 cwd = root, stdout = f, stderr = f)
+        # wait4() provides the resource usage of this very process
+        pid, status, usage = os.wait4(child.pid, 0)
+        child.returncode = status
+    wall  = time.time() - start
+
+    if status:
+        with open(log) as f:
+            sys.stderr.write(''.join(f.readlines()[-20:]))
+        raise Exception('webapp-config ' + ' '.join(args) + ' failed')
+
+    return {'wall_s'     : wall,
+            'user_s'     : usage.ru_utime,
+            'sys_s'      : usage.ru_stime,
+            'maxrss_kib' : usage.ru_maxrss}
+
+def sequence(root, options, log):
+    ''' Run all operations once.'''
+    results = []
+
+    def measure(operation, link, args):
+        result = run(root, args, log)
+        result.update({'operation': operation, 'link': link})
+        results.append(result)
+
+    for link in options.links:
+        where = ['-h', 'localhost', '-d', '/bench-' + link] + LINKS[link]
+        measure('install', link, ['-I', 'bench', '1.0'] + where)
+        measure('upgrade', link, ['-U', 'bench', '1.1'] + where)
+
+    measure('list-installs', None, ['--list-installs'])
+    measure('prune-database', None, ['--prune-database', 'pretend'])
+
+    for link in options.links:
+        where = ['-h', 'localhost', '-d', '/bench-' + link] + LINKS[link]
+        measure('clean', link, ['-C', 'bench', '1.1'] + where)
+
+    return results
+
+def summarize(rounds):
+    ''' The best time of every operation across the rounds.'''
+    best = {}
+    for results in rounds:
+        for result in results:
+            key = (result['operation'], result['link'])
+            if not key in best or result['wall_s'] < best[key]['wall_s']:
+                best[key] = result
+    return [best[i] for i in sorted(best, key = lambda k: (k[0], k[1] or ''))]
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Times webapp-config on a synthetic application.')
+    parser.add_argument('--files', type = int, default = 1000,
+                        help = 'number of files (default 1000)')
+    parser.add_argument('--depth', type = int, default = 4,
+                        help = 'maximum directory depth (default 4)')
+    parser.add_argument('--per-dir', type = int, default = 50,
+                        help = 'average files per directory (default 50)')
+    parser.add_argument('--min-size', type = int, default = 0,
+                        help = 'smallest file in bytes (default 0)')
+    parser.add_argument('--max-size', type = int, default = 65536,
+                        help = 'largest file in bytes (default 65536)')
+    parser.add_argument('--config', type = float, default = 0.02,
+                        help = 'fraction of config-owned files')
+    parser.add_argument('--server', type = float, default = 0.02,
+                        dest = 'server_owned',
+                        help = 'fraction of server-owned files')
+    parser.add_argument('--symlinks', type = float, default = 0.01,
+                        help = 'fraction of symbolic links')
+    parser.add_argument('--links', default = 'hard,soft,copy',
+                        help = 'link types to measure (default all)')
+    parser.add_argument('--web-server', default = 'apache', dest = 'server',
+                        choices = sorted(SERVERS),
+                        help = 'web server to install for (default apache)')
+    parser.add_argument('--rounds', type = int, default = 1,
+                        help = 'repetitions, the best time is kept')
+    parser.add_argument('--seed', type = int, default = 1)
+    parser.add_argument('--keep', action = 'store_true',
+                        help = 'keep the files and the log for inspection')
+    parser.add_argument('--output', help = 'write the JSON to a file')
+
+    options = parser.parse_args()
+    options.links = options.links.split(',')
+
+    try:
+        pwd.getpwnam(SERVERS[options.server])
+    except KeyError:
+        sys.exit('The user "' + SERVERS[options.server] + '" does not exist.')
+
+    root = tempfile.mkdtemp(prefix = 'webapp-bench-')
+    log  = root + '/webapp-config.log'
+
+    try:
+        shape  = setup(root, options)
+        rounds = []
+        for i in range(options.rounds):
+            rounds.append(sequence(root, options, log))
+
+        result = {'webapp_config' : WCVERSION,
+                  'python'        : platform.python_version(),
+                  'parameters'    : dict((k, v) for k, v in
+                                         vars(options).items()
+                                         if k not in ['keep', 'output']),
+                  'shape'         : shape,
+                  'rounds'        : options.rounds,
+                  'results'       : summarize(rounds)}
+    finally:
+        if options.keep:
+            print('Kept ' + root, file = sys.stderr)
+        else:
+            shutil.rmtree(root)
+
+    output = json.dumps(result, indent = 2, sort_keys = True)
+    if options.output:
+        with open(options.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - MICRO
+################################################################################
+# File:       micro.py
+#
+#             Measures the primitives that run once per file or directory
+#             of an application at several input sizes:
+#
+#               PermissionMap.__call__, FileType.filetype/dirtype,
+#               Contents.read/add/write/get_sorted_files,
+#               compat.create_md5, Protection.get_protectedname,
+#               DotConfig.read and Message.debug (disabled)
+#
+#             For every benchmark and size the best of several rounds
+#             is reported together with the cost of a single call, so
+#             the scaling of each primitive can be compared between
+#             releases.
+#
+#             Usage: python bench/micro.py [--sizes 100,1000,10000]
+#                                          [--rounds N] [--only NAME,...]
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Measures the per-entry primitives of webapp-config.'''
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from WebappConfig.compat      import create_md5
+from WebappConfig.content     import Contents
+from WebappConfig.debug       import Message, OUT
+from WebappConfig.dotconfig   import DotConfig
+from WebappConfig.filetype    import FileType
+from WebappConfig.permissions import PermissionMap
+from WebappConfig.protect     import Protection
+from WebappConfig.version     import WCVERSION
+
+# ========================================================================
+# Inputs
+# ------------------------------------------------------------------------
+
+def paths(size):
+    ''' "size" file names spread over directories of 50 files.'''
+    return ['htdocs/d%d/s%d/f%d.php' % (i // 500, i // 50, i)
+            for i in range(size)]
+
+def make_files(directory, size):
+    ''' Create "size" small files and return their relative names.'''
+    names = paths(size)
+    for name in names:
+        path = directory + '/' + name
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, 'w') as f:
+            f.write('<?php echo "' + name + '"; ?>\n')
+    return names
+
+# ========================================================================
+# Benchmarks
+# ------------------------------------------------------------------------
+
+# Each benchmark prepares its input in a scratch directory and returns
+# a function doing the work together with the number of calls that one
+# run of the function performs. The size is the number of entries
+# unless "unit" says otherwise.
+
+def permission_map(size, tmpdir):
+    perm  = PermissionMap('u=rw,g=r,o=')
+    modes = [0o644, 0o755, 0o600, 0o775] * (size // 4 + 1)
+    modes = modes[:size]
+    def run():
+        for i in modes:
+            perm(i)
+    return run, size
+
+def filetype_init(size, tmpdir):
+    names  = paths(size)
+    config = names[::20] + ['htdocs/d0/*.ini']
+    server = names[1::20] + ['htdocs/d0/s1/**']
+    def run():
+        FileType(config, server)
+    return run, 1
+
+def filetype_lookup(size, tmpdir):
+    names  = paths(size)
+    types  = FileType(names[::20] + ['htdocs/d0/*.ini'],
+                      names[1::20] + ['htdocs/d0/s1/**'])
+    def run():
+        for i in names:
+            types.filetype(i)
+    return run, size
+
+def dirtype_lookup(size, tmpdir):
+    names  = paths(size)
+    types  = FileType(names[::20], names[1::20] + ['htdocs/d0/s1/**'])
+    dirs   = [os.path.dirname(i) for i in names]
+    def run():
+        for i in dirs:
+            types.dirtype(i)
+    return run, size
+
+def contents(tmpdir):
+    return Contents(tmpdir, package = 'bench', version = '1.0',
+                    verbose = False, pretend = False)
+
+def contents_add(size, tmpdir):
+    names   = make_files(tmpdir, size)
+    content = contents(tmpdir)
+    def run():
+        for i in names:
+            # With the checksum of the manifest, as during an install
+            content.add('file', 'virtual', tmpdir, i, tmpdir + '/' + i,
+                        checksum = 'd41d8cd98f00b204e9800998ecf8427e')
+    return run, size
+
+def filled_contents(size, tmpdir):
+    names   = make_files(tmpdir, size)
+    content = contents(tmpdir)
+    for i in names:
+        content.add('file', 'virtual', tmpdir, i, tmpdir + '/' + i,
+                    checksum = 'd41d8cd98f00b204e9800998ecf8427e')
+    return content
+
+def contents_write(size, tmpdir):
+    content = filled_contents(size, tmpdir)
+    return content.write, size
+
+def contents_read(size, tmpdir):
+    filled_contents(size, tmpdir).write()
+    def run():
+        contents(tmpdir).read()
+    return run, size
+
+def contents_sorted(size, tmpdir):
+    content = filled_contents(size, tmpdir)
+    return content.get_sorted_files, size
+
+def md5(size, tmpdir):
+    name = tmpdir + '/data'
+    with open(name, 'wb') as f:
+        f.write(b'x' * size * 1024)
+    def run():
+        for i in range(20):
+            create_md5(name)
+    return run, 20
+
+def protected_name(size, tmpdir):
+    os.makedirs(tmpdir + '/htdocs')
+    for i in range(size):
+        open(tmpdir + '/htdocs/f%d.php' % i, 'w').close()
+    for i in range(3):
+        open(tmpdir + '/htdocs/._cfg%.4d_f0.php' % i, 'w').close()
+    protect = Protection('', 'bench', '1.0', 'portage')
+    def run():
+        for i in range(20):
+            protect.get_protectedname(tmpdir, 'htdocs/f0.php')
+    return run, 20
+
+def dotconfig_read(size, tmpdir):
+    DotConfig(tmpdir).write('www-apps', 'bench', '1.0', 'localhost',
+                            '/bench', 'root:root')
+    def run():
+        for i in range(size):
+            DotConfig(tmpdir).read()
+    return run, size
+
+def debug_disabled(size, tmpdir):
+    null = open(os.devnull, 'w')
+    out  = Message('bench', err = null, dbg = null)
+    out.debug_off()
+    def run():
+        for i in range(size):
+            out.debug('Creating file', 6)
+    return run, size
+
+# (name, benchmark, unit of the size)
+BENCHMARKS = [
+    ('PermissionMap.__call__',   permission_map,  'entries'),
+    ('FileType.__init__',        filetype_init,   'entries'),
+    ('FileType.filetype',        filetype_lookup, 'entries'),
+    ('FileType.dirtype',         dirtype_lookup,  'entries'),
+    ('Contents.add',             contents_add,    'entries'),
+    ('Contents.write',           contents_write,  'entries'),
+    ('Contents.read',            contents_read,   'entries'),
+    ('Contents.get_sorted_files', contents_sorted, 'entries'),
+    ('compat.create_md5',        md5,             'KiB'),
+    ('Protection.get_protectedname', protected_name, 'directory entries'),
+    ('DotConfig.read',           dotconfig_read,  'calls'),
+    ('Message.debug (disabled)', debug_disabled,  'calls'),
+]
+
+def measure(benchmark, size, rounds):
+    ''' Return the best time of a single run and the calls it made.'''
+    tmpdir = tempfile.mkdtemp()
+    try:
+        function, calls = benchmark(size, tmpdir)
+        best = min(timeit.repeat(function, number = 1, repeat = rounds))
+    finally:
+        shutil.rmtree(tmpdir)
+    return best, calls
+
+def main():
+    parser = argparse.ArgumentParser(
+        description = 'Measures the per-entry primitives of webapp-config.')
+    parser.add_argument('--sizes', default = '100,1000,10000',
+                        help = 'input sizes (default 100,1000,10000)')
+    parser.add_argument('--rounds', type = int, default = 5,
+                        help = 'repetitions, the best time is kept')
+    parser.add_argument('--only',
+                        help = 'comma separated names of the benchmarks')
+    options = parser.parse_args()
+
+    sizes = [int(i) for i in options.sizes.split(',')]
+    only  = options.only and options.only.split(',')
+
+    # Contents.add() reports every entry
+    OUT.info_off()
+
+    results = []
+    for name, benchmark, unit in BENCHMARKS:
+        if only and not name in only:
+            continue
+        for size in sizes:
+            best, calls = measure(benchmark, size, options.rounds)
+            results.append({'name'        : name,
+                            'size'        : size,
+                            'unit'        : unit,
+                            'calls'       : calls,
+                            'best_s'      : best,
+                            'per_call_us' : best / calls * 1e6})
+
+    print(json.dumps({'webapp_config' : WCVERSION,
+                      'python'        : platform.python_version(),
+                      'rounds'        : options.rounds,
+                      'results'       : results},
+                     indent = 2, sort_keys = True))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - SPAWN
+################################################################################
+# File:       spawn.py
+#
+#             Measures the latency of starting a hook script through
+#             Sandbox.start() and waiting for it, once with fork() and
+#             once with posix_spawn(). The measurement is repeated with
+#             a large heap (as in the daemon or in batch runs) and with
+#             many open descriptors since both slow down fork().
+#
+#             Usage: python bench/spawn.py [rounds] [heap MiB]
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Measures the latency of Sandbox.start() with fork and posix_spawn.'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from WebappConfig.sandbox import Sandbox
+
+class Config:
+    ''' Just enough configuration for the sandbox.'''
+
+    class config:
+        @staticmethod
+        def get(section, option):
+            return '/tmp'
+
+def measure(sandbox, rounds):
+    ''' Return the median latency of start() plus waitpid() in ms.'''
+    times = []
+    for i in range(rounds):
+        start = time.time()
+        os.waitpid(sandbox.start('true', {}), 0)
+        times.append((time.time() - start) * 1000)
+    times.sort()
+    return times[len(times) // 2]
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    heap   = int(sys.argv[2]) if len(sys.argv) > 2 else 512
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        # Stands in for /usr/bin/sandbox: runs its argument
+        binary = os.path.join(tmpdir, 'sandbox')
+        with open(binary, 'w') as f:
+            f.write('#!/bin/sh\nexec /bin/sh -c "$1"\n')
+        os.chmod(binary, 0o755)
+
+        sandbox = Sandbox(Config())
+        sandbox.sandbox_binary = binary
+
+        methods = [('fork', False)]
+        if Sandbox.use_posix_spawn:
+            methods.append(('posix_spawn', True))
+
+        result = {'rounds': rounds, 'heap_mib': heap}
+
+        def run(label):
+            for name, posix_spawn in methods:
+                sandbox.use_posix_spawn = posix_spawn
+                result[label + '_' + name + '_ms'] = measure(sandbox, rounds)
+
+        run('small')
+
+        # Touch every page so that fork() has to copy the page tables
+        ballast = bytearray(heap * 1024 * 1024)
+        for i in range(0, len(ballast), 4096):
+            ballast[i] = 1
+        run('heap')
+
+        fds = [os.open(os.devnull, os.O_RDONLY) for i in range(1000)]
+        run('heap_fds')
+        for fd in fds:
+            os.close(fd)
+
+        del ballast
+    finally:
+        shutil.rmtree(tmpdir)
+
+    print(json.dumps(result, indent = 2, sort_keys = True))
+
+if __name__ == '__main__':
+    main()
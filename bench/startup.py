@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - STARTUP
+################################################################################
+# File:       startup.py
+#
+#             Measures the startup of webapp-config: the import time of
+#             the modules (using "python -X importtime") and the time
+#             needed to set up the configuration with a cold and a warm
+#             configuration cache.
+#
+#             Usage: python bench/startup.py [rounds]
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Measures import time and configuration setup of webapp-config.'''
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+HERE = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+# Runs in a fresh interpreter and prints the time from the start of the
+# import until the command line has been parsed.
+SETUP = '''
+import sys, time
+start = time.time()
+from WebappConfig.config import Config
+config = Config()
+config._Config__d.update({'my_etcconfig': %(etc)r, 'my_cachedir': %(cache)r})
+sys.argv = ['webapp-config', '--list-servers']
+config.parseparams()
+print(time.time() - start)
+'''
+
+def python(args, env):
+    ''' Run the python interpreter and return stdout and stderr.'''
+    p = subprocess.Popen([sys.executable] + args, env = env,
+                         stdout = subprocess.PIPE, stderr = subprocess.PIPE,
+                         universal_newlines = True)
+    out, err = p.communicate()
+    if p.returncode:
+        raise Exception(err)
+    return out, err
+
+def importtime(env):
+    ''' Return the cumulative import time of WebappConfig.config and the
+    modules with the largest own import time (in microseconds).'''
+    out, err = python(['-X', 'importtime', '-c', 'import WebappConfig.config'],
+                      env)
+    modules = []
+    total   = 0
+    for line in err.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = [i.strip() for i in
+                                 line[len('import time:'):].split('|')]
+        modules.append((int(own), name))
+        if name == 'WebappConfig.config':
+            total = int(cumulative)
+    modules.sort(reverse = True)
+    return total, [{'module': n, 'self': t} for t, n in modules[:10]]
+
+def setup_time(env, etc, cache, rounds, cold):
+    ''' Return the best time for setting up the configuration.'''
+    best = None
+    for i in range(rounds):
+        if cold and os.path.exists(cache):
+            shutil.rmtree(cache)
+        out, err = python(['-c', SETUP % {'etc': etc, 'cache': cache}], env)
+        took = float(out.strip().splitlines()[-1])
+        if best is None or took < best:
+            best = took
+    return best
+
+def main():
+    rounds = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+
+    env = dict(os.environ)
+    env['PYTHONPATH'] = HERE
+
+    root = tempfile.mkdtemp()
+    try:
+        etc   = os.path.join(root, 'webapp-config')
+        cache = os.path.join(root, 'cache')
+
+        with open(os.path.join(HERE, 'config', 'webapp-config')) as f:
+            template = f.read()
+        with open(etc, 'w') as f:
+            f.write(template.replace('@GENTOO_PORTAGE_EPREFIX@', ''))
+
+        total, modules = importtime(env)
+
+        result = {'rounds'        : rounds,
+                  'import_us'     : total,
+                  'slowest'       : modules,
+                  'setup_cold'    : setup_time(env, etc, cache, rounds, True),
+                  'setup_warm'    : setup_time(env, etc, cache, rounds, False)}
+
+        print(json.dumps(result, indent = 2))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+################################################################################
+# WEBAPP-CONFIG BENCHMARKS - TYPE CACHE
+################################################################################
+# File:       typecache.py
+#
+#             Compares WebappSource.read() with a cold and a warm type
+#             cache for a synthetic application with long type lists.
+#
+#             Usage: python bench/typecache.py [entries] [rounds]
+#
+# Copyright:
+#             Distributed under the terms of the GNU General Public License v2
+#
+
+from __future__ import print_function
+
+'''Compares WebappSource.read() with a cold and a warm type cache.'''
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from WebappConfig.db import WebappSource
+
+def make_app(root, entries):
+    ''' Create an application whose type lists have "entries" lines.'''
+    appdir = os.path.join(root, 'share', 'bench', '1.0')
+    os.makedirs(appdir)
+    open(os.path.join(appdir, 'installed_by_webapp_eclass'), 'w').close()
+
+    with open(os.path.join(appdir, 'server-owned-files'), 'w') as f:
+        for i in range(entries):
+            f.write('htdocs/data/d%d/f%d\n' % (i // 100, i))
+
+    with open(os.path.join(appdir, 'config-files'), 'w') as f:
+        for i in range(entries // 10):
+            f.write('htdocs/conf/c%d.php\n' % i)
+
+def timed(source, rounds):
+    ''' Return the best time for a single read().'''
+    best = None
+    for i in range(rounds):
+        start = time.time()
+        source.read()
+        took = time.time() - start
+        if best is None or took < best:
+            best = took
+    return best
+
+def main():
+    entries = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rounds  = int(sys.argv[2]) if len(sys.argv) > 2 else 5
+
+    root = tempfile.mkdtemp()
+    try:
+        make_app(root, entries)
+
+        cold = WebappSource(root = os.path.join(root, 'share'),
+                            package = 'bench', version = '1.0')
+        warm = WebappSource(root = os.path.join(root, 'share'),
+                            package = 'bench', version = '1.0',
+                            cachedir = os.path.join(root, 'cache'))
+        # Populate the cache
+        warm.read()
+
+        result = {'entries' : entries,
+                  'rounds'  : rounds,
+                  'cold'    : timed(cold, rounds),
+                  'warm'    : timed(warm, rounds)}
+        result['speedup'] = result['cold'] / result['warm']
+
+        print(json.dumps(result, indent = 2))
+    finally:
+        shutil.rmtree(root)
+
+if __name__ == '__main__':
+    main()